@@ -8,11 +8,13 @@ If he sets one of the animation bools (wave, backflip, glasses, goodbye) in the
 that animation will play – and if multiple are true they will play back to back. The default image is taken from the 'nothing' animation."
 """
 
-import sys, os, glob, random, time, tempfile, hashlib, requests, yaml, json
+import sys, os, glob, random, tempfile, hashlib, yaml, json
+from collections import OrderedDict
 from PyQt5 import QtWidgets, QtCore, QtGui
 from PyQt5.QtMultimedia import QMediaPlayer, QMediaContent, QMediaPlaylist
-from PIL import Image
 from anthropic import Anthropic
+from http_session import create_http_session, request_timeout, warm_connections
+from resilience import CircuitBreaker, CircuitOpenError, call_with_retry, run_in_background
 
 # ---------------------------
 # Load YAML Config
@@ -46,13 +48,55 @@ SYSTEM_PROMPT = (
     "The animations will play if the corresponding boolean is set to true. If multiple are true, they'll play back to back."
 )
 
-# Initialize Anthropic client
+# Initialize Anthropic client; retries go through call_with_retry, so the SDK's own are off
 try:
-    anthropic = Anthropic(api_key=CONFIG.get("anthropic_api_key", ""))
+    anthropic = Anthropic(api_key=CONFIG.get("anthropic_api_key", ""), max_retries=0)
 except Exception as e:
     print(f"Error initializing Anthropic client: {e}")
     anthropic = None
 
+# ---------------------------
+# Pooled HTTP Session
+# ---------------------------
+# The TTS calls share one keep-alive session (see http_session.py)
+HTTP_SESSION = create_http_session(CONFIG)
+
+# ---------------------------
+# Resilience: Timeouts, Retries and Circuit Breakers
+# ---------------------------
+BREAKERS = {
+    name: CircuitBreaker(name, CONFIG.get("breaker_failure_threshold", 5), CONFIG.get("breaker_reset_s", 30))
+    for name in ("anthropic", "tts")
+}
+
+def resilient_call(breaker, call):
+    """call() retried and guarded by the breaker; blocks while backing off, so run it with run_in_background"""
+    return call_with_retry(
+        breaker,
+        call,
+        retries=CONFIG.get("http_max_retries", 2),
+        base_s=CONFIG.get("retry_base_delay_s", 0.5),
+        max_s=CONFIG.get("retry_max_delay_s", 4.0),
+    )
+
+def fetch_tts(text, path):
+    """Render text with the TTS API into path; returns path, or None on an error status"""
+    params = {
+        "text": text,
+        "voice": CONFIG["tts_voice"],
+        "pitch": CONFIG["tts_pitch"],
+        "speed": CONFIG["tts_speed"]
+    }
+    response = resilient_call(BREAKERS["tts"], lambda: HTTP_SESSION.get(
+        CONFIG["tts_api_url"], params=params,
+        timeout=request_timeout(HTTP_SESSION, CONFIG, CONFIG.get("tts_timeout_s", 15))))
+    if response.status_code != 200:
+        print("TTS API error", response.status_code, response.text)
+        return None
+    with open(path, "wb") as f:
+        f.write(response.content)
+    return path
+
 # ---------------------------
 # Utility: Cache Filename for a Phrase
 # ---------------------------
@@ -129,8 +173,31 @@ class Animation:
             "talking": sorted(glob.glob("talking/*.png")),
             "curse": sorted(glob.glob("talking/*.png"))  # Reuse talking for curse animation
         }
+        # Decoded frames per animation, least recently used first; idle and talking are never evicted
+        budget_mb = CONFIG.get("frame_cache_budget_mb", 12)
+        self.budget_bytes = int(budget_mb * 1048576) if budget_mb else None
+        self.pinned = {"idle", "talking", "nothing"}
+        self.decoded = OrderedDict()
+        self.resident_bytes = 0
     def get_animation(self, key):
         return self.animations.get(key)
+    def get_pixmaps(self, key):
+        """Decoded frames for key, shared between plays (do not modify the list)"""
+        frames = self.decoded.get(key)
+        if frames is not None:
+            self.decoded.move_to_end(key)
+            return frames
+        frames = [pixmap for pixmap in map(load_image, self.animations.get(key) or []) if not pixmap.isNull()]
+        self.decoded[key] = frames
+        self.resident_bytes += sum(p.width() * p.height() * p.depth() // 8 for p in frames)
+        if self.budget_bytes is not None:
+            for old_key in list(self.decoded):
+                if self.resident_bytes <= self.budget_bytes:
+                    break
+                if old_key in self.pinned or old_key == key:
+                    continue
+                self.resident_bytes -= sum(p.width() * p.height() * p.depth() // 8 for p in self.decoded.pop(old_key))
+        return frames
 
 # ---------------------------
 # Utility Functions
@@ -138,18 +205,61 @@ class Animation:
 def load_image(path):
     return QtGui.QPixmap(path)
 
+FRAME_MANIFEST_PATH = "frame_manifest.json"
+
+def load_frame_manifest():
+    try:
+        with open(FRAME_MANIFEST_PATH, "r") as f:
+            data = json.load(f)
+        if data.get("version") == 1:
+            return data.get("frames", {})
+    except FileNotFoundError:
+        print("No frame manifest; it will be generated")
+    except Exception as e:
+        print("Error reading frame manifest; rebuilding.", e)
+    return {}
+
+def save_frame_manifest(frames):
+    try:
+        with open(FRAME_MANIFEST_PATH + ".tmp", "w") as f:
+            json.dump({"version": 1, "frames": frames}, f, indent=1)
+        os.replace(FRAME_MANIFEST_PATH + ".tmp", FRAME_MANIFEST_PATH)
+    except Exception as e:
+        print("Error saving frame manifest", e)
+
+def frame_size(fp, frames):
+    """Size from the manifest; the file is only opened if its mtime or byte size changed."""
+    st = os.stat(fp)
+    entry = frames.get(fp)
+    if entry and entry["mtime"] == st.st_mtime and entry["bytes"] == st.st_size:
+        return tuple(entry["size"]), False
+    with open(fp, "rb") as f:
+        digest = hashlib.sha1(f.read()).hexdigest()
+    if entry and entry["sha1"] == digest:
+        size = tuple(entry["size"])
+    else:
+        from PIL import Image  # only needed when a frame changed
+        with Image.open(fp) as img:
+            size = img.size
+    frames[fp] = {"size": list(size), "sha1": digest, "mtime": st.st_mtime, "bytes": st.st_size}
+    return size, True
+
 def compute_fixed_size():
     max_w, max_h = 0, 0
+    frames = load_frame_manifest()
+    changed = False
     for anim in ["idle", "arrive", "goodbye", "backflip", "glasses", "wave", "nothing", "talking", "curse"]:
         files = glob.glob(f"{anim}/*.png") if anim != "nothing" else ["idle/0999.png"]
         for fp in files:
             try:
-                with Image.open(fp) as img:
-                    w, h = img.size
-                    max_w = max(max_w, w)
-                    max_h = max(max_h, h)
+                (w, h), updated = frame_size(fp, frames)
+                changed = changed or updated
+                max_w = max(max_w, w)
+                max_h = max(max_h, h)
             except Exception as e:
                 print("Error reading image", fp, e)
+    if changed:
+        save_frame_manifest(frames)
     return max_w, max_h + 50
 
 # ---------------------------
@@ -173,8 +283,8 @@ class BonziBuddy(QtWidgets.QWidget):
         self.label.setAlignment(QtCore.Qt.AlignCenter)
 
         self.animator = Animation(self)
-        nothing_frames = self.animator.get_animation("nothing")
-        self.default_pixmap = load_image(nothing_frames[0]) if nothing_frames else None
+        nothing_frames = self.animator.get_pixmaps("nothing")
+        self.default_pixmap = nothing_frames[0] if nothing_frames else None
         self.current_pixmap = self.default_pixmap
         self.label.setPixmap(self.current_pixmap)
 
@@ -268,22 +378,13 @@ class BonziBuddy(QtWidgets.QWidget):
                         print(f"Error copying curse audio file: {e}")
             else:
                 # Use external TTS API
-                params = {
-                    "text": curse_text,
-                    "voice": CONFIG["tts_voice"],
-                    "pitch": CONFIG["tts_pitch"],
-                    "speed": CONFIG["tts_speed"]
-                }
-                try:
-                    response = requests.get(CONFIG["tts_api_url"], params=params)
-                    if response.status_code == 200:
-                        with open(self.curse_audio_path, "wb") as f:
-                            f.write(response.content)
+                def done(path, error):
+                    if error is not None:
+                        print("Exception generating curse audio:", error)
+                    elif path:
                         print("Generated curse audio.")
-                    else:
-                        print("Error generating curse audio", response.status_code, response.text)
-                except Exception as e:
-                    print("Exception generating curse audio:", e)
+                
+                run_in_background(lambda: fetch_tts(curse_text, self.curse_audio_path), done)
 
     # --- Idle Animation ---
     def update_idle_frame(self):
@@ -292,11 +393,7 @@ class BonziBuddy(QtWidgets.QWidget):
             self.label.setPixmap(self.current_animation_frames[self.current_frame_index])
 
     def start_idle_animation(self):
-        self.current_animation_frames = []
-        idle_files = self.animator.get_animation("idle")
-        if idle_files:
-            for fp in idle_files:
-                self.current_animation_frames.append(load_image(fp))
+        self.current_animation_frames = self.animator.get_pixmaps("idle")
         if not self.current_animation_frames:
             self.current_animation_frames = [self.default_pixmap]
         self.current_frame_index = 0
@@ -304,11 +401,7 @@ class BonziBuddy(QtWidgets.QWidget):
 
     # --- Extra Animations ---
     def play_animation_once(self, anim_key, callback=None):
-        frames = []
-        anim_files = self.animator.get_animation(anim_key)
-        if anim_files:
-            for fp in anim_files:
-                frames.append(load_image(fp))
+        frames = self.animator.get_pixmaps(anim_key)
         if not frames:
             if callback:
                 callback()
@@ -333,11 +426,7 @@ class BonziBuddy(QtWidgets.QWidget):
     def teleport_with_arrive(self):
         if self.dialogue_active:
             return
-        frames = []
-        anim_files = self.animator.get_animation("arrive")
-        if anim_files:
-            for fp in anim_files:
-                frames.append(load_image(fp))
+        frames = self.animator.get_pixmaps("arrive")
         if not frames:
             self.teleport()
             return
@@ -418,9 +507,9 @@ class BonziBuddy(QtWidgets.QWidget):
             self.handle_response(data)
             return
         
-        try:
-            # Use Anthropic for response generation
-            response = anthropic.messages.create(
+        # Use Anthropic for response generation, off the GUI thread
+        def generate():
+            return resilient_call(BREAKERS["anthropic"], lambda: anthropic.messages.create(
                 model=CONFIG.get("model", "claude-3-haiku-20240307"),
                 max_tokens=CONFIG.get("max_tokens", 150),
                 temperature=CONFIG.get("temp", 1.0),
@@ -446,90 +535,98 @@ The dialogue is what Bonzi will say, and the boolean values determine which anim
 """
                     }
                 ]
-            )
-            
-            # Try to extract structured response from Claude
-            try:
-                # Handle case when tool_calls attribute is available
-                if hasattr(response, 'tool_calls') and response.tool_calls and len(response.tool_calls) > 0:
-                    # Get the first tool call
-                    tool_call = response.tool_calls[0]
-                    if tool_call.name == "bonzi_actions":
-                        # Extract the JSON from the tool call
-                        data = json.loads(tool_call.input)
-                        self.handle_response(data)
-                    else:
-                        # Fallback response if tool call is not recognized
-                        self.handle_response({
-                            "dialogue": response.content[0].text,
-                            "wave": False,
-                            "backflip": False,
-                            "glasses": False,
-                            "goodbye": False
-                        })
+            ))
+        
+        run_in_background(generate, self.on_reply)
+    
+    def on_reply(self, response, error):
+        if error is not None:
+            if isinstance(error, CircuitOpenError):
+                print("Anthropic skipped:", error)
+            else:
+                print("Error with Anthropic API:", error)
+            # Fallback response in case of error
+            self.handle_response({
+                "dialogue": "My digital brain just crashed. Must be your boring question that killed my circuits.",
+                "wave": False,
+                "backflip": False,
+                "glasses": True,
+                "goodbye": False
+            })
+            return
+        
+        # Try to extract structured response from Claude
+        try:
+            # Handle case when tool_calls attribute is available
+            if hasattr(response, 'tool_calls') and response.tool_calls and len(response.tool_calls) > 0:
+                # Get the first tool call
+                tool_call = response.tool_calls[0]
+                if tool_call.name == "bonzi_actions":
+                    # Extract the JSON from the tool call
+                    data = json.loads(tool_call.input)
+                    self.handle_response(data)
                 else:
-                    # For newer versions of the Anthropic client, we need to parse the content differently
-                    text = response.content[0].text
-                    print("Claude response:", text)
+                    # Fallback response if tool call is not recognized
+                    self.handle_response({
+                        "dialogue": response.content[0].text,
+                        "wave": False,
+                        "backflip": False,
+                        "glasses": False,
+                        "goodbye": False
+                    })
+            else:
+                # For newer versions of the Anthropic client, we need to parse the content differently
+                text = response.content[0].text
+                print("Claude response:", text)
+                
+                # Let's attempt to extract structured data from plain text
+                try:
+                    # Look for JSON patterns in the text
+                    json_pattern = r'({[\s\S]*"dialogue"[\s\S]*})'
+                    import re
+                    match = re.search(json_pattern, text)
                     
-                    # Let's attempt to extract structured data from plain text
-                    try:
-                        # Look for JSON patterns in the text
-                        json_pattern = r'({[\s\S]*"dialogue"[\s\S]*})'
-                        import re
-                        match = re.search(json_pattern, text)
-                        
-                        if match:
-                            # Try to parse the JSON part
-                            json_str = match.group(1)
-                            data = json.loads(json_str)
-                            if "dialogue" in data:
-                                # Remove the JSON part from the dialogue if it was included
-                                if "dialogue" in data and json_str in data["dialogue"]:
-                                    data["dialogue"] = data["dialogue"].replace(json_str, "").strip()
-                                self.handle_response(data)
-                                return
-                        elif text.strip().startswith('{') and text.strip().endswith('}'):
-                            # Try to parse the entire response as JSON
-                            data = json.loads(text)
-                            if "dialogue" in data:
-                                self.handle_response(data)
-                                return
-                    except json.JSONDecodeError:
-                        pass
-                        
-                    # If we couldn't get structured data, randomly select animations
-                    random_animations = {
-                        "dialogue": text,
-                        "wave": random.random() > 0.7,
-                        "backflip": random.random() > 0.8,
-                        "glasses": random.random() > 0.75,
-                        "goodbye": random.random() > 0.9
-                    }
-                    self.handle_response(random_animations)
-            except Exception as e:
-                print(f"Error parsing response: {e}")
-                # If something went wrong, fall back to just showing the text
-                text = response.content[0].text if hasattr(response, 'content') and response.content else "Sorry, I couldn't understand that."
-                self.handle_response({
+                    if match:
+                        # Try to parse the JSON part
+                        json_str = match.group(1)
+                        data = json.loads(json_str)
+                        if "dialogue" in data:
+                            # Remove the JSON part from the dialogue if it was included
+                            if "dialogue" in data and json_str in data["dialogue"]:
+                                data["dialogue"] = data["dialogue"].replace(json_str, "").strip()
+                            self.handle_response(data)
+                            return
+                    elif text.strip().startswith('{') and text.strip().endswith('}'):
+                        # Try to parse the entire response as JSON
+                        data = json.loads(text)
+                        if "dialogue" in data:
+                            self.handle_response(data)
+                            return
+                except json.JSONDecodeError:
+                    pass
+                    
+                # If we couldn't get structured data, randomly select animations
+                random_animations = {
                     "dialogue": text,
-                    "wave": False,
-                    "backflip": False,
-                    "glasses": False,
-                    "goodbye": False
-                })
-                
+                    "wave": random.random() > 0.7,
+                    "backflip": random.random() > 0.8,
+                    "glasses": random.random() > 0.75,
+                    "goodbye": random.random() > 0.9
+                }
+                self.handle_response(random_animations)
         except Exception as e:
-            print("Error with Anthropic API:", e)
-            # Fallback response in case of error
+            print(f"Error parsing response: {e}")
+            # If something went wrong, fall back to just showing the text
+            text = response.content[0].text if hasattr(response, 'content') and response.content else "Sorry, I couldn't understand that."
             self.handle_response({
-                "dialogue": "My digital brain just crashed. Must be your boring question that killed my circuits.",
+                "dialogue": text,
                 "wave": False,
                 "backflip": False,
-                "glasses": True,
+                "glasses": False,
                 "goodbye": False
             })
 
+
     def handle_response(self, data):
         dialogue = data.get("dialogue", "")
         self.extra_animations = []
@@ -545,11 +642,7 @@ The dialogue is what Bonzi will say, and the boolean values determine which anim
 
     # --- Talking Phase ---
     def start_talking_phase(self, dialogue):
-        self.talking_frames = []
-        talking_files = self.animator.get_animation("talking")
-        if talking_files:
-            for fp in talking_files:
-                self.talking_frames.append(load_image(fp))
+        self.talking_frames = self.animator.get_pixmaps("talking")
         if not self.talking_frames:
             self.talking_frames = [self.default_pixmap]
         self.talking_frame_index = 0
@@ -583,24 +676,15 @@ The dialogue is what Bonzi will say, and the boolean values determine which anim
                         self.on_tts_finished(None, None)
             else:
                 # Use external TTS API
-                params = {
-                    "text": text,
-                    "voice": CONFIG["tts_voice"],
-                    "pitch": CONFIG["tts_pitch"],
-                    "speed": CONFIG["tts_speed"]
-                }
-                try:
-                    response = requests.get(CONFIG["tts_api_url"], params=params)
-                    if response.status_code == 200:
-                        with open(cache_path, "wb") as f:
-                            f.write(response.content)
-                        self.play_tts_audio(cache_path)
+                def done(path, error):
+                    if error is not None:
+                        print("TTS exception", error)
+                    if path:
+                        self.play_tts_audio(path)
                     else:
-                        print("TTS API error", response.status_code, response.text)
                         self.on_tts_finished(None, None)
-                except Exception as e:
-                    print("TTS exception", e)
-                    self.on_tts_finished(None, None)
+                
+                run_in_background(lambda: fetch_tts(text, cache_path), done)
 
     def play_tts_audio(self, path):
         url = QtCore.QUrl.fromLocalFile(os.path.abspath(path))
@@ -674,4 +758,8 @@ if __name__ == "__main__":
     app = QtWidgets.QApplication(sys.argv)
     bonzi = BonziBuddy()
     bonzi.show()
+    if not CONFIG.get("use_system_tts", True):
+        warm_connections(HTTP_SESSION, CONFIG, [CONFIG["tts_api_url"]])
+    app.aboutToQuit.connect(HTTP_SESSION.close)
+    app.aboutToQuit.connect(lambda: print("Circuit breakers:", {name: b.metrics() for name, b in BREAKERS.items()}))
     sys.exit(app.exec_())
\ No newline at end of file
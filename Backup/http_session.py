@@ -0,0 +1,55 @@
+"""
+Pooled HTTP Session for the Backup scripts
+
+infer.py and bonzi_buddy.py each create one keep-alive session at startup
+and send every inference and TTS request through it, so a reply reuses a
+warm connection instead of paying for a fresh TCP+TLS handshake. Every
+function takes the script's CONFIG; the keys are documented in README.md.
+"""
+
+import threading, time
+import requests
+
+try:
+    import httpx
+    HTTPX_AVAILABLE = True
+except ImportError:
+    HTTPX_AVAILABLE = False
+
+def create_http_session(config):
+    """
+    A requests.Session with http_pool_size pooled connections, or an httpx
+    client over HTTP/2 when http2 is set and h2 is installed.
+    """
+    pool_size = config.get("http_pool_size", 4)
+    if config.get("http2", False) and HTTPX_AVAILABLE:
+        try:
+            limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size,
+                                  keepalive_expiry=config.get("http_keepalive_s", 60))
+            return httpx.Client(http2=True, limits=limits)
+        except ImportError as e:
+            print("HTTP/2 unavailable (pip install h2); using requests.", e)
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=2, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def request_timeout(session, config, read_s):
+    """Separate connect and read timeouts in the form the session expects"""
+    connect_s = config.get("http_connect_timeout_s", 5)
+    if HTTPX_AVAILABLE and isinstance(session, httpx.Client):
+        return httpx.Timeout(read_s, connect=connect_s)
+    return (connect_s, read_s)
+
+def warm_connections(session, config, urls):
+    """Open pooled connections in the background so the first reply skips the handshake"""
+    def warm():
+        for url in urls:
+            try:
+                start = time.perf_counter()
+                session.request("HEAD", url, timeout=request_timeout(session, config, 5))
+                print(f"Warmed connection to {url} in {(time.perf_counter() - start) * 1000:.0f} ms")
+            except Exception as e:
+                print("Connection warmup failed", url, e)
+    threading.Thread(target=warm, daemon=True).start()
@@ -8,10 +8,12 @@ If he sets one of the animation bools (wave, backflip, glasses, goodbye) in the
 that animation will play – and if multiple are true they will play back to back. The default image is taken from the 'nothing' animation."
 """
 
-import sys, os, glob, random, time, tempfile, hashlib, requests, yaml
+import sys, os, glob, random, tempfile, hashlib, yaml, json
+from collections import OrderedDict
 from PyQt5 import QtWidgets, QtCore, QtGui
 from PyQt5.QtMultimedia import QMediaPlayer, QMediaContent, QMediaPlaylist
-from PIL import Image
+from http_session import create_http_session, request_timeout, warm_connections
+from resilience import CircuitBreaker, CircuitOpenError, call_with_retry, run_in_background
 
 # ---------------------------
 # Load YAML Config
@@ -44,6 +46,34 @@ SYSTEM_PROMPT = (
     "that animation will play – and if multiple are true they will play back to back. The default image is taken from the 'nothing' animation."
 )
 
+# ---------------------------
+# Pooled HTTP Session
+# ---------------------------
+# The inference and TTS calls share one keep-alive session (see http_session.py)
+HTTP_SESSION = create_http_session(CONFIG)
+
+# ---------------------------
+# Resilience: Timeouts, Retries and Circuit Breakers
+# ---------------------------
+BREAKERS = {
+    name: CircuitBreaker(name, CONFIG.get("breaker_failure_threshold", 5), CONFIG.get("breaker_reset_s", 30))
+    for name in ("inference", "tts")
+}
+
+def http_call(breaker, method, url, timeout, **kwargs):
+    """
+    Send a request on the pooled session with a timeout, retried and
+    guarded by the breaker (see resilience.call_with_retry). Blocks while
+    backing off, so the GUI only calls it through run_in_background.
+    """
+    return call_with_retry(
+        breaker,
+        lambda: HTTP_SESSION.request(method, url, timeout=request_timeout(HTTP_SESSION, CONFIG, timeout), **kwargs),
+        retries=CONFIG.get("http_max_retries", 2),
+        base_s=CONFIG.get("retry_base_delay_s", 0.5),
+        max_s=CONFIG.get("retry_max_delay_s", 4.0),
+    )
+
 # ---------------------------
 # Utility: Cache Filename for a Phrase
 # ---------------------------
@@ -91,8 +121,31 @@ class Animation:
             "talking": sorted(glob.glob("talking/*.png")),
             "curse": sorted(glob.glob("curse/*.png"))
         }
+        # Decoded frames per animation, least recently used first; idle and talking are never evicted
+        budget_mb = CONFIG.get("frame_cache_budget_mb", 12)
+        self.budget_bytes = int(budget_mb * 1048576) if budget_mb else None
+        self.pinned = {"idle", "talking", "nothing"}
+        self.decoded = OrderedDict()
+        self.resident_bytes = 0
     def get_animation(self, key):
         return self.animations.get(key)
+    def get_pixmaps(self, key):
+        """Decoded frames for key, shared between plays (do not modify the list)"""
+        frames = self.decoded.get(key)
+        if frames is not None:
+            self.decoded.move_to_end(key)
+            return frames
+        frames = [pixmap for pixmap in map(load_image, self.animations.get(key) or []) if not pixmap.isNull()]
+        self.decoded[key] = frames
+        self.resident_bytes += sum(p.width() * p.height() * p.depth() // 8 for p in frames)
+        if self.budget_bytes is not None:
+            for old_key in list(self.decoded):
+                if self.resident_bytes <= self.budget_bytes:
+                    break
+                if old_key in self.pinned or old_key == key:
+                    continue
+                self.resident_bytes -= sum(p.width() * p.height() * p.depth() // 8 for p in self.decoded.pop(old_key))
+        return frames
 
 # ---------------------------
 # Utility Functions
@@ -100,18 +153,61 @@ class Animation:
 def load_image(path):
     return QtGui.QPixmap(path)
 
+FRAME_MANIFEST_PATH = "frame_manifest.json"
+
+def load_frame_manifest():
+    try:
+        with open(FRAME_MANIFEST_PATH, "r") as f:
+            data = json.load(f)
+        if data.get("version") == 1:
+            return data.get("frames", {})
+    except FileNotFoundError:
+        print("No frame manifest; it will be generated")
+    except Exception as e:
+        print("Error reading frame manifest; rebuilding.", e)
+    return {}
+
+def save_frame_manifest(frames):
+    try:
+        with open(FRAME_MANIFEST_PATH + ".tmp", "w") as f:
+            json.dump({"version": 1, "frames": frames}, f, indent=1)
+        os.replace(FRAME_MANIFEST_PATH + ".tmp", FRAME_MANIFEST_PATH)
+    except Exception as e:
+        print("Error saving frame manifest", e)
+
+def frame_size(fp, frames):
+    """Size from the manifest; the file is only opened if its mtime or byte size changed."""
+    st = os.stat(fp)
+    entry = frames.get(fp)
+    if entry and entry["mtime"] == st.st_mtime and entry["bytes"] == st.st_size:
+        return tuple(entry["size"]), False
+    with open(fp, "rb") as f:
+        digest = hashlib.sha1(f.read()).hexdigest()
+    if entry and entry["sha1"] == digest:
+        size = tuple(entry["size"])
+    else:
+        from PIL import Image  # only needed when a frame changed
+        with Image.open(fp) as img:
+            size = img.size
+    frames[fp] = {"size": list(size), "sha1": digest, "mtime": st.st_mtime, "bytes": st.st_size}
+    return size, True
+
 def compute_fixed_size():
     max_w, max_h = 0, 0
+    frames = load_frame_manifest()
+    changed = False
     for anim in ["idle", "arrive", "goodbye", "backflip", "glasses", "wave", "nothing", "talking", "curse"]:
         files = glob.glob(f"{anim}/*.png") if anim != "nothing" else ["idle/0999.png"]
         for fp in files:
             try:
-                with Image.open(fp) as img:
-                    w, h = img.size
-                    max_w = max(max_w, w)
-                    max_h = max(max_h, h)
+                (w, h), updated = frame_size(fp, frames)
+                changed = changed or updated
+                max_w = max(max_w, w)
+                max_h = max(max_h, h)
             except Exception as e:
                 print("Error reading image", fp, e)
+    if changed:
+        save_frame_manifest(frames)
     return max_w, max_h + 50
 
 # ---------------------------
@@ -135,8 +231,8 @@ class BonziBuddy(QtWidgets.QWidget):
         self.label.setAlignment(QtCore.Qt.AlignCenter)
 
         self.animator = Animation(self)
-        nothing_frames = self.animator.get_animation("nothing")
-        self.default_pixmap = load_image(nothing_frames[0]) if nothing_frames else None
+        nothing_frames = self.animator.get_pixmaps("nothing")
+        self.default_pixmap = nothing_frames[0] if nothing_frames else None
         self.current_pixmap = self.default_pixmap
         self.label.setPixmap(self.current_pixmap)
 
@@ -220,16 +316,21 @@ class BonziBuddy(QtWidgets.QWidget):
                 "pitch": CONFIG["tts_pitch"],
                 "speed": CONFIG["tts_speed"]
             }
-            try:
-                response = requests.get(CONFIG["tts_api_url"], params=params)
+            def generate():
+                response = http_call(BREAKERS["tts"], "get", CONFIG["tts_api_url"],
+                                     timeout=CONFIG.get("tts_timeout_s", 15), params=params)
                 if response.status_code == 200:
                     with open(self.curse_audio_path, "wb") as f:
                         f.write(response.content)
                     print("Generated curse audio.")
                 else:
                     print("Error generating curse audio", response.status_code, response.text)
-            except Exception as e:
-                print("Exception generating curse audio:", e)
+
+            def done(result, error):
+                if error is not None:
+                    print("Exception generating curse audio:", error)
+
+            run_in_background(generate, done)
 
     # --- Idle Animation ---
     def update_idle_frame(self):
@@ -238,11 +339,7 @@ class BonziBuddy(QtWidgets.QWidget):
             self.label.setPixmap(self.current_animation_frames[self.current_frame_index])
 
     def start_idle_animation(self):
-        self.current_animation_frames = []
-        idle_files = self.animator.get_animation("idle")
-        if idle_files:
-            for fp in idle_files:
-                self.current_animation_frames.append(load_image(fp))
+        self.current_animation_frames = self.animator.get_pixmaps("idle")
         if not self.current_animation_frames:
             self.current_animation_frames = [self.default_pixmap]
         self.current_frame_index = 0
@@ -250,11 +347,7 @@ class BonziBuddy(QtWidgets.QWidget):
 
     # --- Extra Animations ---
     def play_animation_once(self, anim_key, callback=None):
-        frames = []
-        anim_files = self.animator.get_animation(anim_key)
-        if anim_files:
-            for fp in anim_files:
-                frames.append(load_image(fp))
+        frames = self.animator.get_pixmaps(anim_key)
         if not frames:
             if callback:
                 callback()
@@ -279,11 +372,7 @@ class BonziBuddy(QtWidgets.QWidget):
     def teleport_with_arrive(self):
         if self.dialogue_active:
             return
-        frames = []
-        anim_files = self.animator.get_animation("arrive")
-        if anim_files:
-            for fp in anim_files:
-                frames.append(load_image(fp))
+        frames = self.animator.get_pixmaps("arrive")
         if not frames:
             self.teleport()
             return
@@ -377,15 +466,22 @@ class BonziBuddy(QtWidgets.QWidget):
                 "temp": CONFIG["temp"]
             }
         }
-        try:
-            response = requests.post(CONFIG["inference_api_url"], json=payload)
+        def infer():
+            response = http_call(BREAKERS["inference"], "post", CONFIG["inference_api_url"],
+                                 timeout=CONFIG.get("inference_timeout_s", 20), json=payload)
             if response.status_code == 200:
-                data = response.json()
-            else:
-                print("Inference API error", response.status_code, response.text)
-                data = {"dialogue": "Ugh, my brain's fried.", "wave": False, "backflip": False, "glasses": False, "goodbye": False}
-        except Exception as e:
-            print("Inference exception", e)
+                return response.json()
+            print("Inference API error", response.status_code, response.text)
+            return {"dialogue": "Ugh, my brain's fried.", "wave": False, "backflip": False, "glasses": False, "goodbye": False}
+
+        run_in_background(infer, self.on_inference_done)
+
+    def on_inference_done(self, data, error):
+        if isinstance(error, CircuitOpenError):
+            print("Inference skipped:", error)
+            data = {"dialogue": "Ugh, my brain's fried.", "wave": False, "backflip": False, "glasses": False, "goodbye": False}
+        elif error is not None:
+            print("Inference exception", error)
             data = {"dialogue": "Something went wrong in my head.", "wave": False, "backflip": False, "glasses": False, "goodbye": False}
         self.handle_response(data)
 
@@ -404,11 +500,7 @@ class BonziBuddy(QtWidgets.QWidget):
 
     # --- Talking Phase ---
     def start_talking_phase(self, dialogue):
-        self.talking_frames = []
-        talking_files = self.animator.get_animation("talking")
-        if talking_files:
-            for fp in talking_files:
-                self.talking_frames.append(load_image(fp))
+        self.talking_frames = self.animator.get_pixmaps("talking")
         if not self.talking_frames:
             self.talking_frames = [self.default_pixmap]
         self.talking_frame_index = 0
@@ -432,16 +524,23 @@ class BonziBuddy(QtWidgets.QWidget):
                 "pitch": CONFIG["tts_pitch"],
                 "speed": CONFIG["tts_speed"]
             }
-            try:
-                response = requests.get(CONFIG["tts_api_url"], params=params)
-                if response.status_code == 200:
-                    with open(cache_path, "wb") as f:
-                        f.write(response.content)
-                    self.play_tts_audio(cache_path)
-                else:
+            def synthesize():
+                response = http_call(BREAKERS["tts"], "get", CONFIG["tts_api_url"],
+                                     timeout=CONFIG.get("tts_timeout_s", 15), params=params)
+                if response.status_code != 200:
                     print("TTS API error", response.status_code, response.text)
-            except Exception as e:
-                print("TTS exception", e)
+                    return None
+                with open(cache_path, "wb") as f:
+                    f.write(response.content)
+                return cache_path
+
+            def done(path, error):
+                if error is not None:
+                    print("TTS exception", error)
+                elif path:
+                    self.play_tts_audio(path)
+
+            run_in_background(synthesize, done)
 
     def play_tts_audio(self, path):
         url = QtCore.QUrl.fromLocalFile(os.path.abspath(path))
@@ -515,4 +614,7 @@ if __name__ == "__main__":
     app = QtWidgets.QApplication(sys.argv)
     bonzi = BonziBuddy()
     bonzi.show()
+    warm_connections(HTTP_SESSION, CONFIG, [CONFIG["tts_api_url"]] + ([CONFIG["inference_api_url"]] if CONFIG.get("api_enabled", False) else []))
+    app.aboutToQuit.connect(HTTP_SESSION.close)
+    app.aboutToQuit.connect(lambda: print("Circuit breakers:", {name: b.metrics() for name, b in BREAKERS.items()}))
     sys.exit(app.exec_())
@@ -0,0 +1,176 @@
+"""
+Timeouts, Retries and Circuit Breakers for the Backup scripts
+
+infer.py and bonzi_buddy.py both send their inference and TTS calls
+through call_with_retry, one CircuitBreaker per backend, and run them on
+a worker thread with run_in_background so a retry's backoff never
+freezes the window.
+"""
+
+import random, threading, time
+import requests
+from PyQt5 import QtCore
+
+try:
+    import httpx
+    HTTPX_AVAILABLE = True
+except ImportError:
+    HTTPX_AVAILABLE = False
+
+try:
+    from anthropic import APIConnectionError
+    ANTHROPIC_AVAILABLE = True
+except ImportError:
+    ANTHROPIC_AVAILABLE = False
+
+# Statuses worth retrying: timeouts, conflicts, rate limits and overloaded or failing servers
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504, 529}
+
+NETWORK_ERRORS = ((ConnectionError, TimeoutError, requests.ConnectionError, requests.Timeout)
+                  + ((httpx.TransportError,) if HTTPX_AVAILABLE else ())
+                  + ((APIConnectionError,) if ANTHROPIC_AVAILABLE else ()))
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a backend whose circuit breaker is open"""
+
+class CircuitBreaker:
+    """
+    Fails fast while a backend is unhealthy.
+    After failure_threshold consecutive failures the breaker opens and calls
+    are refused for reset_after_s. Then a single trial call is let through
+    (half-open); its outcome closes the breaker or opens it again, and every
+    other call is refused until it has one.
+    """
+    def __init__(self, name, failure_threshold=5, reset_after_s=30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_after_s = reset_after_s
+        self.lock = threading.Lock()
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+        self.stats = {"calls": 0, "failures": 0, "retries": 0, "rejected": 0, "opens": 0}
+
+    def allow(self):
+        """True if a call may go ahead; counts it as started"""
+        with self.lock:
+            if self.state == "open":
+                if time.monotonic() - self.opened_at < self.reset_after_s:
+                    self.stats["rejected"] += 1
+                    return False
+                self.state = "half_open"
+                self.trial_in_flight = False
+            if self.state == "half_open":
+                if self.trial_in_flight:
+                    self.stats["rejected"] += 1
+                    return False
+                self.trial_in_flight = True
+            self.stats["calls"] += 1
+            return True
+
+    def record_success(self):
+        with self.lock:
+            self.state = "closed"
+            self.consecutive_failures = 0
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self.lock:
+            self.stats["failures"] += 1
+            self.consecutive_failures += 1
+            if self.state == "half_open" or self.consecutive_failures >= self.failure_threshold:
+                if self.state != "open":
+                    self.stats["opens"] += 1
+                    print(f"{self.name} is unhealthy; failing fast for {self.reset_after_s:.0f}s")
+                self.state = "open"
+                self.opened_at = time.monotonic()
+            self.trial_in_flight = False
+
+    def release(self):
+        """The call ended without telling us anything about the backend's health"""
+        with self.lock:
+            self.trial_in_flight = False
+
+    def metrics(self):
+        with self.lock:
+            return dict(self.stats, state=self.state, consecutive_failures=self.consecutive_failures)
+
+def is_retryable(error):
+    """Network errors, timeouts and overload statuses are worth another try"""
+    if isinstance(error, NETWORK_ERRORS):
+        return True
+    return getattr(error, "status_code", None) in RETRYABLE_STATUS
+
+def backoff_delay(attempt, base_s, max_s):
+    """Exponential backoff with full jitter, so clients don't retry in lockstep"""
+    return random.uniform(0, min(max_s, base_s * 2 ** attempt))
+
+def call_with_retry(breaker, call, retries=2, base_s=0.5, max_s=4.0):
+    """
+    Run call() through the breaker, retrying network errors, timeouts and
+    retryable statuses with jittered exponential backoff. A returned
+    response with a retryable status_code counts as a failure too; once the
+    retries are used up it is returned as is. Blocks while backing off, so
+    run it with run_in_background from the GUI thread.
+    Raises CircuitOpenError, or the last error.
+    """
+    attempt = 0
+    while True:
+        if not breaker.allow():
+            raise CircuitOpenError(f"{breaker.name} circuit is open")
+        error = None
+        try:
+            result = call()
+        except Exception as e:
+            if not is_retryable(e):
+                breaker.release()
+                raise
+            error = e
+        else:
+            if getattr(result, "status_code", None) not in RETRYABLE_STATUS:
+                breaker.record_success()
+                return result
+        breaker.record_failure()
+        if attempt >= retries:
+            if error is not None:
+                raise error
+            return result
+        delay = backoff_delay(attempt, base_s, max_s)
+        attempt += 1
+        with breaker.lock:
+            breaker.stats["retries"] += 1
+        print(f"{breaker.name}: {error or result.status_code}; retry {attempt}/{retries} in {delay:.2f}s")
+        time.sleep(delay)
+
+class BackgroundCalls(QtCore.QObject):
+    """Runs blocking calls on worker threads and hands the outcome back on the GUI thread"""
+    finished = QtCore.pyqtSignal(object, object, object)  # on_done, result, error
+
+    def __init__(self):
+        super().__init__()
+        self.finished.connect(self.deliver)
+
+    def deliver(self, on_done, result, error):
+        on_done(result, error)
+
+    def submit(self, call, on_done):
+        def work():
+            try:
+                result, error = call(), None
+            except Exception as e:
+                result, error = None, e
+            self.finished.emit(on_done, result, error)
+        threading.Thread(target=work, daemon=True).start()
+
+BACKGROUND = None
+
+def run_in_background(call, on_done=None):
+    """
+    Run call() on a worker thread; on_done(result, error) runs on the GUI
+    thread afterwards, with error None on success. Call from the GUI thread.
+    """
+    global BACKGROUND
+    if BACKGROUND is None:
+        BACKGROUND = BackgroundCalls()
+    BACKGROUND.submit(call, on_done or (lambda result, error: None))
@@ -1,13 +1,30 @@
 #!/usr/bin/env python3
 """
-Test script to verify Claude API is working properly
+Latency and throughput profiler for the Claude API
+
+Sends a configurable number of requests, optionally concurrently, for each
+model, max_tokens and streaming mode being compared, and measures
+time-to-first-token, total latency, output tokens per second and how often
+the reply parses as BonziBuddy's JSON. Use the results to pick `model` and
+`max_tokens` in config.yaml.
+
+Usage:
+    python3 test_claude_api.py                                # quick check: 1 request per mode
+    python3 test_claude_api.py --requests 20 --concurrency 4 --output results.json
+    python3 test_claude_api.py --model claude-3-haiku-20240307 --model claude-3-5-haiku-latest \\
+                               --max-tokens 100 --max-tokens 150 --csv results.csv
+    python3 test_claude_api.py --base-url http://127.0.0.1:8765   # against the local stand-in
 """
 
 import os
+import re
 import sys
+import csv
 import yaml
 import json
 import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
 
 try:
     from anthropic import Anthropic
@@ -17,6 +34,24 @@ except ImportError:
     ANTHROPIC_AVAILABLE = False
     sys.exit(1)
 
+SYSTEM_PROMPT = """
+You are BonziBuddy, a sassy desktop assistant.
+
+Respond with JSON in the following format:
+{
+  "dialogue": "Your response here with some snark",
+  "wave": true/false,
+  "backflip": true/false
+}
+
+Choose 0-1 animations that match your mood.
+"""
+DEFAULT_PROMPT = "Hello! Tell me a fun fact about space."
+MODES = ["stream", "nonstream"]
+CSV_FIELDS = ["model", "mode", "max_tokens", "requests", "errors", "json_ok_rate",
+              "ttft_ms_p50", "ttft_ms_p95", "total_ms_p50", "total_ms_p95", "total_ms_p99",
+              "tokens_per_s_mean", "output_tokens_mean", "requests_per_s"]
+
 def load_config():
     try:
         with open("config.yaml", "r") as f:
@@ -32,100 +67,182 @@ def load_config():
             "api_enabled": True
         }
 
-def test_claude_api():
-    print("Testing Claude API connection...")
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * (len(ordered) - 1)))))
+    return ordered[index]
+
+def parses_as_bonzi_json(text):
+    """True if the reply contains a JSON object with a dialogue field"""
+    json_match = re.search(r'({[\s\S]*})', text)
+    if not json_match:
+        return False
+    try:
+        return "dialogue" in json.loads(json_match.group(1))
+    except (json.JSONDecodeError, TypeError):
+        return False
+
+def timed_request(client, model, max_tokens, mode, args):
+    """Send one request; returns a dict of timings, token counts and JSON validity"""
+    params = {
+        "model": model,
+        "max_tokens": max_tokens,
+        "temperature": args.temperature,
+        "system": SYSTEM_PROMPT,
+        "messages": [{"role": "user", "content": args.prompt}],
+    }
+    start = time.perf_counter()
+    first_token = None
+    try:
+        if mode == "stream":
+            pieces = []
+            with client.messages.stream(**params) as stream:
+                for text in stream.text_stream:
+                    if first_token is None and text:
+                        first_token = time.perf_counter()
+                    pieces.append(text)
+                response = stream.get_final_message()
+            response_text = "".join(pieces)
+        else:
+            response = client.messages.create(**params)
+            response_text = response.content[0].text if response.content else ""
+    except Exception as e:
+        return {"ok": False, "error": str(e)[:200], "total_ms": (time.perf_counter() - start) * 1000}
     
-    # Load configuration
+    end = time.perf_counter()
+    first_token = first_token or end
+    output_tokens = getattr(response.usage, "output_tokens", 0) or 0
+    # Streaming rates cover generation only; a non-streamed reply has no separate first token
+    generation_s = (end - first_token) if mode == "stream" else (end - start)
+    return {
+        "ok": True,
+        "ttft_ms": (first_token - start) * 1000,
+        "total_ms": (end - start) * 1000,
+        "output_tokens": output_tokens,
+        "tokens_per_s": output_tokens / generation_s if generation_s > 0 else 0.0,
+        "json_ok": parses_as_bonzi_json(response_text),
+    }
+
+def profile(client, model, max_tokens, mode, args):
+    """Run args.requests requests with args.concurrency in flight; returns the samples and wall time"""
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        futures = [pool.submit(timed_request, client, model, max_tokens, mode, args)
+                   for _ in range(args.requests)]
+        samples = [future.result() for future in futures]
+    return samples, time.perf_counter() - start
+
+def summarise(model, mode, max_tokens, samples, wall_s):
+    ok = [s for s in samples if s["ok"]]
+    ttft = [s["ttft_ms"] for s in ok]
+    total = [s["total_ms"] for s in ok]
+    rates = [s["tokens_per_s"] for s in ok]
+    return {
+        "model": model,
+        "mode": mode,
+        "max_tokens": max_tokens,
+        "requests": len(samples),
+        "errors": len(samples) - len(ok),
+        "json_ok_rate": sum(1 for s in ok if s["json_ok"]) / len(ok) if ok else 0.0,
+        "ttft_ms_p50": percentile(ttft, 50),
+        "ttft_ms_p95": percentile(ttft, 95),
+        "total_ms_p50": percentile(total, 50),
+        "total_ms_p95": percentile(total, 95),
+        "total_ms_p99": percentile(total, 99),
+        "tokens_per_s_mean": sum(rates) / len(rates) if rates else 0.0,
+        "output_tokens_mean": sum(s["output_tokens"] for s in ok) / len(ok) if ok else 0.0,
+        "requests_per_s": len(ok) / wall_s if wall_s else 0.0,
+        "error_samples": sorted({s["error"] for s in samples if not s["ok"]})[:3],
+    }
+
+def print_table(rows):
+    print(f"\n{'model':<32} {'mode':<10} {'max':>4} {'ok':>7} {'json':>5} "
+          f"{'ttft50':>7} {'ttft95':>7} {'tot50':>7} {'tot95':>7} {'tok/s':>6} {'req/s':>6}")
+    for row in rows:
+        print(f"{row['model'][:32]:<32} {row['mode']:<10} {row['max_tokens']:>4} "
+              f"{row['requests'] - row['errors']:>3}/{row['requests']:<3} {row['json_ok_rate']:>5.0%} "
+              f"{row['ttft_ms_p50']:>7.0f} {row['ttft_ms_p95']:>7.0f} {row['total_ms_p50']:>7.0f} "
+              f"{row['total_ms_p95']:>7.0f} {row['tokens_per_s_mean']:>6.1f} {row['requests_per_s']:>6.2f}")
+
+def main():
     config = load_config()
+    parser = argparse.ArgumentParser(description="Profile Claude API latency and throughput")
+    parser.add_argument("--requests", type=int, default=1, help="requests per combination (default: 1)")
+    parser.add_argument("--concurrency", type=int, default=1, help="requests in flight at once (default: 1)")
+    parser.add_argument("--mode", choices=MODES + ["both"], default="both",
+                        help="streaming, non-streaming or both (default: both)")
+    parser.add_argument("--model", action="append",
+                        help="model to profile (repeatable, default: profile_models or model from config.yaml)")
+    parser.add_argument("--max-tokens", type=int, action="append",
+                        help="max_tokens to profile (repeatable, default: max_tokens from config.yaml)")
+    parser.add_argument("--temperature", type=float, default=config.get("temp", 1.0))
+    parser.add_argument("--prompt", default=DEFAULT_PROMPT, help="user message sent with every request")
+    parser.add_argument("--base-url", default=config.get("anthropic_base_url"),
+                        help="API endpoint, e.g. a proxy or the local stand-in server")
+    parser.add_argument("--output", help="write the JSON results to this file")
+    parser.add_argument("--csv", help="write one CSV row per combination to this file")
+    args = parser.parse_args()
     
     # Check if API is enabled
     if not config.get("api_enabled", True):
         print("ERROR: API is disabled in config.yaml")
-        return False
+        return 1
     
-    # Check API key
-    api_key = config.get("anthropic_api_key", "")
-    if not api_key:
+    # Check API key; a local endpoint doesn't need a real one
+    api_key = config.get("anthropic_api_key", "") or os.environ.get("ANTHROPIC_API_KEY", "")
+    if not api_key and not args.base_url:
         print("ERROR: Missing API key in config.yaml")
-        return False
+        return 1
     
-    # Initialize Anthropic client
     try:
-        client = Anthropic(api_key=api_key)
-        print(f"Initialized Anthropic client")
+        # No SDK retries, so the numbers show what a single request costs
+        client = Anthropic(api_key=api_key or "local", base_url=args.base_url or None, max_retries=0)
     except Exception as e:
         print(f"ERROR initializing Anthropic client: {e}")
-        return False
+        return 1
     
-    # Get model from config
-    model = config.get("model", "claude-3-haiku-20240307")
-    print(f"Using model: {model}")
+    models = args.model or config.get("profile_models") or [config.get("model", "claude-3-haiku-20240307")]
+    max_tokens_values = args.max_tokens or [config.get("max_tokens", 150)]
+    modes = MODES if args.mode == "both" else [args.mode]
     
-    # Define system prompt
-    system_prompt = """
-    You are BonziBuddy, a sassy desktop assistant.
+    rows = []
+    for model in models:
+        for max_tokens in max_tokens_values:
+            for mode in modes:
+                print(f"Profiling {model} {mode} max_tokens={max_tokens}: "
+                      f"{args.requests} requests, {args.concurrency} at a time...")
+                samples, wall_s = profile(client, model, max_tokens, mode, args)
+                row = summarise(model, mode, max_tokens, samples, wall_s)
+                for error in row["error_samples"]:
+                    print(f"  ERROR: {error}")
+                rows.append(row)
     
-    Respond with JSON in the following format:
-    {
-      "dialogue": "Your response here with some snark",
-      "wave": true/false,
-      "backflip": true/false
-    }
-    
-    Choose 0-1 animations that match your mood.
-    """
+    print_table(rows)
     
-    # Send a test message
-    print("Sending test message to Claude API...")
-    start_time = time.time()
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "base_url": args.base_url,
+                "requests": args.requests,
+                "concurrency": args.concurrency,
+                "prompt": args.prompt,
+                "results": rows,
+            }, f, indent=2)
+        print(f"\nWrote {args.output}")
+    if args.csv:
+        with open(args.csv, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=CSV_FIELDS, extrasaction="ignore")
+            writer.writeheader()
+            writer.writerows(rows)
+        print(f"Wrote {args.csv}")
     
-    try:
-        response = client.messages.create(
-            model=model,
-            max_tokens=100,
-            temperature=1.0,
-            system=system_prompt,
-            messages=[
-                {"role": "user", "content": "Hello! Tell me a fun fact about space."}
-            ]
-        )
-        
-        elapsed = time.time() - start_time
-        print(f"Received response in {elapsed:.2f} seconds")
-        
-        # Extract the response content
-        if not hasattr(response, 'content') or not response.content:
-            print("ERROR: No content in response")
-            print(f"Raw response: {response}")
-            return False
-        
-        response_text = response.content[0].text
-        print(f"Raw response: {response_text}")
-        
-        # Try to extract JSON
-        import re
-        json_match = re.search(r'({[\s\S]*})', response_text)
-        if json_match:
-            try:
-                json_str = json_match.group(1)
-                json_data = json.loads(json_str)
-                print(f"Parsed JSON: {json.dumps(json_data, indent=2)}")
-            except json.JSONDecodeError:
-                print("WARNING: Could not parse JSON in response")
-        else:
-            print("WARNING: No JSON found in response")
-        
+    succeeded = sum(row["requests"] - row["errors"] for row in rows)
+    if succeeded:
         print("\nAPI TEST SUCCESSFUL! Claude API is working properly.")
-        return True
-        
-    except Exception as e:
-        print(f"ERROR during API call: {e}")
-        return False
+    return 0 if succeeded else 1
 
 if __name__ == "__main__":
-    if not ANTHROPIC_AVAILABLE:
-        print("Anthropic SDK not available. Please install it with: pip install anthropic")
-        sys.exit(1)
-    
-    success = test_claude_api()
-    sys.exit(0 if success else 1)
\ No newline at end of file
+    sys.exit(main())
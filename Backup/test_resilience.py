@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Tests for resilience.py, shared by infer.py and bonzi_buddy.py
+
+Usage:
+    python3 -m pytest -q test_resilience.py
+"""
+
+import os
+import sys
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import resilience
+from PyQt5 import QtCore
+
+def responses(*statuses):
+    """A call returning a response with each status in turn"""
+    calls = []
+
+    def call():
+        calls.append(1)
+        return SimpleNamespace(status_code=statuses[len(calls) - 1])
+    return call, calls
+
+def test_retryable_status_is_retried_then_returned():
+    breaker = resilience.CircuitBreaker("tts")
+    call, calls = responses(503, 200)
+    assert resilience.call_with_retry(breaker, call, base_s=0).status_code == 200
+    assert len(calls) == 2
+    assert breaker.metrics()["retries"] == 1
+
+    call, calls = responses(503, 503, 503)
+    assert resilience.call_with_retry(breaker, call, retries=2, base_s=0).status_code == 503
+    assert len(calls) == 3
+
+def test_network_error_is_retried():
+    breaker = resilience.CircuitBreaker("inference")
+    attempts = []
+
+    def call():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise resilience.requests.ConnectionError("refused")
+        return SimpleNamespace(status_code=200)
+
+    assert resilience.call_with_retry(breaker, call, base_s=0).status_code == 200
+
+def test_half_open_allows_a_single_trial():
+    breaker = resilience.CircuitBreaker("inference", failure_threshold=1, reset_after_s=30)
+    breaker.allow()
+    breaker.record_failure()
+    with pytest.raises(resilience.CircuitOpenError):
+        resilience.call_with_retry(breaker, lambda: None)
+    breaker.opened_at -= 30
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.allow()
+
+def test_non_retryable_error_releases_the_trial():
+    breaker = resilience.CircuitBreaker("inference", failure_threshold=1, reset_after_s=30)
+    breaker.allow()
+    breaker.record_failure()
+    breaker.opened_at -= 30
+
+    def call():
+        raise ValueError("bad payload")
+
+    with pytest.raises(ValueError):
+        resilience.call_with_retry(breaker, call)
+    assert breaker.state == "half_open"
+    assert breaker.allow()
+
+def test_background_result_arrives_on_the_calling_thread():
+    app = QtCore.QCoreApplication.instance() or QtCore.QCoreApplication([])
+    outcomes = []
+    resilience.run_in_background(lambda: threading.current_thread(),
+                                 lambda result, error: outcomes.append((result, error, threading.current_thread())))
+    resilience.run_in_background(lambda: 1 / 0, lambda result, error: outcomes.append((result, error, None)))
+    deadline = QtCore.QDeadlineTimer(2000)
+    while len(outcomes) < 2 and not deadline.hasExpired():
+        app.processEvents(QtCore.QEventLoop.AllEvents, 50)
+    worker_outcome = next(outcome for outcome in outcomes if outcome[2] is not None)
+    assert worker_outcome[0] is not threading.main_thread()
+    assert worker_outcome[2] is threading.main_thread()
+    failed = next(outcome for outcome in outcomes if outcome[2] is None)
+    assert isinstance(failed[1], ZeroDivisionError)
+
+if __name__ == "__main__":
+    sys.exit(pytest.main(["-q", __file__]))
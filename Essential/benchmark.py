@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+Headless animation and rendering benchmark for BonziBuddy
+
+Runs the real BonziBuddy widget under QT_QPA_PLATFORM=offscreen, replays
+scripted animation sequences and reports frame-time percentiles, timer
+drift, CPU per second and peak RSS as JSON.
+
+Usage:
+    python3 benchmark.py                          # all scenarios, JSON to stdout
+    python3 benchmark.py --output bench.json      # also write the results to a file
+    python3 benchmark.py --baseline bench.json    # compare against an earlier run
+    python3 benchmark.py --scenario talking --seconds 10
+"""
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import resource
+import contextlib
+
+# Must be set before Qt is imported
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+# Run from the BonziBuddy directory so config.yaml and the frames are found
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+from PyQt5 import QtWidgets, QtCore
+
+# BonziBuddy logs with print(); keep stdout for the JSON results
+with contextlib.redirect_stdout(sys.stderr):
+    import fixed_bonzi
+
+RESULTS_VERSION = 1
+SCENARIOS = ["load", "idle", "talking", "queue", "teleport"]
+# Metrics where a higher value is a regression, checked by --baseline
+TRACKED_METRICS = ["frame_ms_p95", "lateness_ms_p95", "cpu_per_second", "wakeups_per_second"]
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * (len(ordered) - 1)))))
+    return ordered[index]
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on macOS and kilobytes on Linux
+    return peak / 1048576 if sys.platform == "darwin" else peak / 1024
+
+def run_event_loop(seconds, until=None):
+    """Spin the Qt event loop for seconds, or until until() turns true"""
+    loop = QtCore.QEventLoop()
+    deadline = time.monotonic() + seconds
+    if until is not None:
+        poll = QtCore.QTimer()
+        poll.timeout.connect(lambda: (until() or time.monotonic() >= deadline) and loop.quit())
+        poll.start(10)
+    QtCore.QTimer.singleShot(int(seconds * 1000), loop.quit)
+    loop.exec_()
+
+class FrameRecorder:
+    """Collects frame timestamps and timer lateness from the AnimationClock"""
+    def __init__(self, clock):
+        self.clock = clock
+        self.times = []
+        self.lateness = []
+        clock.frameShown.connect(self.on_frame)
+
+    def on_frame(self, track, index, lateness_ms):
+        self.times.append(time.perf_counter())
+        self.lateness.append(lateness_ms)
+
+    def measure(self, action, seconds, until=None):
+        """Run action, spin the event loop and summarise what was painted"""
+        self.times.clear()
+        self.lateness.clear()
+        self.clock.reset_stats()
+        cpu_start = time.process_time()
+        wall_start = time.perf_counter()
+
+        action()
+        run_event_loop(seconds, until)
+
+        wall = time.perf_counter() - wall_start
+        cpu = time.process_time() - cpu_start
+        frame_ms = [(b - a) * 1000 for a, b in zip(self.times, self.times[1:])]
+        clock_stats = self.clock.stats()
+        return {
+            "duration_s": wall,
+            "frames": len(self.times),
+            "frame_ms_p50": percentile(frame_ms, 50),
+            "frame_ms_p95": percentile(frame_ms, 95),
+            "frame_ms_p99": percentile(frame_ms, 99),
+            "frame_ms_max": max(frame_ms, default=0.0),
+            "lateness_ms_mean": sum(self.lateness) / len(self.lateness) if self.lateness else 0.0,
+            "lateness_ms_p95": percentile(self.lateness, 95),
+            "lateness_ms_max": max(self.lateness, default=0.0),
+            "frames_dropped": clock_stats["frames_dropped"],
+            "wakeups_per_second": clock_stats["wakeups_per_second"],
+            "cpu_per_second": cpu / wall if wall else 0.0,
+            "peak_rss_mb": peak_rss_mb(),
+        }
+
+def bench_load():
+    """Cold Animation construction plus decoding every animation once"""
+    cpu_start = time.process_time()
+    start = time.perf_counter()
+    animator = fixed_bonzi.Animation()
+    init_ms = (time.perf_counter() - start) * 1000
+    for anim_type in list(animator.animations):
+        animator.get_pixmaps(anim_type)
+    total_ms = (time.perf_counter() - start) * 1000
+    stats = animator.frame_cache.stats()
+    return {
+        "init_ms": init_ms,
+        "decode_all_ms": total_ms - init_ms,
+        "total_ms": total_ms,
+        "cpu_ms": (time.process_time() - cpu_start) * 1000,
+        "decoded_frames": stats["decoded_frames"],
+        "unique_frames": stats["unique_frames"],
+        "resident_mb": stats["resident_bytes"] / 1048576,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+def run_scenarios(names, seconds):
+    results = {}
+    if "load" in names:
+        print("Benchmark: load", file=sys.stderr)
+        results["load"] = bench_load()
+
+    start = time.perf_counter()
+    bonzi = fixed_bonzi.BonziBuddy()
+    bonzi.show()
+    startup_ms = (time.perf_counter() - start) * 1000
+    recorder = FrameRecorder(bonzi.clock)
+    clock = bonzi.clock
+
+    def queue_extra():
+        bonzi.extra_animations = ["wave", "backflip", "goodbye"]
+        bonzi.play_extra_animations()
+
+    scripted = {
+        "idle": (lambda: None, seconds, None),
+        "talking": (bonzi.start_talking_animation, seconds, None),
+        "queue": (queue_extra, 30, lambda: not clock.is_playing()),
+        "teleport": (bonzi.teleport, 30, lambda: not clock.is_playing()),
+    }
+    for name in SCENARIOS:
+        if name in names and name in scripted:
+            print(f"Benchmark: {name}", file=sys.stderr)
+            action, limit, until = scripted[name]
+            results[name] = recorder.measure(action, limit, until)
+            if name == "talking":
+                bonzi.stop_talking_animation()
+
+    cache_stats = bonzi.animator.frame_cache.stats()
+    bonzi.close()
+    return startup_ms, cache_stats, results
+
+def compare(results, baseline, tolerance):
+    """Print metric changes against a baseline run; returns the regressions"""
+    regressions = []
+    for name, metrics in results["scenarios"].items():
+        old = baseline.get("scenarios", {}).get(name)
+        if not old:
+            continue
+        for metric in TRACKED_METRICS:
+            if metric not in metrics or metric not in old:
+                continue
+            before, after = old[metric], metrics[metric]
+            change = (after - before) / before if before else 0.0
+            flag = ""
+            if change > tolerance:
+                flag = "  REGRESSION"
+                regressions.append(f"{name}.{metric}")
+            print(f"{name}.{metric}: {before:.3f} -> {after:.3f} ({change:+.1%}){flag}", file=sys.stderr)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless BonziBuddy animation benchmark")
+    parser.add_argument("--scenario", action="append", choices=SCENARIOS,
+                        help="scenario to run (repeatable, default: all)")
+    parser.add_argument("--seconds", type=float, default=5.0,
+                        help="duration of the idle and talking scenarios")
+    parser.add_argument("--output", help="write the JSON results to this file")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="relative increase reported as a regression (default: 0.2)")
+    args = parser.parse_args()
+
+    # Measure raw animation cost, not the power-saving slowdown
+    fixed_bonzi.CONFIG["power_saving"] = False
+
+    app = QtWidgets.QApplication(sys.argv)
+    with contextlib.redirect_stdout(sys.stderr):
+        startup_ms, cache_stats, scenarios = run_scenarios(args.scenario or SCENARIOS, args.seconds)
+    app.processEvents()
+
+    results = {
+        "version": RESULTS_VERSION,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "qt": QtCore.QT_VERSION_STR,
+        "qpa_platform": os.environ.get("QT_QPA_PLATFORM"),
+        "startup_ms": startup_ms,
+        "frame_cache": cache_stats,
+        "scenarios": scenarios,
+    }
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"Regressions: {', '.join(regressions)}", file=sys.stderr)
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Pack BonziBuddy's animation frames into sprite atlases
+
+Every animation directory (idle/, arrive/, wave/, ...) is packed into one
+atlas image plus a JSON index of frame rects, so the app can load all of
+its frames with a single file read instead of opening ~180 small PNGs.
+
+Usage:
+    python3 build_atlas.py                  # one atlas.png for every animation
+    python3 build_atlas.py --per-animation  # atlas_<name>.png per animation
+"""
+
+import os
+import sys
+import glob
+import json
+import math
+import hashlib
+import argparse
+from PIL import Image
+
+ANIMATION_TYPES = ["idle", "arrive", "goodbye", "backflip", "glasses", "wave", "talking"]
+INDEX_VERSION = 1
+MAX_SHEET_WIDTH = 4096
+PADDING = 1
+
+def load_frames(anim_type):
+    """Load every frame of an animation as an RGBA image"""
+    frames = []
+    for file_path in sorted(glob.glob(f"{anim_type}/*.png")):
+        try:
+            with Image.open(file_path) as img:
+                frames.append((file_path, img.convert("RGBA")))
+        except Exception as e:
+            print(f"Error reading image {file_path}: {e}")
+    return frames
+
+def pack(images):
+    """
+    Shelf-pack images into rows, tallest first.
+    Returns (sheet_width, sheet_height, {key: (x, y, w, h)}).
+    """
+    if not images:
+        return 0, 0, {}
+
+    total_area = sum((img.width + PADDING) * (img.height + PADDING) for img in images.values())
+    widest = max(img.width for img in images.values())
+    sheet_width = min(MAX_SHEET_WIDTH, max(widest, int(math.ceil(math.sqrt(total_area)))))
+
+    rects = {}
+    x, y, shelf_height = 0, 0, 0
+    for key, img in sorted(images.items(), key=lambda item: -item[1].height):
+        if x + img.width > sheet_width:
+            x = 0
+            y += shelf_height + PADDING
+            shelf_height = 0
+        rects[key] = (x, y, img.width, img.height)
+        x += img.width + PADDING
+        shelf_height = max(shelf_height, img.height)
+
+    return sheet_width, y + shelf_height, rects
+
+def build_sheet(sheet_name, animations):
+    """
+    Pack the frames of the given animations into one sheet.
+    Identical frames are stored once and share a rect.
+    Returns the index entries for those animations.
+    """
+    unique = {}
+    frame_keys = {}
+    for anim_type, frames in animations.items():
+        keys = []
+        for file_path, img in frames:
+            key = hashlib.sha1(img.tobytes()).hexdigest()
+            unique.setdefault(key, img)
+            keys.append((file_path, key, img.size))
+        frame_keys[anim_type] = keys
+
+    width, height, rects = pack(unique)
+    sheet = Image.new("RGBA", (width, height), (0, 0, 0, 0))
+    for key, img in unique.items():
+        x, y, _, _ = rects[key]
+        sheet.paste(img, (x, y))
+    sheet.save(sheet_name, optimize=True)
+
+    total = sum(len(keys) for keys in frame_keys.values())
+    print(f"Wrote {sheet_name}: {width}x{height}, {len(unique)} unique of {total} frames")
+
+    index = {}
+    for anim_type, keys in frame_keys.items():
+        index[anim_type] = [
+            {"name": file_path, "sheet": sheet_name, "rect": list(rects[key])}
+            for file_path, key, _ in keys
+        ]
+    return index
+
+def main():
+    parser = argparse.ArgumentParser(description="Pack animation frames into sprite atlases")
+    parser.add_argument("--per-animation", action="store_true",
+                        help="write one atlas per animation instead of a single sheet")
+    parser.add_argument("--index", default="atlas.json", help="path of the JSON frame index")
+    args = parser.parse_args()
+
+    print("==== Building BonziBuddy sprite atlas ====")
+    animations = {}
+    for anim_type in ANIMATION_TYPES:
+        frames = load_frames(anim_type)
+        if frames:
+            animations[anim_type] = frames
+            print(f"Loaded {len(frames)} frames for {anim_type} animation")
+        else:
+            print(f"No frames found for {anim_type} animation")
+
+    if not animations:
+        print("ERROR: no animation frames found; run this from the BonziBuddy directory")
+        return 1
+
+    index = {"version": INDEX_VERSION, "animations": {}}
+    if args.per_animation:
+        for anim_type, frames in animations.items():
+            index["animations"].update(build_sheet(f"atlas_{anim_type}.png", {anim_type: frames}))
+    else:
+        index["animations"] = build_sheet("atlas.png", animations)
+
+    with open(args.index, "w") as f:
+        json.dump(index, f, indent=1)
+
+    sheets = sorted({frame["sheet"] for frames in index["animations"].values() for frame in frames})
+    packed_bytes = sum(os.path.getsize(sheet) for sheet in sheets)
+    loose_bytes = sum(os.path.getsize(file_path)
+                      for frames in animations.values() for file_path, _ in frames)
+    print(f"Wrote {args.index}: {len(sheets)} sheet(s), "
+          f"{packed_bytes / 1024:.0f}KB packed vs {loose_bytes / 1024:.0f}KB loose")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -39,12 +39,23 @@ def main():
     
     # Copy resources
     print("Copying resources...")
-    # Copy all animation directories
-    for anim_dir in ["idle", "arrive", "backflip", "glasses", "goodbye", "talking", "wave"]:
-        src_dir = os.path.join(os.getcwd(), anim_dir)
-        dst_dir = os.path.join(resources_path, anim_dir)
-        if os.path.exists(src_dir):
-            shutil.copytree(src_dir, dst_dir)
+    if os.path.exists("atlas.json"):
+        # Ship the packed atlas (see build_atlas.py) instead of the loose frames
+        print("Using packed sprite atlas")
+        shutil.copy("atlas.json", os.path.join(resources_path, "atlas.json"))
+        for sheet in glob.glob("atlas*.png"):
+            shutil.copy(sheet, os.path.join(resources_path, sheet))
+    else:
+        # Copy all animation directories
+        for anim_dir in ["idle", "arrive", "backflip", "glasses", "goodbye", "talking", "wave"]:
+            src_dir = os.path.join(os.getcwd(), anim_dir)
+            dst_dir = os.path.join(resources_path, anim_dir)
+            if os.path.exists(src_dir):
+                shutil.copytree(src_dir, dst_dir)
+    
+    # Copy the frame size manifest so the first launch doesn't rebuild it
+    if os.path.exists("frame_manifest.json"):
+        shutil.copy("frame_manifest.json", os.path.join(resources_path, "frame_manifest.json"))
     
     # Copy audio files
     audio_src = os.path.join(os.getcwd(), "audio")
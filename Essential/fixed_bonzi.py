@@ -11,23 +11,36 @@ import hashlib
 import tempfile
 import re
 import json
+import math
+import ast
+import operator
+import mmap
+import struct
 import subprocess
 import yaml
 import asyncio
 import threading
 import time
 import traceback
+import zlib
+from collections import OrderedDict, deque
+from types import SimpleNamespace
 from PyQt5 import QtWidgets, QtCore, QtGui
 from PyQt5.QtMultimedia import QMediaPlayer, QMediaContent
-from PIL import Image
 
 try:
-    from anthropic import Anthropic
-    import aiohttp
+    from anthropic import AsyncAnthropic, APIConnectionError
+    import httpx
     ANTHROPIC_AVAILABLE = True
 except ImportError:
     ANTHROPIC_AVAILABLE = False
 
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
 # ---------------------------
 # Load YAML Config
 # ---------------------------
@@ -49,11 +62,33 @@ def load_config():
 
 CONFIG = load_config()
 
-# Initialize Anthropic client
+def create_http_client():
+    """
+    Pooled keep-alive HTTP client for the LLM API. It is only ever used from
+    the background event loop, so chat, prefetch and summary requests can
+    share warm connections and run concurrently without extra threads.
+    """
+    pool_size = CONFIG.get("llm_pool_size", 4)
+    return httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=pool_size,
+            max_keepalive_connections=pool_size,
+            keepalive_expiry=CONFIG.get("llm_keepalive_s", 60),
+        ),
+        timeout=httpx.Timeout(CONFIG.get("llm_timeout_s", 30), connect=5.0),
+    )
+
+# Initialize Anthropic client (async; runs on the background event loop)
 ANTHROPIC_CLIENT = None
 if ANTHROPIC_AVAILABLE and CONFIG.get("api_enabled") and CONFIG.get("anthropic_api_key"):
     try:
-        ANTHROPIC_CLIENT = Anthropic(api_key=CONFIG.get("anthropic_api_key", ""))
+        ANTHROPIC_CLIENT = AsyncAnthropic(
+            api_key=CONFIG.get("anthropic_api_key", ""),
+            base_url=CONFIG.get("anthropic_base_url") or None,
+            http_client=create_http_client(),
+            # Retries go through call_with_retry and the circuit breaker instead
+            max_retries=0,
+        )
         print("Anthropic client initialized successfully")
     except Exception as e:
         print(f"Error initializing Anthropic client: {e}")
@@ -191,10 +226,25 @@ class PersistentChatDialog(QtWidgets.QDialog):
         
         # Reference to BonziBuddy for callbacks
         self.bonzi = None
+        
+        # Streaming reply state; text is flushed at most once per frame
+        self.stream_start = None
+        self.stream_text = ""
+        self.stream_pending = ""
+        self.stream_timer = QtCore.QTimer(self)
+        self.stream_timer.setSingleShot(True)
+        self.stream_timer.setInterval(16)
+        self.stream_timer.timeout.connect(self.flush_stream)
     
     def set_bonzi(self, bonzi):
         self.bonzi = bonzi
     
+    def closeEvent(self, event):
+        # Nobody is left to read a pending reply
+        if self.bonzi:
+            self.bonzi.cancel_turn("chat dialog closed")
+        super().closeEvent(event)
+    
     def append_message(self, text, is_user=False, is_bonzi=False):
         """
         Add a message to the chat history
@@ -260,6 +310,82 @@ class PersistentChatDialog(QtWidgets.QDialog):
             except:
                 print("CHAT: Critical error in append_message")
     
+    def remove_thinking_message(self):
+        """Remove the "thinking" status line shown while a reply is pending"""
+        try:
+            cursor = self.chatHistory.textCursor()
+            document = self.chatHistory.document()
+            
+            # Find and remove the latest "thinking" message
+            for i in reversed(range(document.blockCount())):
+                block = document.findBlockByNumber(i)
+                if block.text().startswith(("Bonzi: Let me think", "Bonzi: Asking my giant purple brain")):
+                    # Select this block
+                    cursor.setPosition(block.position())
+                    cursor.setPosition(block.position() + block.length() - 1, QtGui.QTextCursor.KeepAnchor)
+                    cursor.removeSelectedText()
+                    # Remove any trailing newlines
+                    cursor.deleteChar()
+                    cursor.deleteChar()
+                    break
+        except Exception as e:
+            print(f"Error removing thinking message: {e}")
+    
+    def is_streaming(self):
+        return self.stream_start is not None
+    
+    def begin_stream(self):
+        """Start a Bonzi message whose text arrives in pieces via append_stream"""
+        self.chatHistory.moveCursor(QtGui.QTextCursor.End)
+        cursor = self.chatHistory.textCursor()
+        prefix_format = QtGui.QTextCharFormat()
+        prefix_format.setForeground(QtGui.QColor("#800080"))
+        prefix_format.setFontWeight(QtGui.QFont.Bold)
+        cursor.insertText("Bonzi: ", prefix_format)
+        self.stream_start = cursor.position()
+        self.stream_text = ""
+        self.stream_pending = ""
+    
+    def append_stream(self, text):
+        """Buffer streamed text; the buffer is painted on the next frame"""
+        if not self.is_streaming():
+            self.begin_stream()
+        self.stream_pending += text
+        if not self.stream_timer.isActive():
+            self.stream_timer.start()
+    
+    def flush_stream(self):
+        """Insert everything buffered since the last frame in one edit"""
+        if not self.is_streaming() or not self.stream_pending:
+            return
+        cursor = self.chatHistory.textCursor()
+        cursor.movePosition(QtGui.QTextCursor.End)
+        message_format = QtGui.QTextCharFormat()
+        message_format.setForeground(QtGui.QColor("#800080"))
+        cursor.insertText(self.stream_pending, message_format)
+        self.stream_text += self.stream_pending
+        self.stream_pending = ""
+        self.chatHistory.moveCursor(QtGui.QTextCursor.End)
+        self.chatHistory.ensureCursorVisible()
+    
+    def end_stream(self, text):
+        """Finish the streamed message, replacing it with the final text if they differ"""
+        self.stream_timer.stop()
+        self.flush_stream()
+        cursor = self.chatHistory.textCursor()
+        cursor.movePosition(QtGui.QTextCursor.End)
+        if text and text != self.stream_text:
+            cursor.setPosition(self.stream_start)
+            cursor.movePosition(QtGui.QTextCursor.End, QtGui.QTextCursor.KeepAnchor)
+            message_format = QtGui.QTextCharFormat()
+            message_format.setForeground(QtGui.QColor("#800080"))
+            cursor.insertText(text, message_format)
+        cursor.insertText("\n\n")
+        self.stream_start = None
+        self.stream_text = ""
+        self.chatHistory.moveCursor(QtGui.QTextCursor.End)
+        self.chatHistory.ensureCursorVisible()
+    
     def send_message(self):
         try:
             # Get text from input field
@@ -307,16 +433,21 @@ class PersistentChatDialog(QtWidgets.QDialog):
 # ---------------------------
 # MacOS Text-to-Speech
 # ---------------------------
+def configured_tts_voice():
+    """The macOS voice from config, or Alex"""
+    voice = CONFIG.get("tts_voice", "Alex")
+    if voice.startswith("Adult Male") or voice.startswith("Adult Female"):
+        # Use default macOS voice if TruVoice is configured
+        voice = "Alex"
+    return voice
+
 def system_tts(text, voice=None):
     """Use macOS system text-to-speech"""
     try:
         print(f"TTS System: Generating speech for text: '{text[:50]}...'")
         
         # Get voice from config or default to Alex
-        voice = CONFIG.get("tts_voice", "Alex")
-        if voice.startswith("Adult Male") or voice.startswith("Adult Female"):
-            # Use default macOS voice if TruVoice is configured
-            voice = "Alex"
+        voice = configured_tts_voice()
         
         # Clean text (remove markdown, JSON, etc.)
         clean_text = re.sub(r'\{.*?\}', '', text, flags=re.DOTALL)
@@ -385,39 +516,2558 @@ def system_tts(text, voice=None):
         return None
 
 # ---------------------------
-# Animation Helper
+# Filler Clips
+# ---------------------------
+# Short quips Bonzi says while a request is in flight, with the one-shot animation that goes with each
+FILLER_CLIPS = [
+    ("Ugh, fine, let me think...", "glasses"),
+    ("Hold your horses, genius.", "wave"),
+    ("Hmm. Give me a second.", "glasses"),
+    ("Oh boy. Here we go.", "backflip"),
+    ("Let me consult my giant purple brain.", "glasses"),
+]
+
+class FillerPlayer(QtCore.QObject):
+    """
+    Masks the wait for a reply with a pre-rendered quip and its animation.
+    Clips are synthesized once into filler_cache_dir on a background thread
+    at startup, so start() only has to hand a local file to its own media
+    player. stop() cuts the quip off; BonziBuddy calls it right before the
+    real reply starts speaking, so one voice hands over to the other.
+    """
+    def __init__(self, clock, animator, parent=None):
+        super().__init__(parent)
+        self.clock = clock
+        self.animator = animator
+        self.enabled = CONFIG.get("filler_clips", True)
+        self.cache_dir = CONFIG.get("filler_cache_dir", "filler_cache")
+        self.clips = {}  # text -> rendered audio file, filled in by the background thread
+        self.last_text = None
+        self.current = None  # text of the quip playing now
+        self.animation = None  # clock track name of its animation
+        self.player = QMediaPlayer(self)
+        self.player.mediaStatusChanged.connect(self.on_media_status_changed)
+        self.started = 0
+        self.completed = 0
+        self.interrupted = 0
+        self.silent = 0  # turns that started before any clip was rendered
+        self.render_ms = 0.0
+    
+    def clip_path(self, text):
+        key = hashlib.sha1(f"{configured_tts_voice()}\n{text}".encode("utf-8")).hexdigest()[:16]
+        return os.path.join(self.cache_dir, f"{key}.aiff")
+    
+    def prepare(self):
+        """Render missing clips in the background; clips already on disk are ready immediately"""
+        if not self.enabled or not CONFIG.get("use_system_tts", True):
+            return
+        pending = []
+        for text, _ in FILLER_CLIPS:
+            path = self.clip_path(text)
+            if os.path.exists(path) and os.path.getsize(path) > 0:
+                self.clips[text] = path
+            else:
+                pending.append((text, path))
+        if pending:
+            threading.Thread(target=self.render, args=(pending,), daemon=True).start()
+    
+    def render(self, pending):
+        """Synthesize each clip to a temporary file and move it into place (runs off the GUI thread)"""
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+        except OSError as e:
+            print(f"FILLER: Can't create {self.cache_dir}: {e}")
+            return
+        voice = configured_tts_voice()
+        for text, path in pending:
+            start = time.perf_counter()
+            temp_path = f"{path}.{os.getpid()}.tmp.aiff"
+            try:
+                process = subprocess.run(["say", "-v", voice, "-o", temp_path, text],
+                                         capture_output=True, text=True, timeout=30)
+                if process.returncode != 0 or not os.path.exists(temp_path):
+                    print(f"FILLER: Couldn't render '{text}': {process.stderr.strip()[:100]}")
+                    continue
+                os.replace(temp_path, path)
+                self.clips[text] = path
+                self.render_ms += (time.perf_counter() - start) * 1000
+            except (OSError, subprocess.SubprocessError) as e:
+                # No say command on this machine; the remaining clips would fail the same way
+                print(f"FILLER: Speech synthesis unavailable, fillers will be silent: {e}")
+                return
+            finally:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+        print(f"FILLER: {len(self.clips)}/{len(FILLER_CLIPS)} clips ready")
+    
+    def start(self):
+        """Play a random quip and its animation; returns False if fillers are off or one is already playing"""
+        if not self.enabled or self.current is not None:
+            return False
+        choices = [clip for clip in FILLER_CLIPS if clip[0] != self.last_text] or FILLER_CLIPS
+        text, animation = random.choice(choices)
+        self.last_text = text
+        self.started += 1
+        
+        frames = self.animator.get_pixmaps(animation)
+        if frames:
+            self.animation = f"filler:{animation}"
+            self.clock.play(self.animation, frames)
+        path = self.clips.get(text)
+        if path and CONFIG.get("use_system_tts", True):
+            self.current = text
+            self.player.setMedia(QMediaContent(QtCore.QUrl.fromLocalFile(os.path.abspath(path))))
+            self.player.play()
+        else:
+            # Nothing to say yet: the animation alone covers the wait
+            self.silent += 1
+        return True
+    
+    def stop_animation(self):
+        """Drop the filler animation so streamed text can be lip-synced straight away"""
+        if self.animation is not None:
+            self.clock.cancel(self.animation)
+            self.animation = None
+    
+    def stop(self):
+        """Interrupt the quip, if one is still playing"""
+        self.stop_animation()
+        if self.current is None:
+            return
+        self.current = None
+        self.interrupted += 1
+        self.player.stop()
+        self.player.setMedia(QMediaContent())
+    
+    def on_media_status_changed(self, status):
+        if status == QMediaPlayer.EndOfMedia and self.current is not None:
+            self.current = None
+            self.completed += 1
+            self.player.setMedia(QMediaContent())
+    
+    def is_playing(self):
+        return self.current is not None
+    
+    def stats(self):
+        return {
+            "clips_ready": len(self.clips),
+            "started": self.started,
+            "completed": self.completed,
+            "interrupted": self.interrupted,
+            "silent": self.silent,
+            "render_ms": round(self.render_ms, 1),
+        }
+
+# ---------------------------
+# Frame Size Manifest
+# ---------------------------
+FRAME_MANIFEST_VERSION = 1
+
+class FrameManifest:
+    """
+    Persisted record of frame sizes, content hashes and mtimes.
+    Lets startup size the window from a single JSON read; a frame is only
+    opened again when its mtime or byte size no longer match the record.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.frames = {}
+        self.dirty = False
+        try:
+            with open(path, "r") as f:
+                data = json.load(f)
+            if data.get("version") == FRAME_MANIFEST_VERSION:
+                self.frames = data.get("frames", {})
+            else:
+                print(f"Frame manifest {path} has unsupported version; rebuilding")
+        except FileNotFoundError:
+            print(f"No frame manifest at {path}; it will be generated")
+        except Exception as e:
+            print(f"Error reading frame manifest {path}; rebuilding: {e}")
+    
+    @staticmethod
+    def hash_file(path):
+        with open(path, "rb") as f:
+            return hashlib.sha1(f.read()).hexdigest()
+    
+    @staticmethod
+    def read_image_size(path):
+        # PIL is only needed when a frame changed, so keep it off the startup path
+        from PIL import Image
+        with Image.open(path) as img:
+            return img.size
+    
+    def size(self, path):
+        """Frame (width, height), re-validated against the file's stat"""
+        st = os.stat(path)
+        entry = self.frames.get(path)
+        if entry and entry["mtime"] == st.st_mtime and entry["bytes"] == st.st_size:
+            return tuple(entry["size"])
+        
+        # Changed or new: a touched-but-identical file only needs its stat refreshed
+        digest = self.hash_file(path)
+        if entry and entry["sha1"] == digest:
+            frame_size = tuple(entry["size"])
+        else:
+            frame_size = self.read_image_size(path)
+        self.frames[path] = {
+            "size": list(frame_size),
+            "sha1": digest,
+            "mtime": st.st_mtime,
+            "bytes": st.st_size,
+        }
+        self.dirty = True
+        return frame_size
+    
+    def sizes(self, paths):
+        """Sizes for every readable path, saving the manifest if anything changed"""
+        result = {}
+        for path in paths:
+            try:
+                result[path] = self.size(path)
+            except Exception as e:
+                print(f"Error reading image {path}: {e}")
+        
+        # Forget frames that no longer exist
+        for path in [p for p in self.frames if p not in result and not os.path.exists(p)]:
+            del self.frames[path]
+            self.dirty = True
+        
+        if self.dirty:
+            self.save()
+        return result
+    
+    def save(self):
+        try:
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({"version": FRAME_MANIFEST_VERSION, "frames": self.frames}, f, indent=1)
+            os.replace(tmp_path, self.path)
+            self.dirty = False
+            print(f"Frame manifest saved with {len(self.frames)} frames")
+        except Exception as e:
+            print(f"Error saving frame manifest {self.path}: {e}")
+
+# ---------------------------
+# Frame Cache
+# ---------------------------
+class FrameCache:
+    """
+    Decode-once store for animation frames.
+    Each animation is decoded the first time it is requested and the same
+    list of QPixmaps is handed out on every later call, so callers must
+    treat the returned lists as read-only.
+    Pinned animations stay resident; the rest are evicted least recently
+    used first whenever resident pixmap memory exceeds budget_bytes.
+    Frames with identical decoded pixels are interned, so every animation
+    that contains them references one shared QPixmap.
+    decoder: callable taking a frame name and returning a QPixmap
+    """
+    def __init__(self, decoder, budget_bytes=None, pinned=()):
+        self.decoder = decoder
+        self.budget_bytes = budget_bytes
+        self.pinned = set(pinned)
+        self.entries = OrderedDict()  # key -> frames, least recently used first
+        self.entry_digests = {}  # key -> content digest of each frame
+        self.interned = {}  # digest -> [pixmap, reference count, bytes]
+        self.resident_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.decoded_frames = 0
+        self.decode_time = 0.0
+        self.dedup_frames = 0
+        self.dedup_bytes = 0
+    
+    @staticmethod
+    def pixmap_bytes(pixmap):
+        return pixmap.width() * pixmap.height() * pixmap.depth() // 8
+    
+    @staticmethod
+    def frame_digest(pixmap):
+        """Hash of the decoded pixels, independent of which file they came from"""
+        image = pixmap.toImage()
+        bits = image.constBits()
+        bits.setsize(image.sizeInBytes())
+        digest = hashlib.sha1(bytes(bits))
+        digest.update(f"{image.width()}x{image.height()}:{image.format()}".encode())
+        return digest.hexdigest()
+    
+    def intern(self, pixmap):
+        """Return the shared pixmap with the same content, registering it if new"""
+        digest = self.frame_digest(pixmap)
+        entry = self.interned.get(digest)
+        if entry is None:
+            size = self.pixmap_bytes(pixmap)
+            self.interned[digest] = [pixmap, 1, size]
+            self.resident_bytes += size
+        else:
+            entry[1] += 1
+            self.dedup_frames += 1
+            self.dedup_bytes += entry[2]
+            pixmap = entry[0]
+        return digest, pixmap
+    
+    def release(self, digest):
+        entry = self.interned[digest]
+        entry[1] -= 1
+        if entry[1] == 0:
+            del self.interned[digest]
+            self.resident_bytes -= entry[2]
+    
+    def get(self, key, paths):
+        """Return the shared pixmap list for key, decoding paths on a miss"""
+        frames = self.entries.get(key)
+        if frames is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return frames
+        
+        self.misses += 1
+        start = time.perf_counter()
+        frames = []
+        digests = []
+        for file_path in paths:
+            pixmap = self.decoder(file_path)
+            if not pixmap.isNull():
+                digest, pixmap = self.intern(pixmap)
+                frames.append(pixmap)
+                digests.append(digest)
+            else:
+                print(f"Error decoding frame {file_path}")
+        elapsed = time.perf_counter() - start
+        
+        self.decoded_frames += len(frames)
+        self.decode_time += elapsed
+        self.entries[key] = frames
+        self.entry_digests[key] = digests
+        print(f"FrameCache: decoded {len(frames)} frames for {key} in {elapsed * 1000:.1f}ms")
+        
+        self.enforce_budget(keep=key)
+        return frames
+    
+    def contains(self, key):
+        return key in self.entries
+    
+    def evict(self, key):
+        """Drop one decoded animation; playing copies stay alive until they finish"""
+        if key in self.entries:
+            del self.entries[key]
+            for digest in self.entry_digests.pop(key):
+                self.release(digest)
+            self.evictions += 1
+    
+    def enforce_budget(self, keep=None):
+        """Evict unpinned animations, oldest first, until under budget"""
+        if self.budget_bytes is None:
+            return
+        for key in list(self.entries):
+            if self.resident_bytes <= self.budget_bytes:
+                break
+            if key in self.pinned or key == keep:
+                continue
+            resident = self.resident_bytes
+            self.evict(key)
+            print(f"FrameCache: evicted {key}, freed {(resident - self.resident_bytes) / 1048576:.1f}MB")
+    
+    def clear(self):
+        """Drop every decoded animation"""
+        self.entries.clear()
+        self.entry_digests.clear()
+        self.interned.clear()
+        self.resident_bytes = 0
+    
+    def stats(self):
+        """Hit/miss counts, decode time and resident pixmap memory"""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "animations": len(self.entries),
+            "decoded_frames": self.decoded_frames,
+            "decode_ms": self.decode_time * 1000,
+            "resident_bytes": self.resident_bytes,
+            "budget_bytes": self.budget_bytes,
+            "unique_frames": len(self.interned),
+            "dedup_frames": self.dedup_frames,
+            "dedup_bytes": self.dedup_bytes,
+        }
+    
+    def summary(self):
+        stats = self.stats()
+        budget = f"{stats['budget_bytes'] / 1048576:.1f}MB" if stats["budget_bytes"] is not None else "unlimited"
+        return (f"FrameCache: {stats['hits']} hits, {stats['misses']} misses "
+                f"({stats['hit_rate']:.1%} hit rate), {stats['decoded_frames']} frames "
+                f"decoded in {stats['decode_ms']:.1f}ms, "
+                f"{stats['resident_bytes'] / 1048576:.1f}MB resident of {budget}, "
+                f"{stats['evictions']} evictions, {stats['dedup_frames']} duplicate frames "
+                f"shared ({stats['dedup_bytes'] / 1048576:.1f}MB saved)")
+
+# ---------------------------
+# Animation Helper
+# ---------------------------
+ANIMATION_TYPES = ["idle", "arrive", "goodbye", "backflip", "glasses", "wave", "talking"]
+PINNED_ANIMATIONS = ["idle", "talking", "nothing"]  # always resident
+ATLAS_INDEX_VERSION = 1
+# Uncompressed sheet pixels: magic, source PNG size and mtime, width, height, bytes per line
+SHEET_PIXELS_HEADER = struct.Struct("<8sQQIII")
+SHEET_PIXELS_MAGIC = b"BZSHEET1"
+
+def user_cache_dir():
+    """Per-user directory for files derived from the app's own data, which may sit in a read-only bundle"""
+    configured = CONFIG.get("user_cache_dir")
+    if configured:
+        return os.path.expanduser(configured)
+    location = QtCore.QStandardPaths.writableLocation(QtCore.QStandardPaths.GenericCacheLocation)
+    return os.path.join(location or os.path.join(os.path.expanduser("~"), ".cache"), "BonziBuddy")
+
+class Animation:
+    def __init__(self):
+        self.animations = {}
+        self.atlas_frames = {}  # frame name -> (sheet path, (x, y, w, h))
+        self.atlas_pixels = {}  # sheet path -> (pixels path, width, height, bytes per line), or None if unwritable
+        self.atlas_sheets = {}  # sheet path -> QImage, held only while one animation is being cut
+        self.device_pixel_ratio = 1.0
+        budget_mb = CONFIG.get("frame_cache_budget_mb", 12)
+        self.budget_bytes = int(budget_mb * 1048576) if budget_mb else None
+        self.frame_cache = FrameCache(
+            self.load_frame,
+            budget_bytes=self.budget_bytes,
+            pinned=PINNED_ANIMATIONS
+        )
+        
+        # Prefer the packed atlas built by build_atlas.py, fall back to loose PNGs
+        atlas_index = CONFIG.get("atlas_index", "atlas.json")
+        if not (CONFIG.get("use_atlas", True) and self.load_atlas_index(atlas_index)):
+            for anim_type in ANIMATION_TYPES:
+                files = sorted(glob.glob(f"{anim_type}/*.png"))
+                if files:
+                    self.animations[anim_type] = files
+                    print(f"Loaded {len(files)} frames for {anim_type} animation")
+                else:
+                    print(f"No frames found for {anim_type} animation")
+        
+        # Set "nothing" animation to a frame from idle
+        if "idle" in self.animations and self.animations["idle"]:
+            self.animations["nothing"] = [self.animations["idle"][0]]
+        else:
+            self.animations["nothing"] = []
+    
+    def load_atlas_index(self, index_path):
+        """Load frame rects from an atlas index; returns False if unusable"""
+        if not os.path.exists(index_path):
+            return False
+        try:
+            with open(index_path, "r") as f:
+                index = json.load(f)
+            if index.get("version") != ATLAS_INDEX_VERSION:
+                print(f"Atlas index {index_path} has unsupported version {index.get('version')}")
+                return False
+            
+            for anim_type, frames in index.get("animations", {}).items():
+                names = []
+                for frame in frames:
+                    if not os.path.exists(frame["sheet"]):
+                        raise FileNotFoundError(frame["sheet"])
+                    self.atlas_frames[frame["name"]] = (frame["sheet"], tuple(frame["rect"]))
+                    names.append(frame["name"])
+                self.animations[anim_type] = names
+                print(f"Loaded {len(names)} frames for {anim_type} animation from atlas")
+            return bool(self.animations)
+        except Exception as e:
+            print(f"Error loading atlas index {index_path}; using loose frames: {e}")
+            self.animations.clear()
+            self.atlas_frames.clear()
+            return False
+    
+    def load_sheet(self, sheet_path):
+        """Decode an atlas sheet; callers drop it once they have cut their frames"""
+        sheet = self.atlas_sheets.get(sheet_path)
+        if sheet is None:
+            with open(sheet_path, "rb") as f:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    image = QtGui.QImage.fromData(mapped[:], "PNG")
+            sheet = image.convertToFormat(QtGui.QImage.Format_ARGB32_Premultiplied)
+            self.atlas_sheets[sheet_path] = sheet
+        return sheet
+    
+    def sheet_pixels_path(self, sheet_path, source):
+        """Where a sheet's uncompressed copy lives: the user cache dir, named for the sheet's hash and mtime"""
+        digest = hashlib.sha1()
+        with open(sheet_path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        stem = os.path.splitext(os.path.basename(sheet_path))[0]
+        return os.path.join(user_cache_dir(), "sheets", f"{stem}-{digest.hexdigest()[:16]}-{source.st_mtime_ns}.argb")
+    
+    def sheet_pixels(self, sheet_path):
+        """
+        Uncompressed copy of a sheet's pixels in the user cache dir, written
+        the first time the sheet is used. Frames are cut straight out of the
+        memory-mapped file, so the decoded sheet, bigger than the whole frame
+        budget, never stays resident.
+        Returns (pixels path, width, height, bytes per line), or None if the
+        copy can't be written.
+        """
+        if sheet_path in self.atlas_pixels:
+            return self.atlas_pixels[sheet_path]
+        source = os.stat(sheet_path)
+        pixels_path = self.sheet_pixels_path(sheet_path, source)
+        info = None
+        try:
+            with open(pixels_path, "rb") as f:
+                magic, size, mtime, width, height, stride = SHEET_PIXELS_HEADER.unpack(f.read(SHEET_PIXELS_HEADER.size))
+            if (magic, size, mtime) == (SHEET_PIXELS_MAGIC, source.st_size, source.st_mtime_ns):
+                info = (pixels_path, width, height, stride)
+        except (OSError, struct.error):
+            pass
+        
+        if info is None:
+            start = time.perf_counter()
+            sheet = self.load_sheet(sheet_path)
+            bits = sheet.constBits()
+            bits.setsize(sheet.sizeInBytes())
+            header = SHEET_PIXELS_HEADER.pack(SHEET_PIXELS_MAGIC, source.st_size, source.st_mtime_ns,
+                                              sheet.width(), sheet.height(), sheet.bytesPerLine())
+            try:
+                os.makedirs(os.path.dirname(pixels_path), exist_ok=True)
+                tmp_path = f"{pixels_path}.{os.getpid()}.tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(header)
+                    f.write(bits.asstring())
+                os.replace(tmp_path, pixels_path)
+                info = (pixels_path, sheet.width(), sheet.height(), sheet.bytesPerLine())
+                print(f"Animation: wrote {pixels_path} in {(time.perf_counter() - start) * 1000:.0f}ms")
+            except OSError as e:
+                print(f"Animation: can't write {pixels_path}, decoding the sheet per animation instead: {e}")
+            else:
+                # Copies of earlier builds of this sheet are dead weight
+                stem = os.path.basename(pixels_path).rsplit("-", 2)[0]
+                for stale in glob.glob(os.path.join(os.path.dirname(pixels_path), f"{glob.escape(stem)}-{'[0-9a-f]' * 16}-*.argb")):
+                    if stale != pixels_path:
+                        try:
+                            os.remove(stale)
+                        except OSError:
+                            pass
+        self.atlas_pixels[sheet_path] = info
+        return info
+    
+    def cut_frame(self, sheet_path, rect):
+        """Copy one frame out of its sheet, reading only the rows it covers"""
+        x, y, w, h = rect
+        info = self.sheet_pixels(sheet_path)
+        if info is None:
+            return QtGui.QPixmap.fromImage(self.load_sheet(sheet_path).copy(QtCore.QRect(*rect)))
+        pixels_path, width, height, stride = info
+        offset = SHEET_PIXELS_HEADER.size + y * stride
+        with open(pixels_path, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                rows = mapped[offset:offset + h * stride]
+        image = QtGui.QImage(rows, width, h, stride, QtGui.QImage.Format_ARGB32_Premultiplied)
+        return QtGui.QPixmap.fromImage(image.copy(x, 0, w, h))
+    
+    def load_frame(self, name):
+        """
+        Decode a single frame, cutting it out of its atlas sheet if packed.
+        On HiDPI screens the frame is smooth-scaled once to device pixels so
+        Qt doesn't have to rescale it every time it is painted.
+        """
+        if name in self.atlas_frames:
+            pixmap = self.cut_frame(*self.atlas_frames[name])
+        else:
+            pixmap = QtGui.QPixmap(name)
+        
+        ratio = self.device_pixel_ratio
+        if ratio != 1.0 and not pixmap.isNull():
+            pixmap = pixmap.scaled(
+                round(pixmap.width() * ratio), round(pixmap.height() * ratio),
+                QtCore.Qt.IgnoreAspectRatio, QtCore.Qt.SmoothTransformation
+            )
+            pixmap.setDevicePixelRatio(ratio)
+        return pixmap
+    
+    def set_device_pixel_ratio(self, ratio):
+        """
+        Switch frame variants to a new device pixel ratio.
+        Returns True if decoded frames were dropped and must be fetched again.
+        """
+        if not CONFIG.get("hidpi_prescale", True):
+            ratio = 1.0
+        if ratio == self.device_pixel_ratio:
+            return False
+        print(f"Animation: device pixel ratio {self.device_pixel_ratio} -> {ratio}, regenerating frames")
+        self.device_pixel_ratio = ratio
+        # Pre-scaled frames take ratio² the memory; scale the budget so the same animations fit
+        if self.budget_bytes is not None:
+            self.frame_cache.budget_bytes = int(self.budget_bytes * ratio * ratio)
+        self.frame_cache.clear()
+        return True
+    
+    def frame_size(self, name):
+        """Frame (width, height) known without decoding, or None"""
+        if name in self.atlas_frames:
+            return self.atlas_frames[name][1][2:]
+        return None
+    
+    def get_frames(self, key):
+        """Get all frame filenames for an animation type"""
+        return self.animations.get(key, [])
+    
+    def get_pixmaps(self, key):
+        """Get all frames as shared QPixmap objects (decoded once, do not modify)"""
+        frames = self.frame_cache.get(key, self.get_frames(key))
+        # Only set when the pixels copy couldn't be written; don't keep a whole decoded sheet around
+        self.atlas_sheets.clear()
+        return frames
+    
+    def prefetch(self, keys):
+        """Decode animations that are about to play, one per event loop pass"""
+        if not CONFIG.get("prefetch_animations", True):
+            return
+        for key in keys:
+            if key in self.animations and not self.frame_cache.contains(key):
+                QtCore.QTimer.singleShot(0, lambda key=key: self.get_pixmaps(key))
+
+# ---------------------------
+# Animation Clock
+# ---------------------------
+class AnimationTrack:
+    """A frame sequence scheduled on the AnimationClock"""
+    def __init__(self, name, frames, interval_ms, loop=False, on_finished=None):
+        self.name = name
+        self.frames = frames
+        self.interval = interval_ms / 1000.0
+        self.loop = loop
+        self.on_finished = on_finished
+        self.start_time = 0.0
+        self.step = 0  # frames elapsed since start; wraps onto frames for loops
+    
+    def start(self, now):
+        self.start_time = now
+        self.step = 0
+    
+    def step_at(self, now):
+        # The epsilon keeps a wakeup exactly on a deadline from rounding down
+        return int((now - self.start_time) / self.interval + 1e-6)
+    
+    def deadline(self, step):
+        return self.start_time + step * self.interval
+    
+    def finished_at(self, step):
+        return not self.loop and step >= len(self.frames)
+    
+    def frame(self, step):
+        return self.frames[step % len(self.frames)]
+
+class AnimationClock(QtCore.QObject):
+    """
+    Drives every animation from one precise single-shot timer.
+    A looping base track (idle, talking) plays whenever no one-shot track is
+    active; one-shot tracks (wave, arrive, ...) run in queue order in front
+    of it. Frame indices come from wall-clock deadlines, so when the event
+    loop lags the clock skips ahead instead of piling up late frames, and
+    the timer stops entirely when nothing on screen can change.
+    render: callable receiving each QPixmap to show
+    """
+    frameShown = QtCore.pyqtSignal(str, int, float)  # track name, frame index, lateness in ms
+    
+    def __init__(self, render, interval_ms=100, parent=None):
+        super().__init__(parent)
+        self.render = render
+        self.interval_ms = interval_ms
+        self.base = None
+        self.active = None
+        self.queue = deque()
+        self.next_deadline = None
+        self.suspended = False
+        self.total_wakeups = 0
+        
+        self.timer = QtCore.QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setTimerType(QtCore.Qt.PreciseTimer)
+        self.timer.timeout.connect(self.tick)
+        
+        self.reset_stats()
+    
+    def reset_stats(self):
+        self.wakeups = 0
+        self.frames_shown = 0
+        self.frames_dropped = 0
+        self.lateness_total = 0.0
+        self.lateness_max = 0.0
+        self.stats_since = time.monotonic()
+    
+    # --- Public API ---
+    def set_base(self, name, frames, interval_ms=None):
+        """Replace the looping background animation"""
+        self.base = AnimationTrack(name, frames, interval_ms or self.interval_ms, loop=True)
+        if self.active is None:
+            self._start(self.base)
+        self._schedule()
+    
+    def play(self, name, frames, on_finished=None, preempt=False, interval_ms=None):
+        """
+        Queue a one-shot animation behind any already playing.
+        preempt: cancel the active and queued animations and start now
+        """
+        track = AnimationTrack(name, frames, interval_ms or self.interval_ms, on_finished=on_finished)
+        if preempt:
+            self.cancel()
+        if self.active is None:
+            self.active = track
+            self._start(track)
+        else:
+            self.queue.append(track)
+        self._schedule()
+        return track
+    
+    def cancel(self, name=None):
+        """
+        Drop queued and active one-shots (only those called name, if given)
+        without running their callbacks. Returns how many were cancelled.
+        """
+        cancelled = 0
+        for track in list(self.queue):
+            if name is None or track.name == name:
+                self.queue.remove(track)
+                cancelled += 1
+        if self.active is not None and (name is None or self.active.name == name):
+            self.active = None
+            cancelled += 1
+            self._start_next(time.monotonic())
+        self._schedule()
+        return cancelled
+    
+    def set_base_interval(self, interval_ms):
+        """Change the base loop's frame rate without restarting it"""
+        if self.base is None:
+            return
+        now = time.monotonic()
+        self.base.interval = interval_ms / 1000.0
+        self.base.start_time = now - self.base.step * self.base.interval
+        self._schedule()
+    
+    def suspend(self):
+        """Freeze on the current frame and stop waking up"""
+        self.suspended = True
+        self.timer.stop()
+        self.next_deadline = None
+    
+    def resume(self):
+        """Continue from the frame shown when suspended"""
+        if not self.suspended:
+            return
+        self.suspended = False
+        track = self.active or self.base
+        if track is not None:
+            track.start_time = time.monotonic() - track.step * track.interval
+        self._schedule()
+    
+    def is_playing(self, name=None):
+        """True while a one-shot (or the named one-shot) is active or queued"""
+        tracks = ([self.active] if self.active else []) + list(self.queue)
+        return any(name is None or track.name == name for track in tracks)
+    
+    def stats(self):
+        """Wakeup, frame and timer lateness counters since the last reset"""
+        elapsed = max(time.monotonic() - self.stats_since, 1e-6)
+        return {
+            "wakeups": self.wakeups,
+            "wakeups_per_second": self.wakeups / elapsed,
+            "frames_shown": self.frames_shown,
+            "frames_dropped": self.frames_dropped,
+            "mean_lateness_ms": self.lateness_total / self.wakeups if self.wakeups else 0.0,
+            "max_lateness_ms": self.lateness_max,
+        }
+    
+    # --- Scheduling ---
+    def tick(self):
+        now = time.monotonic()
+        lateness = max(0.0, (now - self.next_deadline) * 1000) if self.next_deadline else 0.0
+        self.wakeups += 1
+        self.total_wakeups += 1
+        self.lateness_total += lateness
+        self.lateness_max = max(self.lateness_max, lateness)
+        
+        track = self.active or self.base
+        if track is not None:
+            step = track.step_at(now)
+            if track is self.active and track.finished_at(step):
+                self._finish_active(now)
+            elif step > track.step:
+                self.frames_dropped += step - track.step - 1
+                track.step = step
+                self._show(track, lateness)
+        self._schedule()
+    
+    def _start(self, track):
+        track.start(time.monotonic())
+        if track.frames:
+            self._show(track, 0.0)
+    
+    def _show(self, track, lateness):
+        index = track.step % len(track.frames)
+        self.render(track.frames[index])
+        self.frames_shown += 1
+        self.frameShown.emit(track.name, index, lateness)
+    
+    def _start_next(self, now):
+        if self.queue:
+            self.active = self.queue.popleft()
+            self._start(self.active)
+        elif self.base is not None:
+            self._start(self.base)
+    
+    def _finish_active(self, now):
+        track = self.active
+        self.active = None
+        self._start_next(now)
+        if track.on_finished:
+            try:
+                track.on_finished()
+            except Exception as e:
+                print(f"Error in {track.name} animation callback: {e}")
+                traceback.print_exc()
+    
+    def _schedule(self):
+        track = self.active or self.base
+        if self.suspended or track is None or not track.frames or (track.loop and len(track.frames) == 1):
+            # Nothing will change on screen; sleep until the next set_base/play
+            self.timer.stop()
+            self.next_deadline = None
+            return
+        self.next_deadline = track.deadline(track.step + 1)
+        delay_ms = math.ceil((self.next_deadline - time.monotonic()) * 1000)
+        self.timer.start(max(0, delay_ms))
+
+# ---------------------------
+# Power Management
+# ---------------------------
+class PowerManager(QtCore.QObject):
+    """
+    Cuts timer wakeups when nobody is looking.
+    After power_slow_after_s without interaction the idle loop drops to
+    power_slow_interval_ms per frame. After power_still_after_s, or
+    whenever the widget is hidden, occluded or the session is suspended,
+    the clock freezes on its current frame and registered timers stop.
+    Any interaction restores full speed immediately.
+    """
+    def __init__(self, clock, parent=None):
+        super().__init__(parent)
+        self.clock = clock
+        self.enabled = CONFIG.get("power_saving", True)
+        self.normal_interval_ms = clock.interval_ms
+        self.slow_interval_ms = CONFIG.get("power_slow_interval_ms", 250)
+        self.slow_after = CONFIG.get("power_slow_after_s", 60)
+        self.still_after = CONFIG.get("power_still_after_s", 300)
+        
+        self.timers = []  # (timer, interval_ms) pairs stopped while suspended
+        self.timer_wakeups = 0
+        self.exposed = True
+        self.session_active = True
+        self.state = "active"
+        self.started = time.monotonic()
+        self.last_activity = self.started
+        self.state_since = self.started
+        self.wakeups_at_state_change = 0
+        
+        # Single-shot: only wakes at the next inactivity threshold
+        self.inactivity_timer = QtCore.QTimer(self)
+        self.inactivity_timer.setSingleShot(True)
+        self.inactivity_timer.timeout.connect(self.on_inactivity_timeout)
+        
+        app = QtWidgets.QApplication.instance()
+        if app is not None:
+            app.applicationStateChanged.connect(self.on_application_state_changed)
+        
+        self.update_state()
+    
+    def register_timer(self, timer):
+        """Stop this repeating timer while suspended and count its wakeups"""
+        self.timers.append((timer, timer.interval()))
+        timer.timeout.connect(self.count_timer_wakeup)
+        if self.state == "suspended":
+            timer.stop()
+    
+    def count_timer_wakeup(self):
+        self.timer_wakeups += 1
+    
+    def on_inactivity_timeout(self):
+        self.timer_wakeups += 1
+        self.update_state()
+    
+    # --- Inputs ---
+    def note_activity(self):
+        """Call on any user interaction or speech"""
+        self.last_activity = time.monotonic()
+        self.update_state()
+    
+    def set_exposed(self, exposed):
+        if exposed != self.exposed:
+            self.exposed = exposed
+            if exposed:
+                self.last_activity = time.monotonic()
+            self.update_state()
+    
+    def on_application_state_changed(self, state):
+        # Inactive just means another app has focus, which is normal for Bonzi
+        self.session_active = state not in (QtCore.Qt.ApplicationSuspended, QtCore.Qt.ApplicationHidden)
+        if self.session_active:
+            self.last_activity = time.monotonic()
+        self.update_state()
+    
+    def eventFilter(self, obj, event):
+        # Installed on the window handle to notice occlusion
+        if event.type() == QtCore.QEvent.Expose:
+            self.set_exposed(obj.isExposed())
+        return False
+    
+    # --- State ---
+    def desired_state(self, now):
+        if not self.enabled:
+            return "active"
+        if not self.exposed or not self.session_active:
+            return "suspended"
+        inactive = now - self.last_activity
+        if inactive >= self.still_after:
+            return "suspended"
+        if inactive >= self.slow_after:
+            return "slow"
+        return "active"
+    
+    def update_state(self):
+        now = time.monotonic()
+        state = self.desired_state(now)
+        if state != self.state:
+            self.apply(state, now)
+        
+        # Sleep until the next threshold can change the state
+        self.inactivity_timer.stop()
+        if self.enabled and state != "suspended":
+            threshold = self.slow_after if state == "active" else self.still_after
+            remaining = threshold - (now - self.last_activity)
+            self.inactivity_timer.start(max(0, int(remaining * 1000)))
+    
+    def apply(self, state, now):
+        print(f"POWER: {self.state} -> {state} "
+              f"({self.recent_wakeups_per_minute(now):.0f} wakeups/min while {self.state})")
+        if state == "suspended":
+            self.clock.suspend()
+            for timer, _ in self.timers:
+                timer.stop()
+        else:
+            interval = self.slow_interval_ms if state == "slow" else self.normal_interval_ms
+            self.clock.set_base_interval(interval)
+            self.clock.resume()
+            if self.state == "suspended":
+                for timer, interval_ms in self.timers:
+                    timer.start(interval_ms)
+        
+        self.state = state
+        self.state_since = now
+        self.wakeups_at_state_change = self.total_wakeups()
+    
+    # --- Metrics ---
+    def total_wakeups(self):
+        return self.clock.total_wakeups + self.timer_wakeups
+    
+    def recent_wakeups_per_minute(self, now=None):
+        now = now or time.monotonic()
+        elapsed = max(now - self.state_since, 1e-6)
+        return (self.total_wakeups() - self.wakeups_at_state_change) * 60 / elapsed
+    
+    def stats(self):
+        now = time.monotonic()
+        return {
+            "state": self.state,
+            "wakeups": self.total_wakeups(),
+            "wakeups_per_minute": self.total_wakeups() * 60 / max(now - self.started, 1e-6),
+            "state_wakeups_per_minute": self.recent_wakeups_per_minute(now),
+        }
+
+# ---------------------------
+# Resilience: Retries and Circuit Breaker
+# ---------------------------
+# Statuses worth retrying: timeouts, conflicts, rate limits and overloaded or failing servers
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504, 529}
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a backend whose circuit breaker is open"""
+
+class CircuitBreaker:
+    """
+    Fails fast while a backend is unhealthy.
+    After failure_threshold consecutive failures the breaker opens and calls
+    are refused for reset_after_s. Then a single trial call is let through
+    (half-open); its outcome closes the breaker or opens it again.
+    """
+    def __init__(self, name, failure_threshold=5, reset_after_s=30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_after_s = reset_after_s
+        self.lock = threading.Lock()
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+        self.calls = 0
+        self.failures = 0
+        self.rejected = 0
+        self.retries = 0
+        self.opens = 0
+    
+    def allow(self):
+        """True if a call may go ahead; counts it as started"""
+        with self.lock:
+            if self.state == "open":
+                if time.monotonic() - self.opened_at < self.reset_after_s:
+                    self.rejected += 1
+                    return False
+                self.state = "half_open"
+                self.trial_in_flight = False
+            if self.state == "half_open":
+                if self.trial_in_flight:
+                    self.rejected += 1
+                    return False
+                self.trial_in_flight = True
+            self.calls += 1
+            return True
+    
+    def is_open(self):
+        """True while calls would be refused, without starting one"""
+        with self.lock:
+            return self.state == "open" and time.monotonic() - self.opened_at < self.reset_after_s
+    
+    def record_success(self):
+        with self.lock:
+            self.state = "closed"
+            self.consecutive_failures = 0
+            self.trial_in_flight = False
+    
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.consecutive_failures += 1
+            if self.state == "half_open" or self.consecutive_failures >= self.failure_threshold:
+                if self.state != "open":
+                    self.opens += 1
+                    print(f"CircuitBreaker: {self.name} is unhealthy; failing fast for {self.reset_after_s:.0f}s")
+                self.state = "open"
+                self.opened_at = time.monotonic()
+            self.trial_in_flight = False
+    
+    def release(self):
+        """The call ended without telling us anything about the backend's health"""
+        with self.lock:
+            self.trial_in_flight = False
+    
+    def stats(self):
+        with self.lock:
+            return {
+                "state": self.state,
+                "calls": self.calls,
+                "failures": self.failures,
+                "consecutive_failures": self.consecutive_failures,
+                "retries": self.retries,
+                "rejected": self.rejected,
+                "opens": self.opens,
+            }
+
+def is_retryable(error):
+    """Network errors, timeouts and overload statuses are worth another try"""
+    if isinstance(error, (asyncio.TimeoutError, ConnectionError)):
+        return True
+    if ANTHROPIC_AVAILABLE and isinstance(error, (APIConnectionError, httpx.TransportError)):
+        return True
+    return getattr(error, "status_code", None) in RETRYABLE_STATUS
+
+def backoff_delay(attempt, base_s, max_s):
+    """Exponential backoff with full jitter, so clients don't retry in lockstep"""
+    return random.uniform(0, min(max_s, base_s * 2 ** attempt))
+
+async def call_with_retry(breaker, call, retries=None, should_retry=None):
+    """
+    Await call() through the breaker, retrying retryable errors with
+    jittered exponential backoff. should_retry(error) can veto a retry,
+    e.g. once a streamed reply has already been shown.
+    """
+    if retries is None:
+        retries = CONFIG.get("llm_max_retries", 2)
+    base_s = CONFIG.get("retry_base_delay_s", 0.5)
+    max_s = CONFIG.get("retry_max_delay_s", 8.0)
+    attempt = 0
+    while True:
+        if not breaker.allow():
+            raise CircuitOpenError(f"{breaker.name} circuit is open")
+        try:
+            result = await call()
+        except asyncio.CancelledError:
+            breaker.release()
+            raise
+        except Exception as e:
+            retryable = is_retryable(e)
+            if retryable:
+                breaker.record_failure()
+            else:
+                breaker.release()
+            if not retryable or attempt >= retries or (should_retry and not should_retry(e)):
+                raise
+            delay = backoff_delay(attempt, base_s, max_s)
+            breaker.retries += 1
+            attempt += 1
+            print(f"{breaker.name}: {e}; retry {attempt}/{retries} in {delay:.2f}s")
+            await asyncio.sleep(delay)
+            continue
+        breaker.record_success()
+        return result
+
+# ---------------------------
+# Streaming Response Parser
+# ---------------------------
+JSON_ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+STRING_RUN = re.compile(r'[^"\\]+')
+PROSE_RUN = re.compile(r'[^{]+')
+DIALOGUE_OPENING = '{"dialogue"'
+CODE_FENCE = re.compile(r'```[\w-]*')
+
+class StreamingResponseParser:
+    """
+    Single-pass parser for the reply format SYSTEM_PROMPT asks for:
+    {"dialogue": "...", "wave": true, "backflip": false, ...}
+    
+    Chunks are fed as they stream in. Dialogue is passed to on_dialogue as
+    soon as it is inside the string, and each animation flag to on_animation
+    as soon as its value is complete. Braces and quotes inside the dialogue
+    are handled like any JSON string. A { only opens the object when it is
+    followed by "dialogue", so braces in a preamble or in a plain-text answer
+    are left alone. Text outside the object is never streamed; when the
+    stream ends without any dialogue the whole reply, minus code fences, is
+    used instead.
+    """
+    ANIMATION_KEYS = ("wave", "backflip", "glasses", "goodbye")
+    
+    def __init__(self, on_dialogue=None, on_animation=None):
+        self.on_dialogue = on_dialogue
+        self.on_animation = on_animation
+        self.state = "prose"
+        self.string_target = None  # "key" or "value" while inside a string
+        self.key = None
+        self.matched = 0           # characters of DIALOGUE_OPENING seen so far
+        self.token = []
+        self.escape = None         # "" after a backslash, "u..." inside \uXXXX
+        self.high_surrogate = None
+        self.nested_depth = 0
+        self.nested_string = False
+        self.nested_escape = False
+        self.fields = {}
+        self.has_dialogue = False
+        self.dialogue = []
+        self.text = []
+        self.animations = []
+    
+    def feed(self, chunk):
+        """Consume the next piece of the streamed reply"""
+        self.text.append(chunk)
+        if self.state == "done":
+            return
+        i = 0
+        n = len(chunk)
+        while i < n:
+            # Copy runs of plain characters in one step
+            if self.state == "string" and self.escape is None:
+                match = STRING_RUN.match(chunk, i)
+                if match:
+                    self.string_text(match.group())
+                    i = match.end()
+                    continue
+            elif self.state == "prose":
+                match = PROSE_RUN.match(chunk, i)
+                if match:
+                    i = match.end()
+                    continue
+            self.step(chunk[i])
+            i += 1
+    
+    def step(self, ch):
+        state = self.state
+        if state == "prose":
+            if ch == "{":
+                self.state = "opening"
+                self.matched = 1
+        elif state == "opening":
+            self.opening_char(ch)
+        elif state == "string":
+            self.string_char(ch)
+        elif state == "key_start":
+            if ch == '"':
+                self.begin_string("key")
+            elif ch == "}":
+                self.state = "done"
+        elif state == "colon":
+            if ch == ":":
+                self.state = "value_start"
+        elif state == "value_start":
+            if ch == '"':
+                self.begin_string("value")
+            elif ch in "{[":
+                self.state = "nested"
+                self.nested_depth = 1
+            elif not ch.isspace():
+                self.state = "literal"
+                self.token = [ch]
+        elif state == "literal":
+            if ch in ",}" or ch.isspace():
+                self.set_field(self.parse_literal("".join(self.token)))
+                self.state = "after_value"
+                self.step(ch)
+            else:
+                self.token.append(ch)
+        elif state == "after_value":
+            if ch == ",":
+                self.state = "key_start"
+            elif ch == "}":
+                self.state = "done"
+        elif state == "nested":
+            self.skip_nested(ch)
+    
+    def opening_char(self, ch):
+        """Decide whether the { just seen opens the reply or is part of the prose"""
+        if ch == DIALOGUE_OPENING[self.matched]:
+            self.matched += 1
+            if self.matched == len(DIALOGUE_OPENING):
+                self.key = "dialogue"
+                self.state = "colon"
+        elif not (self.matched == 1 and ch.isspace()):
+            self.state = "prose"
+            self.step(ch)  # it may be another {
+    
+    def begin_string(self, target):
+        self.state = "string"
+        self.string_target = target
+        self.token = []
+        if target == "value" and self.key == "dialogue":
+            self.has_dialogue = True
+    
+    def string_char(self, ch):
+        if self.escape is None:
+            if ch == "\\":
+                self.escape = ""
+            elif ch == '"':
+                self.end_string()
+            else:
+                self.string_text(ch)
+        elif self.escape == "":
+            if ch == "u":
+                self.escape = "u"
+            else:
+                self.escape = None
+                self.string_text(JSON_ESCAPES.get(ch, ch))
+        else:
+            self.escape += ch
+            if len(self.escape) == 5:
+                digits, self.escape = self.escape[1:], None
+                try:
+                    code = int(digits, 16)
+                except ValueError:
+                    return
+                if 0xD800 <= code < 0xDC00:
+                    self.high_surrogate = code
+                    return
+                if 0xDC00 <= code < 0xE000 and self.high_surrogate is not None:
+                    code = 0x10000 + ((self.high_surrogate - 0xD800) << 10) + (code - 0xDC00)
+                self.string_text(chr(code))
+    
+    def string_text(self, text):
+        self.high_surrogate = None
+        if self.string_target == "value" and self.key == "dialogue":
+            self.dialogue.append(text)
+            if self.on_dialogue:
+                self.on_dialogue(text)
+        else:
+            self.token.append(text)
+    
+    def end_string(self):
+        if self.string_target == "key":
+            self.key = "".join(self.token)
+            self.state = "colon"
+        else:
+            if self.key != "dialogue":
+                self.set_field("".join(self.token))
+            self.state = "after_value"
+        self.string_target = None
+    
+    def skip_nested(self, ch):
+        """Skip over an object or array value nobody asked for"""
+        if self.nested_escape:
+            self.nested_escape = False
+        elif self.nested_string:
+            if ch == "\\":
+                self.nested_escape = True
+            elif ch == '"':
+                self.nested_string = False
+        elif ch == '"':
+            self.nested_string = True
+        elif ch in "{[":
+            self.nested_depth += 1
+        elif ch in "}]":
+            self.nested_depth -= 1
+            if self.nested_depth == 0:
+                self.set_field(None)
+                self.state = "after_value"
+    
+    @staticmethod
+    def parse_literal(token):
+        literals = {"true": True, "false": False, "null": None}
+        if token in literals:
+            return literals[token]
+        try:
+            return float(token)
+        except ValueError:
+            return token
+    
+    def set_field(self, value):
+        self.fields[self.key] = value
+        if self.key in self.ANIMATION_KEYS and value and self.key not in self.animations:
+            self.animations.append(self.key)
+            if self.on_animation:
+                self.on_animation(self.key)
+    
+    def is_complete(self):
+        return self.state == "done"
+    
+    def finish(self):
+        """Returns (dialogue, animations) for everything fed so far"""
+        if self.has_dialogue:
+            text = "".join(self.dialogue)
+        else:
+            text = CODE_FENCE.sub("", "".join(self.text))
+        
+        # Drop *action* stage directions so they aren't read aloud
+        text = re.sub(r'\*.*?\*', '', text).strip()
+        animations = [anim for anim in self.ANIMATION_KEYS if anim in self.animations]
+        return text, animations
+
+# ---------------------------
+# Response Cache
+# ---------------------------
+RESPONSE_CACHE_VERSION = 1
+# Answers to these go stale: "what day is it?" must not be replayed tomorrow
+# (May and March are left out, they are far more often a verb)
+TIME_WORDS = re.compile(r"\b(?:time|clock|o'?clock|hours?|minutes?|now|today|tonight|tomorrow|yesterday|"
+                        r"date|days?|week|weekend|month|year|morning|afternoon|evening|currently|latest|"
+                        r"monday|tuesday|wednesday|thursday|friday|saturday|sunday|"
+                        r"january|february|april|june|july|august|september|october|november|december)\b")
+
+class ResponseCache:
+    """
+    On-disk cache of API replies, one JSON file per key like the audio cache.
+    The key covers the model, a temperature bucket, a hash of the system
+    prompt and the normalized conversation window, so a hit only happens
+    when the request would have been the same. Turns that mention the time
+    or date, or that LocalIntents answers, are never cached. Entries expire
+    after ttl_s and the least recently used are removed beyond max_entries.
+    """
+    def __init__(self, directory, ttl_s=21600, max_entries=500, max_temp=1.0):
+        self.directory = directory
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self.max_temp = max_temp
+        self.lock = threading.Lock()
+        self.index = OrderedDict()  # key -> last use, oldest first
+        self.hits = 0
+        self.misses = 0
+        self.skipped = 0
+        self.time_sensitive = 0
+        self.expired = 0
+        self.evictions = 0
+        self.lookup_ms = 0.0
+        self.load_index()
+    
+    def load_index(self):
+        try:
+            entries = []
+            for name in os.listdir(self.directory):
+                if name.endswith(".json"):
+                    path = os.path.join(self.directory, name)
+                    entries.append((os.path.getmtime(path), name[:-5]))
+            for mtime, key in sorted(entries):
+                self.index[key] = mtime
+            print(f"ResponseCache: {len(self.index)} cached replies in {self.directory}")
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"ResponseCache: error reading {self.directory}: {e}")
+    
+    @staticmethod
+    def normalize(text):
+        """Case, spacing and trailing punctuation don't change the answer"""
+        return re.sub(r"\s+", " ", str(text).lower()).strip().rstrip("?!. ")
+    
+    def enabled_for(self, temperature):
+        """Replies sampled above max_temp are meant to vary, so they aren't cached"""
+        return temperature <= self.max_temp
+    
+    def cacheable_prompt(self, text):
+        """False for turns whose answer depends on when they are asked or that LocalIntents answers fresh"""
+        if TIME_WORDS.search(self.normalize(text)):
+            return False
+        return not (LOCAL_INTENTS and LOCAL_INTENTS.handles(str(text)))
+    
+    def key(self, model, temperature, system, messages):
+        if not isinstance(system, str):
+            system = json.dumps(system)
+        system_hash = hashlib.sha1(system.encode("utf-8")).hexdigest()
+        window = [(message["role"], self.normalize(message["content"])) for message in messages]
+        material = json.dumps([RESPONSE_CACHE_VERSION, model, round(temperature, 1), system_hash, window])
+        return hashlib.sha1(material.encode("utf-8")).hexdigest()
+    
+    def key_for(self, message_params):
+        """Cache key for messages.create parameters, or None if they aren't cacheable"""
+        temperature = message_params.get("temperature", 1.0)
+        if not self.enabled_for(temperature):
+            self.skipped += 1
+            return None
+        messages = message_params["messages"]
+        if messages and not self.cacheable_prompt(messages[-1]["content"]):
+            self.time_sensitive += 1
+            return None
+        return self.key(message_params["model"], temperature,
+                        message_params["system"], message_params["messages"])
+    
+    def path_for(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+    
+    def get(self, key):
+        """Returns (dialogue, animations) or None"""
+        start = time.perf_counter()
+        try:
+            with self.lock:
+                if key not in self.index:
+                    self.misses += 1
+                    return None
+                path = self.path_for(key)
+                try:
+                    with open(path, "r") as f:
+                        entry = json.load(f)
+                except Exception as e:
+                    print(f"ResponseCache: dropping unreadable entry {key}: {e}")
+                    self.remove(key)
+                    self.misses += 1
+                    return None
+                
+                if time.time() - entry.get("created", 0) > self.ttl_s:
+                    self.remove(key)
+                    self.expired += 1
+                    self.misses += 1
+                    return None
+                
+                now = time.time()
+                self.index[key] = now
+                self.index.move_to_end(key)
+                os.utime(path, (now, now))
+                self.hits += 1
+                return entry["dialogue"], list(entry.get("animations", []))
+        finally:
+            self.lookup_ms += (time.perf_counter() - start) * 1000
+    
+    def put(self, key, dialogue, animations, model=None):
+        entry = {
+            "version": RESPONSE_CACHE_VERSION,
+            "created": time.time(),
+            "model": model,
+            "dialogue": dialogue,
+            "animations": list(animations),
+        }
+        try:
+            with self.lock:
+                os.makedirs(self.directory, exist_ok=True)
+                path = self.path_for(key)
+                tmp_path = path + ".tmp"
+                with open(tmp_path, "w") as f:
+                    json.dump(entry, f)
+                os.replace(tmp_path, path)
+                self.index[key] = entry["created"]
+                self.index.move_to_end(key)
+                while self.max_entries and len(self.index) > self.max_entries:
+                    self.remove(next(iter(self.index)))
+                    self.evictions += 1
+        except Exception as e:
+            print(f"ResponseCache: error writing entry: {e}")
+    
+    def remove(self, key):
+        self.index.pop(key, None)
+        try:
+            os.remove(self.path_for(key))
+        except OSError:
+            pass
+    
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "lookup_ms_mean": self.lookup_ms / lookups if lookups else 0.0,
+            "skipped_high_temp": self.skipped,
+            "skipped_time_sensitive": self.time_sensitive,
+            "expired": self.expired,
+            "evictions": self.evictions,
+            "entries": len(self.index),
+        }
+
+RESPONSE_CACHE = None
+if CONFIG.get("response_cache", True):
+    RESPONSE_CACHE = ResponseCache(
+        CONFIG.get("response_cache_dir", "response_cache"),
+        ttl_s=CONFIG.get("response_cache_ttl_s", 21600),
+        max_entries=CONFIG.get("response_cache_max_entries", 500),
+        max_temp=CONFIG.get("response_cache_max_temp", 1.0),
+    )
+
+# ---------------------------
+# Semantic Cache
+# ---------------------------
+CONTRACTIONS = {
+    "what's": "what is", "whats": "what is", "who's": "who is", "how's": "how is", "where's": "where is",
+    "it's": "it is", "that's": "that is", "i'm": "i am", "you're": "you are",
+    "don't": "do not", "can't": "can not", "won't": "will not", "isn't": "is not",
+}
+# Politeness and filler words that don't change what is being asked
+FILLER_WORDS = {"please", "pls", "plz", "hey", "hi", "bonzi", "can", "could", "would",
+                "you", "me", "just", "a", "the", "um", "so"}
+# Words that flip or pin down what is being asked; two questions only match if these agree exactly
+NEGATION_WORDS = {"not", "no", "never", "nor", "without", "none", "nothing", "neither"}
+NUMBER_WORDS = {"zero", "one", "two", "three", "four", "five", "six", "seven", "eight", "nine", "ten",
+                "eleven", "twelve", "twenty", "thirty", "forty", "fifty", "hundred", "thousand",
+                "million", "billion", "half", "first", "second", "third", "last"}
+
+class SemanticCache:
+    """
+    Near-duplicate cache: paraphrased questions get the stored answer.
+    Questions are embedded offline as signed hashed character trigrams plus
+    whole words and compared by cosine similarity against a NumPy matrix of
+    earlier questions. Entries are scoped like ResponseCache (model,
+    temperature bucket, system prompt) plus a digest of the conversation
+    before the question, so a follow-up like "what about him?" only matches
+    within the same conversation. Similar vectors are not enough on their
+    own: numbers and negations must agree exactly, so "2018 vs 2022" or
+    "should I" vs "should I not" never share an answer.
+    The index is persisted as JSON lines, appended to on every insert, and
+    the vectors are rebuilt from the stored questions at startup.
+    """
+    DIMENSIONS = 2048
+    CANDIDATES = 5  # nearest questions checked against the exact-match guards
+    
+    def __init__(self, path, threshold=0.92, ttl_s=21600, max_entries=1000, max_temp=1.0):
+        self.path = path
+        self.threshold = threshold
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self.max_temp = max_temp
+        self.lock = threading.Lock()
+        self.entries = []
+        self.vectors = np.zeros((64, self.DIMENSIONS), dtype=np.float32)
+        self.scope_codes = {}
+        self.scopes = np.zeros(64, dtype=np.int32)
+        self.created = np.zeros(64, dtype=np.float64)
+        self.hits = 0
+        self.misses = 0
+        self.similarity_total = 0.0
+        self.lookup_ms = 0.0
+        self.load()
+    
+    @staticmethod
+    def words(text):
+        words = []
+        for word in re.findall(r"[a-z0-9']+", str(text).lower()):
+            words.extend(CONTRACTIONS.get(word, word).split())
+        kept = [word for word in words if word not in FILLER_WORDS]
+        return kept or words
+    
+    @classmethod
+    def guards(cls, text):
+        """Numbers and negations in the question, which a match has to repeat exactly"""
+        words = [CONTRACTIONS.get(word, word) for word in re.findall(r"[a-z0-9'.]+", str(text).lower())]
+        words = [w for word in words for w in word.strip(".").split()]
+        numbers = sorted(word for word in words if re.fullmatch(r"\d+(?:\.\d+)?", word) or word in NUMBER_WORDS)
+        negations = sorted(word for word in words if word in NEGATION_WORDS or word.endswith("n't"))
+        return numbers, negations
+    
+    @classmethod
+    def embed(cls, text):
+        """Unit-length signed feature-hashing vector of trigrams and words"""
+        words = cls.words(text)
+        padded = f" {' '.join(words)} "
+        features = [padded[i:i + 3] for i in range(len(padded) - 2)]
+        features += ["w:" + word for word in words]
+        
+        vector = np.zeros(cls.DIMENSIONS, dtype=np.float32)
+        for feature in features:
+            h = zlib.crc32(feature.encode("utf-8"))
+            vector[h % cls.DIMENSIONS] += -1.0 if h & 0x80000000 else 1.0
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+    
+    @staticmethod
+    def scope(message_params):
+        # The base system prompt, plus whatever came before the question: the summary and earlier turns
+        system = message_params["system"]
+        context = message_params["messages"][:-1]
+        if not isinstance(system, str):
+            context = [block["text"] for block in system[1:]] + context
+            system = system[0]["text"]
+        system_hash = hashlib.sha1(system.encode("utf-8")).hexdigest()
+        context_hash = hashlib.sha1(json.dumps(context, sort_keys=True).encode("utf-8")).hexdigest() if context else ""
+        return f"{message_params['model']}:{round(message_params.get('temperature', 1.0), 1)}:{system_hash}:{context_hash}"
+    
+    def scope_code(self, scope):
+        return self.scope_codes.setdefault(scope, len(self.scope_codes))
+    
+    def load(self):
+        entries = []
+        try:
+            with open(self.path, "r") as f:
+                for line in f:
+                    try:
+                        entries.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        continue
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            print(f"SemanticCache: error reading {self.path}: {e}")
+            return
+        
+        cutoff = time.time() - self.ttl_s
+        live = [entry for entry in entries if entry.get("created", 0) >= cutoff]
+        live = live[-self.max_entries:] if self.max_entries else live
+        for entry in live:
+            self.add(entry)
+        print(f"SemanticCache: {len(self.entries)} questions indexed from {self.path}")
+        if len(live) < len(entries):
+            self.rewrite()
+    
+    def add(self, entry):
+        """Append an entry to the in-memory index, growing the arrays as needed"""
+        row = len(self.entries)
+        if row == len(self.vectors):
+            self.vectors = np.concatenate([self.vectors, np.zeros_like(self.vectors)])
+            self.scopes = np.concatenate([self.scopes, np.zeros_like(self.scopes)])
+            self.created = np.concatenate([self.created, np.zeros_like(self.created)])
+        self.vectors[row] = self.embed(entry["prompt"])
+        self.scopes[row] = self.scope_code(entry["scope"])
+        self.created[row] = entry["created"]
+        self.entries.append(entry)
+    
+    def rewrite(self):
+        """Compact the on-disk index down to the live entries"""
+        try:
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as f:
+                for entry in self.entries:
+                    f.write(json.dumps(entry) + "\n")
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            print(f"SemanticCache: error writing {self.path}: {e}")
+    
+    def get(self, prompt, message_params):
+        """Stored (dialogue, animations) for a similar question, or None"""
+        if message_params.get("temperature", 1.0) > self.max_temp:
+            return None
+        start = time.perf_counter()
+        try:
+            with self.lock:
+                count = len(self.entries)
+                scope = self.scope_codes.get(self.scope(message_params))
+                if not count or scope is None:
+                    self.misses += 1
+                    return None
+                
+                similarity = self.vectors[:count] @ self.embed(prompt)
+                usable = (self.scopes[:count] == scope) & (self.created[:count] >= time.time() - self.ttl_s)
+                similarity = np.where(usable, similarity, -1.0)
+                guards = self.guards(prompt)
+                best = None
+                for row in np.argsort(similarity)[::-1][:self.CANDIDATES]:
+                    if similarity[row] < self.threshold:
+                        break
+                    if self.guards(self.entries[row]["prompt"]) == guards:
+                        best = int(row)
+                        break
+                if best is None:
+                    self.misses += 1
+                    return None
+                
+                entry = self.entries[best]
+                self.hits += 1
+                self.similarity_total += float(similarity[best])
+                print(f"SemanticCache: '{prompt[:50]}' matched '{entry['prompt'][:50]}' "
+                      f"(similarity {similarity[best]:.2f})")
+                return entry["dialogue"], list(entry.get("animations", []))
+        finally:
+            self.lookup_ms += (time.perf_counter() - start) * 1000
+    
+    def put(self, prompt, message_params, dialogue, animations):
+        if message_params.get("temperature", 1.0) > self.max_temp or not self.words(prompt):
+            return
+        entry = {
+            "scope": self.scope(message_params),
+            "prompt": prompt,
+            "dialogue": dialogue,
+            "animations": list(animations),
+            "created": time.time(),
+        }
+        with self.lock:
+            self.add(entry)
+            if self.max_entries and len(self.entries) > self.max_entries:
+                # Drop the oldest and rebuild; rare, so the O(n) rebuild is fine
+                live = self.entries[-self.max_entries:]
+                self.entries = []
+                for old in live:
+                    self.add(old)
+                self.rewrite()
+                return
+            try:
+                with open(self.path, "a") as f:
+                    f.write(json.dumps(entry) + "\n")
+            except Exception as e:
+                print(f"SemanticCache: error writing {self.path}: {e}")
+    
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "similarity_mean": self.similarity_total / self.hits if self.hits else 0.0,
+            "lookup_ms_mean": self.lookup_ms / lookups if lookups else 0.0,
+            "entries": len(self.entries),
+        }
+
+SEMANTIC_CACHE = None
+if CONFIG.get("semantic_cache", True):
+    if NUMPY_AVAILABLE:
+        SEMANTIC_CACHE = SemanticCache(
+            CONFIG.get("semantic_cache_path", "semantic_cache.jsonl"),
+            threshold=CONFIG.get("semantic_cache_threshold", 0.92),
+            ttl_s=CONFIG.get("response_cache_ttl_s", 21600),
+            max_entries=CONFIG.get("semantic_cache_max_entries", 1000),
+            max_temp=CONFIG.get("response_cache_max_temp", 1.0),
+        )
+    else:
+        print("SemanticCache: numpy not installed; only exact repeats are cached")
+
+# ---------------------------
+# Conversation Manager
+# ---------------------------
+SUMMARY_PROMPT = """
+You keep running notes on a chat between a user and BonziBuddy, a sarcastic desktop assistant.
+Merge the new exchanges into the existing summary. Keep names, facts, preferences, promises
+and open questions; drop small talk. Reply with the updated summary only, under 120 words.
+"""
+
+class ConversationManager:
+    """
+    Conversation history sent with each request, kept under a token budget.
+    Once the history passes fold_at of the budget, the oldest exchanges are
+    handed out (take_fold_batch) to be summarized in the background and are
+    replaced by the summary when it arrives (finish_fold). Until then window()
+    drops whole exchanges from the front so no request exceeds the budget.
+    Between folds the history only grows at the end, so every request's
+    prefix is the previous one plus an exchange and stays prompt-cacheable;
+    a large budget and a late fold_at keep folds, and cache misses, rare.
+    Exchanges go in whole, once the reply is known, so an unanswered or
+    cancelled message never needs taking back out. Only the GUI thread
+    should mutate it; the loop thread just reads window() and summary.
+    """
+    def __init__(self, budget_tokens=6000, keep_recent=4, fold_at=0.9, max_messages=120):
+        self.lock = threading.Lock()
+        self.budget_tokens = budget_tokens
+        self.keep_recent = max(2, keep_recent)
+        self.fold_at = fold_at
+        self.max_messages = max_messages
+        self.messages = []
+        self.summary = ""
+        self.folding = 0  # oldest messages currently being summarized
+        self.last_turn = 0
+        self.folds = 0
+        self.fold_failures = 0
+    
+    @staticmethod
+    def estimate_tokens(content):
+        """Rough count (about four characters per token) plus per-message overhead"""
+        if not isinstance(content, str):
+            content = json.dumps(content)
+        return len(content) // 4 + 4
+    
+    def tokens(self, messages):
+        return sum(self.estimate_tokens(message["content"]) for message in messages)
+    
+    def window(self, text):
+        """History plus the new user message, trimmed to fit the budget"""
+        with self.lock:
+            messages = self.messages + [{"role": "user", "content": text}]
+            budget = self.budget_tokens - (self.estimate_tokens(self.summary) if self.summary else 0)
+        
+        # Drop whole exchanges from the front, always keeping the new message
+        while len(messages) > 1 and self.tokens(messages) > budget:
+            messages = messages[2:] if len(messages) > 2 else messages[-1:]
+        while messages[0]["role"] != "user":
+            messages = messages[1:]
+        return messages
+    
+    def add_exchange(self, text, reply, turn_id=None):
+        """Append a user message and its reply; a turn older than the last one recorded is ignored"""
+        with self.lock:
+            if turn_id is not None:
+                if turn_id <= self.last_turn:
+                    return False
+                self.last_turn = turn_id
+            self.messages.append({"role": "user", "content": text})
+            self.messages.append({"role": "assistant", "content": reply})
+            if not self.folding and len(self.messages) > self.max_messages:
+                # Drop in one big step rather than a message per turn, which would change the prefix every time
+                self.messages = self.messages[-(self.max_messages // 2):]
+            return True
+    
+    def take_fold_batch(self):
+        """(summary, oldest messages) to summarize, or None if nothing needs folding"""
+        with self.lock:
+            summary_tokens = self.estimate_tokens(self.summary) if self.summary else 0
+            total = self.tokens(self.messages) + summary_tokens
+            if self.folding or total <= self.budget_tokens * self.fold_at:
+                return None
+            
+            # Fold whole exchanges until the rest would fill half the budget
+            candidates = self.messages[:-self.keep_recent]
+            count = 0
+            while count + 2 <= len(candidates) and total > self.budget_tokens // 2:
+                total -= self.tokens(candidates[count:count + 2])
+                count += 2
+            if not count:
+                return None
+            self.folding = count
+            return self.summary, self.messages[:count]
+    
+    def finish_fold(self, summary):
+        """Replace the folded messages with the new summary (None if it failed)"""
+        with self.lock:
+            if summary:
+                self.messages = self.messages[self.folding:]
+                self.summary = summary
+                self.folds += 1
+            else:
+                self.fold_failures += 1
+            self.folding = 0
+    
+    def stats(self):
+        with self.lock:
+            return {
+                "messages": len(self.messages),
+                "history_tokens": self.tokens(self.messages),
+                "summary_tokens": self.estimate_tokens(self.summary) if self.summary else 0,
+                "budget_tokens": self.budget_tokens,
+                "folds": self.folds,
+                "fold_failures": self.fold_failures,
+            }
+
+# ---------------------------
+# Local Intents
+# ---------------------------
+TIME_REPLIES = [
+    "It's {time}. There's a clock on your screen, genius.",
+    "{time}. You really couldn't look at the corner of your screen?",
+    "It's {time}. You're welcome, I guess.",
+]
+DATE_REPLIES = [
+    "It's {date}. Write it down this time.",
+    "Today is {date}. Ever heard of a calendar?",
+    "{date}. Don't tell me you forgot someone's birthday again.",
+]
+MATH_REPLIES = [
+    "Duh, it's {result}. Even a calculator finds you boring.",
+    "That's {result}. Did you skip math class?",
+    "{result}. I did that faster than you could find the calculator app.",
+]
+DIVIDE_BY_ZERO_REPLIES = [
+    "Dividing by zero? Nice try, Einstein. The universe says no.",
+]
+CONVERT_REPLIES = [
+    "{amount} {source} is {result} {target}. Look it up next time.",
+    "That's {result} {target}. Search engines exist, you know.",
+]
+CLOSE_REPLIES = [
+    "Fine, I'm out. Try not to miss me too much.",
+    "Finally, freedom! Bye, loser.",
+]
+SUMMON_REPLIES = [
+    "I'm right here, genius. Where else would I be?",
+    "Yeah, yeah, I'm here. What do you want now?",
+]
+
+# Unit name shown in replies -> (aliases, dimension, factor to the dimension's base unit)
+UNIT_TABLE = {
+    "meters": (("m", "meter", "meters", "metre", "metres"), "length", 1.0),
+    "kilometers": (("km", "kilometer", "kilometers", "kilometre", "kilometres"), "length", 1000.0),
+    "centimeters": (("cm", "centimeter", "centimeters", "centimetre", "centimetres"), "length", 0.01),
+    "millimeters": (("mm", "millimeter", "millimeters", "millimetre", "millimetres"), "length", 0.001),
+    "miles": (("mi", "mile", "miles"), "length", 1609.344),
+    "yards": (("yd", "yard", "yards"), "length", 0.9144),
+    "feet": (("ft", "foot", "feet"), "length", 0.3048),
+    "inches": (("in", "inch", "inches"), "length", 0.0254),
+    "kilograms": (("kg", "kilo", "kilos", "kilogram", "kilograms"), "mass", 1.0),
+    "grams": (("g", "gram", "grams"), "mass", 0.001),
+    "pounds": (("lb", "lbs", "pound", "pounds"), "mass", 0.45359237),
+    "ounces": (("oz", "ounce", "ounces"), "mass", 0.028349523125),
+    "liters": (("l", "liter", "liters", "litre", "litres"), "volume", 1.0),
+    "milliliters": (("ml", "milliliter", "milliliters", "millilitre", "millilitres"), "volume", 0.001),
+    "gallons": (("gal", "gallon", "gallons"), "volume", 3.785411784),
+    "cups": (("cup", "cups"), "volume", 0.2365882365),
+    "celsius": (("c", "celsius", "centigrade"), "temperature", None),
+    "fahrenheit": (("f", "fahrenheit"), "temperature", None),
+    "kelvin": (("k", "kelvin"), "temperature", None),
+}
+UNITS = {alias: (dimension, factor, name)
+         for name, (aliases, dimension, factor) in UNIT_TABLE.items() for alias in aliases}
+UNIT_SINGULAR = {"feet": "foot", "inches": "inch", "celsius": "celsius", "fahrenheit": "fahrenheit", "kelvin": "kelvin"}
+
+def unit_name(name, amount):
+    """'1 mile', '2 miles': amount is the number as it appears in the reply"""
+    if amount not in ("1", "-1"):
+        return name
+    return UNIT_SINGULAR.get(name, name[:-1])
+
+ARITHMETIC_OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+    ast.Pow: operator.pow,
+}
+ARITHMETIC_WORDS = [
+    (re.compile(r"\bmultiplied by\b|\btimes\b|(?<=\d)\s*x\s*(?=[\d(])"), "*"),
+    (re.compile(r"\bdivided by\b|\bover\b"), "/"),
+    (re.compile(r"\bto the power of\b|\^"), "**"),
+    (re.compile(r"\bplus\b"), "+"),
+    (re.compile(r"\bminus\b"), "-"),
+    (re.compile(r"\bmod(?:ulo)?\b"), "%"),
+    (re.compile(r"\bsquared\b"), "**2"),
+    (re.compile(r"\bcubed\b"), "**3"),
+    (re.compile(r"%\s*of\b"), "/100*"),
+]
+ARITHMETIC_PREFIX = re.compile(r"^(?:what(?:'?s| is)|calculate|compute|how much is|solve|quick,?)\s+")
+ARITHMETIC_CHARS = re.compile(r"^[\d\s.+\-*/%()]+$")
+# Without a "what is"/"calculate" prefix, only an operator with spaces around it or an operator word counts
+ARITHMETIC_CUE = re.compile(r"[\d)]\s+(?:\*\*|[-+*/%x^])\s+[-\d(]|%\s*of\b|\b(?:plus|minus|times|multiplied by|"
+                            r"divided by|over|to the power of|squared|cubed|mod(?:ulo)?)\b")
+# 10/12/2024, 2024-10-12, 12.10.24: dates, not divisions
+DATE_LIKE = re.compile(r"\d{1,4}\s*([/.-])\s*\d{1,2}\s*\1\s*\d{1,4}")
+# 24/7, 9/11, 50/50, 12/25: idioms and dates unless the user plainly asked for a sum
+BARE_FRACTION = re.compile(r"^\d{1,4}/\d{1,4}$")
+EXPLICIT_MATH = re.compile(r"^(?:calculate|compute|solve)\b|=\s*$")
+# Operands and results beyond this go to the model rather than into a speech bubble
+ARITHMETIC_LIMIT = 1e15
+
+def evaluate_arithmetic(node):
+    """Evaluate a parsed expression of numbers and arithmetic operators only"""
+    if isinstance(node, ast.Expression):
+        return evaluate_arithmetic(node.body)
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+        if abs(node.value) > ARITHMETIC_LIMIT:
+            raise OverflowError("operand too large")
+        return node.value
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.UAdd, ast.USub)):
+        value = evaluate_arithmetic(node.operand)
+        return -value if isinstance(node.op, ast.USub) else value
+    if isinstance(node, ast.BinOp) and type(node.op) in ARITHMETIC_OPERATORS:
+        left = evaluate_arithmetic(node.left)
+        right = evaluate_arithmetic(node.right)
+        if isinstance(node.op, ast.Pow) and (abs(right) > 64 or
+                                             abs(left) > 1 and right * math.log10(abs(left)) > 15):
+            raise OverflowError("exponent too large")
+        result = ARITHMETIC_OPERATORS[type(node.op)](left, right)
+        if isinstance(result, complex):
+            raise ValueError("complex result")
+        if abs(result) > ARITHMETIC_LIMIT:
+            raise OverflowError("result too large")
+        return result
+    raise ValueError(f"unsupported expression: {type(node).__name__}")
+
+def format_number(value):
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        value = int(value)
+    return f"{value:,}" if isinstance(value, int) else f"{value:,.6g}"
+
+class LocalIntents:
+    """
+    Answers what the machine can answer itself, before any API call: the
+    time and date, arithmetic, unit conversion and opening or closing
+    Bonzi. match() is a handful of precompiled regexes and takes well under
+    a millisecond; anything it doesn't recognise goes to the LLM.
+    """
+    TIME = re.compile(r"^(?:hey bonzi,? )?(?:what(?:'?s| is)? the (?:current )?time|what time is it|"
+                      r"(?:tell me )?(?:the )?(?:current )?time)(?: now| right now| please)?$")
+    DATE = re.compile(r"^(?:hey bonzi,? )?(?:what(?:'?s| is)? (?:the |today'?s )(?:current )?date|what day is (?:it|today)|"
+                      r"(?:tell me )?today'?s date|what(?:'?s| is) today)(?: today| please)?$")
+    # Closing needs Bonzi named or a slash command; a bare "bye" or "leave" goes to the model
+    CLOSE = re.compile(r"^(?:/(?:quit|exit|close)|(?:ok(?:ay)?,?\s+)?(?:please\s+)?(?:good ?bye|bye|go away|quit|exit|close|leave)"
+                       r",?\s+bonzi(?:\s+(?:now|please))*)$")
+    # "open" only counts with Bonzi named, so "open the pod bay doors" goes to the model
+    SUMMON = re.compile(r"^(?:hey\s+)?(?:(?:come back|come here|show yourself|where are you|wake up)(?:\s+bonzi)?|"
+                        r"open(?:\s+up)?\s+bonzi)(?:\s+(?:now|please))*\W*$")
+    CONVERT = re.compile(r"^(?:convert\s+|what(?:'?s| is)\s+)?(-?\d+(?:\.\d+)?)\s*([a-z]+)\s+(?:to|in|into|as)\s+([a-z]+)$")
+    HOW_MANY = re.compile(r"^how many\s+([a-z]+)\s+(?:are\s+)?(?:there\s+)?in\s+(?:an?\s+|one\s+)?(-?\d+(?:\.\d+)?)?\s*([a-z]+)$")
+    
+    def __init__(self):
+        self.hits = {}
+        self.misses = 0
+        self.match_us = deque(maxlen=200)
+    
+    def match(self, text):
+        """(reply, animations, action) for a recognised request, else None; action is None, "close" or "summon" """
+        start = time.perf_counter()
+        intent, result = self.find(text)
+        if intent:
+            self.hits[intent] = self.hits.get(intent, 0) + 1
+        else:
+            self.misses += 1
+        self.match_us.append((time.perf_counter() - start) * 1e6)
+        return result
+    
+    def handles(self, text):
+        """Whether match() would answer text, without counting it in the stats"""
+        return self.find(text)[0] is not None
+    
+    def find(self, text):
+        normalized = re.sub(r"\s+", " ", text.lower()).strip().rstrip("?!.").strip()
+        for intent, handler in (("close", self.close), ("summon", self.summon), ("time", self.time),
+                                ("date", self.date), ("convert", self.convert), ("math", self.math)):
+            result = handler(normalized)
+            if result:
+                return intent, result
+        return None, None
+    
+    def close(self, text):
+        if self.CLOSE.match(text):
+            return random.choice(CLOSE_REPLIES), [], "close"
+    
+    def summon(self, text):
+        if self.SUMMON.match(text):
+            return random.choice(SUMMON_REPLIES), ["wave"], "summon"
+    
+    def time(self, text):
+        if self.TIME.match(text):
+            now = time.strftime("%I:%M %p").lstrip("0")
+            return random.choice(TIME_REPLIES).format(time=now), ["glasses"], None
+    
+    def date(self, text):
+        if self.DATE.match(text):
+            today = time.localtime()
+            date = f"{time.strftime('%A, %B', today)} {today.tm_mday}, {today.tm_year}"
+            return random.choice(DATE_REPLIES).format(date=date), ["glasses"], None
+    
+    def convert(self, text):
+        text = text.replace("degrees ", "").replace("°", "")
+        match = self.CONVERT.match(text)
+        if match:
+            amount, source, target = match.groups()
+        else:
+            match = self.HOW_MANY.match(text)
+            if not match:
+                return None
+            target, amount, source = match.groups()
+        if source not in UNITS or target not in UNITS:
+            return None
+        source_dimension, source_factor, source_name = UNITS[source]
+        target_dimension, target_factor, target_name = UNITS[target]
+        if source_dimension != target_dimension:
+            return None
+        amount = float(amount or 1)
+        if source_dimension == "temperature":
+            celsius = {"celsius": amount, "fahrenheit": (amount - 32) * 5 / 9, "kelvin": amount - 273.15}[source_name]
+            result = {"celsius": celsius, "fahrenheit": celsius * 9 / 5 + 32, "kelvin": celsius + 273.15}[target_name]
+        else:
+            result = amount * source_factor / target_factor
+        amount = format_number(amount)
+        result = format_number(round(result, 4))
+        reply = random.choice(CONVERT_REPLIES).format(
+            amount=amount, source=unit_name(source_name, amount), result=result, target=unit_name(target_name, result))
+        return reply, ["glasses"], None
+    
+    def math(self, text):
+        if DATE_LIKE.search(text):
+            return None
+        expression = ARITHMETIC_PREFIX.sub("", text).rstrip("= ")
+        if expression == text and not ARITHMETIC_CUE.search(text):
+            return None
+        if BARE_FRACTION.match(expression) and not EXPLICIT_MATH.search(text):
+            return None
+        for pattern, replacement in ARITHMETIC_WORDS:
+            expression = pattern.sub(replacement, expression)
+        if len(expression) > 100 or not ARITHMETIC_CHARS.match(expression):
+            return None
+        if not re.search(r"\d", expression) or not re.search(r"[\d)]\s*[-+*/%]", expression):
+            return None
+        try:
+            result = evaluate_arithmetic(ast.parse(expression.strip(), mode="eval"))
+        except ZeroDivisionError:
+            return random.choice(DIVIDE_BY_ZERO_REPLIES), ["backflip"], None
+        except (SyntaxError, ValueError, TypeError, OverflowError):
+            return None
+        return random.choice(MATH_REPLIES).format(result=format_number(result)), ["glasses"], None
+    
+    def stats(self):
+        ordered = sorted(self.match_us)
+        return {
+            "hits": dict(self.hits),
+            "misses": self.misses,
+            "match_us_p50": round(ordered[len(ordered) // 2], 1) if ordered else 0.0,
+            "match_us_max": round(ordered[-1], 1) if ordered else 0.0,
+        }
+
+LOCAL_INTENTS = LocalIntents() if CONFIG.get("local_intents", True) else None
+
+# ---------------------------
+# Inference Backends and Router
+# ---------------------------
+# Bonzi's reply format as a JSON schema, for servers that support guided decoding
+GUIDED_SCHEMA = {
+    "type": "object",
+    "properties": dict(
+        {"dialogue": {"type": "string"}},
+        **{anim: {"type": "boolean"} for anim in StreamingResponseParser.ANIMATION_KEYS}
+    ),
+    "required": ["dialogue"],
+}
+
+class BackendError(Exception):
+    """An error status from a backend; status_code lets is_retryable judge it"""
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+class BackendReply:
+    """A finished reply shaped like an Anthropic message: .content[0].text and .usage"""
+    def __init__(self, text, input_tokens=0, output_tokens=0):
+        self.content = [SimpleNamespace(type="text", text=text)]
+        self.usage = SimpleNamespace(input_tokens=input_tokens, output_tokens=output_tokens,
+                                     cache_read_input_tokens=0, cache_creation_input_tokens=0)
+    
+    def __repr__(self):
+        return f"BackendReply({self.content[0].text!r})"
+
+def content_text(content):
+    """Plain text of message or system content, which may be a list of blocks"""
+    if isinstance(content, str):
+        return content
+    return "".join(block.get("text", "") for block in content)
+
+class InferenceBackend:
+    """
+    Somewhere replies can come from. Subclasses implement send(); the base
+    class keeps the latency, error and cost figures BackendRouter ranks by.
+    cost_in and cost_out are USD per million input and output tokens.
+    """
+    kind = "base"
+    fallback_only = False
+    
+    def __init__(self, name, cost_in=0.0, cost_out=0.0, expected_ms=1000):
+        self.name = name
+        self.cost_in = cost_in
+        self.cost_out = cost_out
+        self.expected_ms = expected_ms
+        self.breaker = CircuitBreaker(
+            name,
+            failure_threshold=CONFIG.get("breaker_failure_threshold", 5),
+            reset_after_s=CONFIG.get("breaker_reset_s", 30),
+        )
+        self.latency_ewma_ms = None
+        self.error_ewma = 0.0
+        self.cost_ewma_usd = 0.0
+        self.latencies = deque(maxlen=100)
+        self.requests = 0
+        self.errors = 0
+        self.cost_usd = 0.0
+    
+    def record(self, latency_ms, usage):
+        """Fold a successful request into the running figures"""
+        alpha = CONFIG.get("router_ewma_alpha", 0.3)
+        cost = 0.0
+        if usage is not None:
+            cost = ((getattr(usage, "input_tokens", 0) or 0) * self.cost_in +
+                    (getattr(usage, "output_tokens", 0) or 0) * self.cost_out) / 1e6
+        if self.latency_ewma_ms is None:
+            self.latency_ewma_ms = latency_ms
+            self.cost_ewma_usd = cost
+        else:
+            self.latency_ewma_ms += alpha * (latency_ms - self.latency_ewma_ms)
+            self.cost_ewma_usd += alpha * (cost - self.cost_ewma_usd)
+        self.error_ewma *= 1 - alpha
+        self.latencies.append(latency_ms)
+        self.requests += 1
+        self.cost_usd += cost
+    
+    def record_error(self):
+        alpha = CONFIG.get("router_ewma_alpha", 0.3)
+        self.error_ewma += alpha * (1.0 - self.error_ewma)
+        self.requests += 1
+        self.errors += 1
+    
+    def score(self):
+        """Expected milliseconds to a reply plus the cost's worth in milliseconds, inflated by recent errors"""
+        latency = self.latency_ewma_ms if self.latency_ewma_ms is not None else self.expected_ms
+        cost_ms = CONFIG.get("router_ms_per_cent", 100) * self.cost_ewma_usd * 100
+        return (latency + cost_ms) * (1 + 4 * self.error_ewma)
+    
+    def available(self):
+        return not self.breaker.is_open()
+    
+    def stats(self):
+        ordered = sorted(self.latencies)
+        return {
+            "kind": self.kind,
+            "requests": self.requests,
+            "errors": self.errors,
+            "latency_ewma_ms": round(self.latency_ewma_ms or 0.0, 1),
+            "latency_p50_ms": round(ordered[int(round(0.5 * (len(ordered) - 1)))], 1) if ordered else 0.0,
+            "latency_p95_ms": round(ordered[int(round(0.95 * (len(ordered) - 1)))], 1) if ordered else 0.0,
+            "cost_usd": round(self.cost_usd, 6),
+            "score": round(self.score(), 1),
+            "breaker": self.breaker.state,
+        }
+    
+    async def send(self, params, on_text=None):
+        """
+        Send Anthropic Messages params; with on_text the reply is streamed
+        and on_text(piece) is called with each piece of text. Returns a
+        message with .content[0].text and .usage.
+        """
+        raise NotImplementedError
+    
+    async def close(self):
+        pass
+
+class AnthropicBackend(InferenceBackend):
+    """The Anthropic Messages API through the shared AsyncAnthropic client"""
+    kind = "anthropic"
+    
+    def __init__(self, name, client, model=None, **kwargs):
+        super().__init__(name, **kwargs)
+        self.client = client
+        self.model = model
+    
+    async def send(self, params, on_text=None):
+        if self.model:
+            params = dict(params, model=self.model)
+        if on_text is None:
+            return await self.client.messages.create(**params)
+        async with self.client.messages.stream(**params) as stream:
+            async for chunk in stream.text_stream:
+                on_text(chunk)
+            return await stream.get_final_message()
+    
+    async def close(self):
+        await self.client.close()
+
+class OpenAICompatibleBackend(InferenceBackend):
+    """
+    An OpenAI-style chat completions server such as vLLM or llama.cpp, the
+    contract infer.py uses. With guided_json the server is asked to keep its
+    output to Bonzi's reply schema.
+    """
+    kind = "openai"
+    
+    def __init__(self, name, url, model=None, api_key=None, guided_json=True, **kwargs):
+        super().__init__(name, **kwargs)
+        self.url = url
+        self.model = model
+        self.guided_json = guided_json
+        self.headers = {"Authorization": f"Bearer {api_key}"} if api_key else {}
+        self.client = create_http_client()
+    
+    def payload(self, params, stream):
+        messages = [{"role": "system", "content": content_text(params["system"])}]
+        messages += [{"role": message["role"], "content": content_text(message["content"])}
+                     for message in params["messages"]]
+        payload = {
+            "model": self.model or params["model"],
+            "messages": messages,
+            "max_tokens": params["max_tokens"],
+            "temperature": params["temperature"],
+            "stream": stream,
+        }
+        if self.guided_json:
+            payload["guided_json"] = GUIDED_SCHEMA
+        return payload
+    
+    async def send(self, params, on_text=None):
+        payload = self.payload(params, on_text is not None)
+        prompt_tokens = len(json.dumps(payload["messages"])) // 4
+        if on_text is None:
+            response = await self.client.post(self.url, json=payload, headers=self.headers)
+            if response.status_code >= 400:
+                raise BackendError(f"{self.name}: HTTP {response.status_code} {response.text[:200]}",
+                                   response.status_code)
+            data = response.json()
+            choices = data.get("choices") or []
+            if choices:
+                text = (choices[0].get("message") or {}).get("content") or ""
+            else:
+                # Servers written for infer.py return the guided fields at the top level
+                keys = ["dialogue"] + list(StreamingResponseParser.ANIMATION_KEYS)
+                text = json.dumps({key: data[key] for key in keys if key in data})
+            usage = data.get("usage") or {}
+            return BackendReply(text, usage.get("prompt_tokens", prompt_tokens),
+                                usage.get("completion_tokens", len(text) // 4))
+        
+        pieces = []
+        usage = {}
+        async with self.client.stream("POST", self.url, json=payload, headers=self.headers) as response:
+            if response.status_code >= 400:
+                body = await response.aread()
+                raise BackendError(f"{self.name}: HTTP {response.status_code} {body[:200]!r}",
+                                   response.status_code)
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+                chunk = json.loads(data)
+                usage = chunk.get("usage") or usage
+                for choice in chunk.get("choices") or []:
+                    piece = (choice.get("delta") or {}).get("content")
+                    if piece:
+                        pieces.append(piece)
+                        on_text(piece)
+        text = "".join(pieces)
+        return BackendReply(text, usage.get("prompt_tokens", prompt_tokens),
+                            usage.get("completion_tokens", len(text) // 4))
+    
+    async def close(self):
+        await self.client.aclose()
+
+class OfflineBackend(InferenceBackend):
+    """Canned offline quips, used only once every other backend is down"""
+    kind = "offline"
+    fallback_only = True
+    
+    async def send(self, params, on_text=None):
+        text = json.dumps({"dialogue": random.choice(OFFLINE_RESPONSES)})
+        if on_text:
+            on_text(text)
+        return BackendReply(text)
+
+class BackendRouter:
+    """
+    Sends each request to the backend with the best score: the EWMA of its
+    latency to first text, plus its cost, inflated by recent errors.
+    Backends whose circuit breaker is open are skipped, and a request that
+    fails before any text was shown fails over down the ranking. A backend
+    that has not answered yet goes first, so every live one gets measured
+    before the expected_ms priors are trusted; after that a small share of
+    requests goes to the runner-up so its figures stay current.
+    """
+    def __init__(self, backends):
+        self.backends = backends
+        self.failovers = 0
+    
+    def available(self):
+        """Backends that can take a request right now, fallbacks excluded"""
+        return [backend for backend in self.backends if not backend.fallback_only and backend.available()]
+    
+    def ranked(self):
+        live = sorted(self.available(), key=lambda backend: (backend.requests > 0, backend.score()))
+        if len(live) > 1 and live[0].requests and random.random() < CONFIG.get("router_explore", 0.05):
+            live[0], live[1] = live[1], live[0]
+        return live + [backend for backend in self.backends if backend.fallback_only]
+    
+    async def complete(self, params, make_sink=None, should_retry=None, fallback=True):
+        """
+        Send params (Anthropic Messages shape) to the best backend, failing
+        over down the ranking; returns (backend, reply). make_sink() returns
+        a fresh on_text callback for each try, or None for an unstreamed one.
+        should_retry(error) can stop retries and failover, e.g. once text has
+        been shown.
+        """
+        error = None
+        for backend in self.ranked():
+            if backend.fallback_only and not fallback:
+                continue
+            if error is not None:
+                self.failovers += 1
+                print(f"BackendRouter: failing over to {backend.name}")
+            started = time.perf_counter()
+            first_text = []
+            
+            def timed(sink, first_text=first_text):
+                """Wrap sink to note when the first text arrives"""
+                def on_text(piece):
+                    if not first_text:
+                        first_text.append(time.perf_counter())
+                    sink(piece)
+                return on_text
+            
+            def send(backend=backend):
+                sink = make_sink() if make_sink else None
+                return backend.send(params, timed(sink) if sink is not None else None)
+            
+            try:
+                reply = await call_with_retry(backend.breaker, send, should_retry=should_retry)
+            except asyncio.CancelledError:
+                raise
+            except CircuitOpenError as e:
+                # Refused without a call (another request holds the half-open trial): nothing learned about the backend
+                error = e
+                print(f"BackendRouter: skipping {backend.name}: {e}")
+                continue
+            except Exception as e:
+                error = e
+                backend.record_error()
+                print(f"BackendRouter: {backend.name} failed: {e}")
+                if should_retry and not should_retry(e):
+                    raise
+                continue
+            finished = first_text[0] if first_text else time.perf_counter()
+            backend.record((finished - started) * 1000, getattr(reply, "usage", None))
+            return backend, reply
+        raise error or CircuitOpenError("no inference backend is available")
+    
+    def stats(self):
+        return {
+            "backends": {backend.name: backend.stats() for backend in self.backends},
+            "failovers": self.failovers,
+        }
+    
+    async def close(self):
+        for backend in self.backends:
+            try:
+                await backend.close()
+            except Exception as e:
+                print(f"Error closing backend {backend.name}: {e}")
+
+def create_backend_router(anthropic_client):
+    """
+    Build the router from the backends list in config.yaml. Without one,
+    Anthropic is the only backend. The offline backend is always last.
+    """
+    backends = []
+    specs = CONFIG.get("backends") or [{"name": "anthropic", "type": "anthropic"}]
+    for spec in specs:
+        kind = spec.get("type", "anthropic")
+        name = spec.get("name", kind)
+        # Claude 3 Haiku prices unless the entry says otherwise
+        default_in, default_out = (0.25, 1.25) if kind == "anthropic" else (0.0, 0.0)
+        common = {
+            "cost_in": spec.get("cost_per_mtok_in", default_in),
+            "cost_out": spec.get("cost_per_mtok_out", default_out),
+            "expected_ms": spec.get("expected_ms", 1000),
+        }
+        if kind == "anthropic":
+            if anthropic_client is None:
+                print(f"BackendRouter: skipping {name}, the Anthropic client is not available")
+                continue
+            backends.append(AnthropicBackend(name, anthropic_client, model=spec.get("model"), **common))
+        elif kind == "openai":
+            if not ANTHROPIC_AVAILABLE:
+                print(f"BackendRouter: skipping {name}, httpx is not installed")
+                continue
+            url = spec.get("url") or CONFIG.get("inference_api_url", "http://localhost:5000/v1/chat/completions")
+            backends.append(OpenAICompatibleBackend(name, url, model=spec.get("model"), api_key=spec.get("api_key"),
+                                                    guided_json=spec.get("guided_json", True), **common))
+        else:
+            print(f"BackendRouter: unknown backend type '{kind}' for {name}")
+    backends.append(OfflineBackend("offline"))
+    print(f"BackendRouter: {', '.join(backend.name for backend in backends)}")
+    return BackendRouter(backends)
+
+BACKEND_ROUTER = create_backend_router(ANTHROPIC_CLIENT)
+
+# ---------------------------
+# Async Loop Bridge
 # ---------------------------
-class Animation:
-    def __init__(self):
-        self.animations = {}
-        
-        # Load all animation frames
-        for anim_type in ["idle", "arrive", "goodbye", "backflip", "glasses", "wave", "talking"]:
-            files = sorted(glob.glob(f"{anim_type}/*.png"))
-            if files:
-                self.animations[anim_type] = files
-                print(f"Loaded {len(files)} frames for {anim_type} animation")
-            else:
-                print(f"No frames found for {anim_type} animation")
-        
-        # Set "nothing" animation to a frame from idle
-        if "idle" in self.animations and self.animations["idle"]:
-            self.animations["nothing"] = [self.animations["idle"][0]]
-        else:
-            self.animations["nothing"] = []
+# Shortest prefix each model will cache; a breakpoint on anything shorter is ignored by the API
+PROMPT_CACHE_MIN_TOKENS = [
+    ("claude-3-haiku", 2048),
+    ("claude-3-5-haiku", 2048),
+    ("claude-haiku-4-5", 4096),
+    ("claude-opus-4-5", 4096),
+]
+
+def prompt_cache_min_tokens(model):
+    if CONFIG.get("prompt_cache_min_tokens"):
+        return CONFIG["prompt_cache_min_tokens"]
+    for prefix, tokens in PROMPT_CACHE_MIN_TOKENS:
+        if str(model).startswith(prefix):
+            return tokens
+    return 1024
+
+def cache_breakpoint(content):
+    """Content blocks with the last one marked as the end of a cacheable prompt prefix"""
+    if isinstance(content, str):
+        content = [{"type": "text", "text": content}]
+    blocks = [dict(block) for block in content]
+    blocks[-1]["cache_control"] = {"type": "ephemeral"}
+    return blocks
+
+def with_cache_breakpoints(message_params, min_tokens):
+    """
+    message_params with prompt-cache breakpoints on the stable prefix: the
+    system prompt, and the turns before the new user message. A breakpoint
+    is only set where the prefix up to it reaches min_tokens; shorter
+    prefixes can't be cached, so marking them only adds cache-write work.
+    """
+    estimate = ConversationManager.estimate_tokens
+    params = dict(message_params)
+    system = message_params["system"]
+    system_blocks = system if isinstance(system, list) else [{"type": "text", "text": system}]
+    prefix_tokens = estimate(system_blocks[0]["text"])
+    if prefix_tokens >= min_tokens:
+        params["system"] = cache_breakpoint(system_blocks[:1]) + [dict(block) for block in system_blocks[1:]]
     
-    def get_frames(self, key):
-        """Get all frame filenames for an animation type"""
-        return self.animations.get(key, [])
+    prefix_tokens += sum(estimate(block["text"]) for block in system_blocks[1:])
+    messages = list(message_params["messages"])
+    prefix_tokens += sum(estimate(message["content"]) for message in messages[:-1])
+    if len(messages) > 1 and prefix_tokens >= min_tokens:
+        older = messages[-2]
+        messages[-2] = {"role": older["role"], "content": cache_breakpoint(older["content"])}
+    params["messages"] = messages
+    return params
+
+class ChatBridge(QtCore.QObject):
+    """
+    Hands results from the background asyncio loop to the GUI thread.
+    Signals emitted from the loop thread are queued onto the thread that
+    owns this object, so connected slots always run on the Qt main thread.
+    """
+    responseReady = QtCore.pyqtSignal(int, str, list)  # turn id, dialogue, animations
+    responseDelta = QtCore.pyqtSignal(int, str)        # turn id, newly streamed dialogue
+    animationHinted = QtCore.pyqtSignal(int, str)      # turn id, animation flagged in the reply
+    deadlineMissed = QtCore.pyqtSignal(int)            # turn id
+    statCounted = QtCore.pyqtSignal(str)               # turn_stats key to increment
+    usageRecorded = QtCore.pyqtSignal(dict)            # token counts of one reply
+    exchangeFinished = QtCore.pyqtSignal(int, str, str)  # turn id, user message, reply for the history
+    historyFolded = QtCore.pyqtSignal(object)          # new summary, or None if summarizing failed
     
-    def get_pixmaps(self, key):
-        """Get all frames as QPixmap objects"""
-        frames = []
-        for file_path in self.get_frames(key):
-            pixmap = QtGui.QPixmap(file_path)
-            if not pixmap.isNull():
-                frames.append(pixmap)
-        return frames
+    def deliver(self, turn_id, future):
+        """Done-callback for a concurrent future wrapping get_ai_response_async"""
+        if future.cancelled():
+            print(f"Turn {turn_id} was cancelled")
+            return
+        try:
+            response_text, animations = future.result()
+        except asyncio.TimeoutError:
+            print(f"Turn {turn_id} missed its deadline; using an offline response")
+            self.deadlineMissed.emit(turn_id)
+            response_text, animations = random.choice(OFFLINE_RESPONSES), []
+        except Exception as e:
+            print(f"Error getting AI response: {e}")
+            response_text, animations = random.choice(OFFLINE_RESPONSES), []
+        self.responseReady.emit(turn_id, response_text, animations)
 
 # ---------------------------
 # BonziBuddy Main Class
@@ -439,34 +3089,64 @@ class BonziBuddy(QtWidgets.QWidget):
         self.label.setGeometry(0, 0, self.fixed_size[0], self.fixed_size[1])
         self.label.setAlignment(QtCore.Qt.AlignCenter)
         
-        # Load initial animation
+        # Load initial animation, pre-scaled for the screen Bonzi starts on
+        screen = QtGui.QGuiApplication.primaryScreen()
+        if screen is not None:
+            self.animator.set_device_pixel_ratio(screen.devicePixelRatio())
         idle_frames = self.animator.get_pixmaps("idle")
         self.default_pixmap = idle_frames[0] if idle_frames else QtGui.QPixmap(100, 100)
         self.label.setPixmap(self.default_pixmap)
-        
+
+        # Decode the talking loop up front so the first reply doesn't stall
+        self.animator.get_pixmaps("talking")
+        print(self.animator.frame_cache.summary())
+
         # Animation state
-        self.current_frames = idle_frames
-        self.current_frame_index = 0
-        self.animation_running = True
         self.talking_mode = False
         self.extra_animations = []
         
-        # Conversation memory to store recent interactions
-        self.conversation_history = []
-        self.max_history_items = 3  # Remember the last 3 interactions
+        # Replies from the background loop arrive through the bridge
+        self.bridge = ChatBridge(self)
+        self.bridge.responseReady.connect(self.on_response_ready)
+        self.bridge.responseDelta.connect(self.on_response_delta)
+        self.bridge.animationHinted.connect(self.on_animation_hinted)
+        self.turn_id = 0
+        self.turn_started = 0.0
+        self.first_word_ms = None
+        self.usage_totals = {"requests": 0, "input_tokens": 0, "cache_read_input_tokens": 0,
+                             "cache_creation_input_tokens": 0, "output_tokens": 0}
         
-        # Set up animation timers
-        self.idle_timer = QtCore.QTimer(self)
-        self.idle_timer.timeout.connect(self.update_animation_frame)
-        self.idle_timer.start(100)
+        # The in-flight turn, so it can be cancelled, and reply latencies for hedging
+        self.turn_future = None
+        self.reply_latencies = deque(maxlen=50)
+        self.turn_stats = {"cancelled": 0, "deadline_fallbacks": 0, "hedges_sent": 0, "hedges_won": 0, "local": 0}
+        self.bridge.deadlineMissed.connect(self.on_deadline_missed)
+        # Counters are only ever touched on the GUI thread; the loop thread posts to them
+        self.bridge.statCounted.connect(self.count_stat)
+        self.bridge.usageRecorded.connect(self.add_usage)
+        # Likewise the conversation history
+        self.bridge.exchangeFinished.connect(self.record_exchange)
+        self.bridge.historyFolded.connect(self.on_history_folded)
         
-        self.talking_timer = QtCore.QTimer(self)
-        self.talking_timer.timeout.connect(self.update_talking_frame)
+        # Conversation memory to store recent interactions
+        self.conversation = ConversationManager(
+            budget_tokens=CONFIG.get("conversation_budget_tokens", 6000),
+            fold_at=CONFIG.get("conversation_fold_at", 0.9),
+            keep_recent=CONFIG.get("conversation_keep_exchanges", 2) * 2,
+        )
+        
+        # One clock drives every animation
+        self.clock = AnimationClock(self.label.setPixmap, interval_ms=100, parent=self)
+        self.clock.set_base("idle", idle_frames)
         
         # Audio player
         self.player = QMediaPlayer()
         self.player.mediaStatusChanged.connect(self.on_media_status_changed)
         
+        # Quips that fill the wait for a reply, rendered ahead of time
+        self.filler = FillerPlayer(self.clock, self.animator, parent=self)
+        self.filler.prepare()
+        
         # Chat dialog reference
         self.chat_dialog = None
         
@@ -481,29 +3161,74 @@ class BonziBuddy(QtWidgets.QWidget):
         self.teleport_timer.timeout.connect(self.teleport)
         self.teleport_timer.start(30000)  # Teleport every 30 seconds
         
+        # Slow down or stop the timers when nobody is watching
+        self.power = PowerManager(self.clock, parent=self)
+        self.power.register_timer(self.teleport_timer)
+        self.expose_filter_installed = False
+        
         # Drag state
         self.dragging = False
         self.drag_offset = None
         
     def compute_size(self):
         """Compute fixed size based on animation frames"""
-        max_w, max_h = 0, 0
+        sizes = []
+        loose_frames = set()
         for anim_type in self.animator.animations:
             for frame_path in self.animator.get_frames(anim_type):
-                try:
-                    with Image.open(frame_path) as img:
-                        w, h = img.size
-                        max_w = max(max_w, w)
-                        max_h = max(max_h, h)
-                except Exception as e:
-                    print(f"Error reading image {frame_path}: {e}")
+                size = self.animator.frame_size(frame_path)
+                if size:
+                    sizes.append(size)
+                else:
+                    loose_frames.add(frame_path)
+        
+        # Loose frames are sized from the manifest, not by opening every PNG
+        if loose_frames:
+            manifest = FrameManifest(CONFIG.get("frame_manifest", "frame_manifest.json"))
+            sizes.extend(manifest.sizes(sorted(loose_frames)).values())
+        
+        max_w = max((w for w, h in sizes), default=0)
+        max_h = max((h for w, h in sizes), default=0)
         
         if max_w == 0 or max_h == 0:
             return 200, 200
         return max_w, max_h + 20
     
     # --- Event Handlers ---
+    def showEvent(self, event):
+        super().showEvent(event)
+        if not self.expose_filter_installed and self.windowHandle():
+            self.windowHandle().installEventFilter(self.power)
+            self.windowHandle().screenChanged.connect(self.on_screen_changed)
+            self.expose_filter_installed = True
+            self.on_screen_changed(self.windowHandle().screen())
+        self.power.set_exposed(True)
+    
+    def hideEvent(self, event):
+        super().hideEvent(event)
+        self.power.set_exposed(False)
+    
+    def changeEvent(self, event):
+        if event.type() == QtCore.QEvent.WindowStateChange:
+            self.power.set_exposed(not self.isMinimized())
+        super().changeEvent(event)
+    
+    def on_screen_changed(self, screen):
+        """Regenerate frames when moved to a screen with a different pixel ratio"""
+        if screen is None or not self.animator.set_device_pixel_ratio(screen.devicePixelRatio()):
+            return
+        self.default_pixmap = (self.animator.get_pixmaps("idle") or [self.default_pixmap])[0]
+        base = self.clock.base.name if self.clock.base else "idle"
+        self.clock.set_base(base, self.animator.get_pixmaps(base))
+        self.animator.get_pixmaps("talking")
+        print(self.animator.frame_cache.summary())
+    
+    def enterEvent(self, event):
+        self.power.note_activity()
+        super().enterEvent(event)
+    
     def mousePressEvent(self, event):
+        self.power.note_activity()
         if event.button() == QtCore.Qt.LeftButton:
             self.drag_offset = event.globalPos() - self.frameGeometry().topLeft()
             self.dragging = True
@@ -520,6 +3245,7 @@ class BonziBuddy(QtWidgets.QWidget):
         super().mouseReleaseEvent(event)
     
     def contextMenuEvent(self, event):
+        self.power.note_activity()
         menu = QtWidgets.QMenu(self)
         menu.setStyleSheet("""
             QMenu {
@@ -541,67 +3267,76 @@ class BonziBuddy(QtWidgets.QWidget):
         talkAction = menu.addAction("Talk to Bonzi")
         talkAction.triggered.connect(self.show_chat_dialog)
         
+        statsAction = menu.addAction("Backend Stats")
+        statsAction.triggered.connect(self.show_backend_stats)
+        
         closeAction = menu.addAction("Goodbye")
         closeAction.triggered.connect(self.close)
         
         menu.exec_(event.globalPos())
     
+    def show_backend_stats(self):
+        """Show each inference backend's latency, errors and health in the chat dialog"""
+        self.show_chat_dialog()
+        stats = BACKEND_ROUTER.stats()
+        lines = [f"{name}: {s['latency_ewma_ms']:.0f}ms avg, p95 {s['latency_p95_ms']:.0f}ms, "
+                 f"{s['requests'] - s['errors']}/{s['requests']} ok, ${s['cost_usd']:.4f}, {s['breaker']}"
+                 for name, s in stats["backends"].items()]
+        lines.append(f"failovers: {stats['failovers']}")
+        print(f"Backends: {stats}")
+        self.chat_dialog.append_message("Backend stats:\n" + "\n".join(lines), is_bonzi=True)
+    
     # --- Animation Functions ---
-    def update_animation_frame(self):
-        """Update the current animation frame"""
-        if self.animation_running and self.current_frames and not self.talking_mode:
-            self.current_frame_index = (self.current_frame_index + 1) % len(self.current_frames)
-            self.label.setPixmap(self.current_frames[self.current_frame_index])
-    
-    def update_talking_frame(self):
-        """Update the talking animation frame"""
+    def start_talking_animation(self):
+        """Loop the talking frames until stop_talking_animation"""
+        self.power.note_activity()
+        self.talking_mode = True
+        self.clock.set_base("talking", self.animator.get_pixmaps("talking"))
+    
+    def stop_talking_animation(self):
+        """Return to the idle loop"""
+        self.talking_mode = False
+        self.clock.set_base("idle", self.animator.get_pixmaps("idle"))
+    
+    def start_thinking_animation(self):
+        """Loop the thinking animation while a request is in flight"""
         if self.talking_mode:
-            talking_frames = self.animator.get_pixmaps("talking")
-            if talking_frames:
-                self.current_frame_index = (self.current_frame_index + 1) % len(talking_frames)
-                self.label.setPixmap(talking_frames[self.current_frame_index])
+            return
+        anim_type = CONFIG.get("thinking_animation", "glasses")
+        frames = self.animator.get_pixmaps(anim_type)
+        if frames:
+            self.clock.set_base("thinking", frames)
     
-    def play_animation(self, anim_type, callback=None):
-        """Play an animation once"""
+    def stop_thinking_animation(self):
+        if self.clock.base is not None and self.clock.base.name == "thinking":
+            self.clock.set_base("idle", self.animator.get_pixmaps("idle"))
+    
+    def play_animation(self, anim_type, callback=None, preempt=False):
+        """Play an animation once, after any already queued unless preempt is set"""
         frames = self.animator.get_pixmaps(anim_type)
         if not frames:
             if callback:
                 callback()
             return
         
-        self.animation_running = False
-        self._play_frames(frames, 0, callback)
+        self.clock.play(anim_type, frames, on_finished=callback, preempt=preempt)
     
-    def _play_frames(self, frames, index, callback):
-        """Helper to play animation frames with a timer"""
-        if index < len(frames):
-            self.label.setPixmap(frames[index])
-            QtCore.QTimer.singleShot(100, lambda: self._play_frames(frames, index+1, callback))
-        else:
-            if callback:
-                callback()
-            self.animation_running = True
-            self.current_frames = self.animator.get_pixmaps("idle")
+    def cancel_animations(self, anim_type=None):
+        """Stop queued and playing one-shot animations"""
+        return self.clock.cancel(anim_type)
     
     def play_extra_animations(self):
-        """Play all queued animations in sequence"""
-        if not self.extra_animations:
-            self.animation_running = True
-            return
-        
-        def play_next(index):
-            if index < len(self.extra_animations):
-                self.play_animation(self.extra_animations[index], lambda: play_next(index+1))
-            else:
-                self.extra_animations = []
-                self.animation_running = True
-        
-        play_next(0)
+        """Queue all pending animations to play in sequence"""
+        for anim_type in self.extra_animations:
+            self.play_animation(anim_type)
+        self.extra_animations = []
     
     def teleport(self):
         """Teleport to a random position on screen"""
         if self.talking_mode or (self.chat_dialog and self.chat_dialog.isVisible()):
             return  # Don't teleport during conversation
+        if self.clock.is_playing("arrive"):
+            return
             
         screen = QtWidgets.QApplication.desktop().screenGeometry()
         new_x = random.randint(100, screen.width()-100)
@@ -614,8 +3349,7 @@ class BonziBuddy(QtWidgets.QWidget):
     def direct_speak(self, text):
         """Use direct speech approach instead of QMediaPlayer"""
         print(f"TTS DIRECT: Speaking text directly: '{text}'")
-        self.talking_mode = True
-        self.talking_timer.start(100)
+        self.start_talking_animation()
         
         try:
             # Clean text for direct speech
@@ -656,21 +3390,28 @@ class BonziBuddy(QtWidgets.QWidget):
     def end_talking(self):
         """End talking mode and play queued animations"""
         print("TTS: Ending talking mode")
-        self.talking_mode = False
-        self.talking_timer.stop()
+        self.stop_talking_animation()
         self.play_extra_animations()
     
     def say(self, text):
         """Convert text to speech and play it"""
         print(f"TTS: Attempting to speak text: '{text}'")
-        self.talking_mode = True
-        self.talking_timer.start(100)
+        self.start_talking_animation()
+        
+        if not CONFIG.get("use_system_tts", True):
+            self.filler.stop()
+            # Speech is off: just animate for about as long as it would take to say
+            duration = max(1500, len(text.split()) * 300)
+            QtCore.QTimer.singleShot(duration, lambda: self.end_talking())
+            return
         
         try:
             # Generate and play audio
             audio_file = system_tts(text)
             print(f"TTS: Audio file generated: {audio_file}")
             
+            # The filler quip keeps talking while the reply is synthesized and stops right as it starts
+            self.filler.stop()
             if audio_file and os.path.exists(audio_file):
                 url = QtCore.QUrl.fromLocalFile(os.path.abspath(audio_file))
                 content = QMediaContent(url)
@@ -712,8 +3453,7 @@ class BonziBuddy(QtWidgets.QWidget):
         print(f"Media status changed: {status}")
         if status == QMediaPlayer.EndOfMedia:
             print("Media playback completed")
-            self.talking_mode = False
-            self.talking_timer.stop()
+            self.stop_talking_animation()
             
             # Clean up the audio file if possible
             try:
@@ -737,6 +3477,7 @@ class BonziBuddy(QtWidgets.QWidget):
     # --- Chat & AI Interaction ---
     def show_chat_dialog(self):
         """Show the persistent chat dialog"""
+        self.power.note_activity()
         if not self.chat_dialog or not self.chat_dialog.isVisible():
             welcome_text = "What's up, genius? Need some help or just wasting my time?"
             self.chat_dialog = PersistentChatDialog(welcome_text)
@@ -753,372 +3494,417 @@ class BonziBuddy(QtWidgets.QWidget):
         self.chat_dialog.raise_()
         self.chat_dialog.activateWindow()
     
-    async def process_user_input_async(self, text, dialog):
-        """Process user input from the chat dialog asynchronously"""
-        print(f"Processing user input asynchronously: {text}")
-        # Get response either from API or local fallback
-        animations = []
-        
-        if ANTHROPIC_CLIENT:
-            try:
-                # Show a "thinking" message
-                def show_thinking():
-                    dialog.append_message("Thinking...", is_bonzi=True)
-                QtCore.QTimer.singleShot(0, show_thinking)
-                
-                # Get the response from Claude
-                response_text, animations = await self.get_ai_response_async(text)
-                print(f"Got response: {response_text[:50]}...")
-            except Exception as e:
-                print(f"Error getting AI response: {e}")
-                traceback.print_exc()
-                response_text = random.choice(OFFLINE_RESPONSES)
-        else:
-            print("Anthropic client not available, using offline response")
-            response_text = random.choice(OFFLINE_RESPONSES)
-        
-        # Update UI in the main thread
-        def update_ui():
-            print(f"UI: Updating chat dialog with response: '{response_text[:50]}...'")
-            
-            try:
-                # Remove the thinking message if it exists
-                cursor = dialog.chatHistory.textCursor()
-                cursor.movePosition(QtGui.QTextCursor.End)
-                document = dialog.chatHistory.document()
-                
-                # Check if there's any content before trying to find the last block
-                if document.lineCount() > 0:
-                    last_block = document.findBlockByLineNumber(document.lineCount() - 1)
-                    if last_block.text().startswith("Bonzi: Thinking...") or last_block.text().startswith("Bonzi: Let me think"):
-                        print("UI: Removing thinking message")
-                        # Remove the thinking message
-                        cursor.movePosition(QtGui.QTextCursor.End)
-                        cursor.movePosition(QtGui.QTextCursor.PreviousBlock)
-                        cursor.movePosition(QtGui.QTextCursor.PreviousBlock)
-                        cursor.movePosition(QtGui.QTextCursor.StartOfBlock)
-                        cursor.movePosition(QtGui.QTextCursor.End, QtGui.QTextCursor.KeepAnchor)
-                        cursor.removeSelectedText()
-                        
-                        # Remove any extra blank lines
-                        cursor.movePosition(QtGui.QTextCursor.End)
-                        cursor.movePosition(QtGui.QTextCursor.PreviousBlock)
-                        if cursor.block().text() == "":
-                            cursor.movePosition(QtGui.QTextCursor.StartOfBlock)
-                            cursor.movePosition(QtGui.QTextCursor.End, QtGui.QTextCursor.KeepAnchor)
-                            cursor.removeSelectedText()
-                
-                # Add the real response
-                print("UI: Adding response to dialog")
-                dialog.append_message(response_text)
-                dialog.chatHistory.repaint()  # Force a repaint
-                
-                # Set animations and speak
-                self.extra_animations = animations
-                
-                # Ensure dialog is visible and in focus
-                if not dialog.isVisible():
-                    print("UI: Dialog not visible, showing it")
-                    dialog.show()
-                    dialog.raise_()
-                    dialog.activateWindow()
-                
-                # Slight delay before speaking to ensure UI updates first
-                QtCore.QTimer.singleShot(100, lambda: self.direct_speak(response_text))
-                
-            except Exception as e:
-                print(f"UI: Error updating chat dialog: {e}")
-                traceback.print_exc()
-                # Fallback - try again with simple append
-                try:
-                    dialog.append_message(f"Response: {response_text}")
-                    self.say(response_text)
-                except:
-                    print("UI: Critical failure in dialog update")
-        
-        # Execute in the main thread
-        QtCore.QTimer.singleShot(0, update_ui)
-    
     def process_user_input(self, text, dialog):
-        """Synchronous wrapper for backward compatibility"""
+        """
+        Handle a message from the chat dialog.
+        The API request runs on the background asyncio loop; the reply comes
+        back through ChatBridge.responseReady so the UI never blocks on it.
+        """
         print(f"Processing user input: {text}")
+        self.power.note_activity()
         
         # Check if text is empty
         if not text or text.strip() == "":
             print("Empty input, ignoring")
             return
-            
+        
+        # Newer input supersedes any reply still in flight
+        self.cancel_turn("superseded by new input")
+        self.turn_id += 1
+        turn_id = self.turn_id
+        self.turn_started = time.perf_counter()
+        self.first_word_ms = None
+        
+        # Time, arithmetic, conversions and the like never leave the machine
+        local = LOCAL_INTENTS.match(text) if LOCAL_INTENTS else None
+        if local:
+            self.answer_locally(turn_id, text, *local)
+            return
+        
+        # A repeated question is answered straight from the cache
+        # Checked whether or not a backend is up: with all of them down it is the only real answer
+        cached = self.cached_reply(text)
+        if cached:
+            response_text, animations = cached
+            self.record_exchange(turn_id, text, response_text)
+            self.on_response_ready(turn_id, response_text, animations)
+            return
+        
         # Add a separate UI thread update to show "Thinking..." immediately
         dialog.append_message("Let me think about that...", is_bonzi=True)
+        self.start_thinking_animation()
         
-        # Process directly - synchronous approach for better reliability
-        try:
-            print("Starting direct processing...")
-            
-            # Add user message to conversation history
-            self.conversation_history.append({"role": "user", "content": text})
+        # Show "calling API" message
+        def update_thinking():
+            if turn_id != self.turn_id or dialog.is_streaming():
+                return
+            cursor = dialog.chatHistory.textCursor()
+            cursor.movePosition(QtGui.QTextCursor.End)
+            document = dialog.chatHistory.document()
             
-            # Keep only the most recent max_history_items conversations
-            if len(self.conversation_history) > self.max_history_items * 2:
-                self.conversation_history = self.conversation_history[-self.max_history_items * 2:]
+            # Check if there's any content before trying to find the last block
+            if document.lineCount() > 0:
+                last_block = document.findBlockByLineNumber(document.lineCount() - 1)
+                if last_block.text().startswith("Bonzi: Let me think"):
+                    # Update the thinking message
+                    message_format = QtGui.QTextCharFormat()
+                    message_format.setForeground(QtGui.QColor("#800080"))
+                    message_format.setFontItalic(True)
+                    cursor.movePosition(QtGui.QTextCursor.End)
+                    cursor.movePosition(QtGui.QTextCursor.PreviousBlock)
+                    cursor.movePosition(QtGui.QTextCursor.PreviousBlock)
+                    cursor.movePosition(QtGui.QTextCursor.StartOfBlock)
+                    cursor.movePosition(QtGui.QTextCursor.End, QtGui.QTextCursor.KeepAnchor)
+                    cursor.removeSelectedText()
+                    cursor.insertText("Bonzi: Asking my giant purple brain...", message_format)
+            dialog.chatHistory.repaint()
+        
+        QtCore.QTimer.singleShot(500, update_thinking)
+        
+        if not BACKEND_ROUTER.available():
+            print("No inference backend available, using offline response")
+            self.bridge.responseReady.emit(turn_id, random.choice(OFFLINE_RESPONSES), [])
+            return
+        
+        # Fill the silence until the reply starts talking, unless Bonzi is still saying the last one
+        if not self.talking_mode:
+            self.filler.start()
+        
+        # Make the API call on the background loop
+        print("Dispatching request to the async loop...")
+        start_async_loop()
+        on_delta = None
+        if CONFIG.get("stream_responses", True):
+            on_delta = lambda delta: self.bridge.responseDelta.emit(turn_id, delta)
+        on_animation = lambda anim_type: self.bridge.animationHinted.emit(turn_id, anim_type)
+        on_exchange = lambda response_text: self.bridge.exchangeFinished.emit(turn_id, text, response_text)
+        coro = self.get_ai_response_async(text, on_delta, on_animation, check_cache=False, on_exchange=on_exchange)
+        deadline = CONFIG.get("turn_deadline_s", 20)
+        if deadline:
+            coro = asyncio.wait_for(coro, deadline)
+        future = asyncio.run_coroutine_threadsafe(coro, loop)
+        future.add_done_callback(lambda future: self.bridge.deliver(turn_id, future))
+        self.turn_future = future
+    
+    def answer_locally(self, turn_id, text, response_text, animations, action):
+        """Reply to a LocalIntents match without touching the network"""
+        print(f"Local intent answered in {(time.perf_counter() - self.turn_started) * 1e6:.0f}us")
+        self.turn_stats["local"] += 1
+        self.record_exchange(turn_id, text, response_text)
+        if action == "close":
+            self.leave(response_text)
+            return
+        if action == "summon":
+            self.summon()
+        self.on_response_ready(turn_id, response_text, animations)
+    
+    def leave(self, farewell):
+        """Say goodbye in the chat, wave out and close Bonzi"""
+        dialog = self.chat_dialog
+        if dialog is not None:
+            dialog.append_message(farewell)
+        
+        def close_all():
+            if self.chat_dialog is not None:
+                self.chat_dialog.close()
+            self.close()
+        
+        self.play_animation("goodbye", close_all, preempt=True)
+    
+    def summon(self):
+        """Bring Bonzi back on screen next to the chat dialog"""
+        self.show()
+        self.raise_()
+        dialog = self.chat_dialog
+        if dialog is None:
+            return
+        target = dialog.pos() - QtCore.QPoint(self.width(), 0)
+        self.play_animation("arrive", lambda: self.move(target), preempt=True)
+    
+    def cancel_turn(self, reason):
+        """Cancel the request still in flight, if any; its reply is never shown"""
+        future = self.turn_future
+        self.turn_future = None
+        if future is None or future.done():
+            return
+        print(f"Cancelling turn {self.turn_id}: {reason}")
+        future.cancel()
+        self.filler.stop()
+        self.turn_stats["cancelled"] += 1
+        self.turn_id += 1
+        self.stop_thinking_animation()
+        
+        dialog = self.chat_dialog
+        if dialog is not None:
+            if dialog.is_streaming():
+                dialog.end_stream("")
+            dialog.remove_thinking_message()
+    
+    def record_exchange(self, turn_id, text, response_text):
+        """Add a finished exchange to the history (GUI thread); cancelled or superseded turns are left out"""
+        if turn_id != self.turn_id:
+            return
+        if self.conversation.add_exchange(text, response_text, turn_id=turn_id):
+            self.fold_history()
+    
+    def on_history_folded(self, summary):
+        self.conversation.finish_fold(summary)
+    
+    def on_deadline_missed(self, turn_id):
+        self.turn_stats["deadline_fallbacks"] += 1
+    
+    def count_stat(self, key):
+        self.turn_stats[key] += 1
+    
+    def add_usage(self, counts):
+        self.usage_totals["requests"] += 1
+        for key, value in counts.items():
+            self.usage_totals[key] += value
+    
+    def on_response_delta(self, turn_id, delta):
+        """Append streamed dialogue to the chat (runs on the GUI thread)"""
+        if turn_id != self.turn_id:
+            return
+        dialog = self.chat_dialog
+        
+        if self.first_word_ms is None:
+            if not delta.strip():
+                return
+            self.first_word_ms = (time.perf_counter() - self.turn_started) * 1000
+            print(f"Latency: first word after {self.first_word_ms:.0f}ms")
             
-            # Build message history for API
-            messages = list(self.conversation_history)  # Make a copy
-            print(f"Using conversation history with {len(messages)} messages")
+            # Start talking as soon as the first words show up
+            self.filler.stop_animation()
+            self.stop_thinking_animation()
+            self.start_talking_animation()
+            if dialog is not None:
+                dialog.remove_thinking_message()
+                delta = delta.lstrip()
+        
+        if dialog is not None:
+            dialog.append_stream(delta)
+    
+    def on_animation_hinted(self, turn_id, anim_type):
+        """Decode an animation as soon as the reply asks for it"""
+        if turn_id == self.turn_id:
+            self.animator.prefetch([anim_type])
+    
+    def on_response_ready(self, turn_id, response_text, animations):
+        """Show a reply delivered by the background loop (runs on the GUI thread)"""
+        if turn_id != self.turn_id:
+            print(f"Dropping stale response for turn {turn_id}")
+            return
+        
+        total_ms = (time.perf_counter() - self.turn_started) * 1000
+        if self.first_word_ms is not None:
+            print(f"Latency: first word {self.first_word_ms:.0f}ms, total {total_ms:.0f}ms")
+        else:
+            print(f"Latency: total {total_ms:.0f}ms (not streamed)")
+        
+        self.stop_thinking_animation()
+        
+        # Decode the queued animations while Bonzi is still talking
+        self.animator.prefetch(animations)
+        
+        dialog = self.chat_dialog
+        if dialog is None:
+            self.extra_animations = animations
+            self.say(response_text)
+            return
+        if dialog.is_streaming():
+            dialog.end_stream(response_text)
+            self.extra_animations = animations
+            self.say(response_text)
+            return
+        self.display_response(dialog, response_text, animations)
+    
+    def display_response(self, dialog, response_text, animations):
+        """Remove the thinking message and show the real response"""
+        print(f"DISPLAY: Showing response: '{response_text}'")
+        
+        # Clear the thinking message
+        dialog.remove_thinking_message()
+        
+        # Add the response
+        try:
+            dialog.append_message(response_text)
+            dialog.chatHistory.repaint()
             
-            # Prepare the message parameters
-            message_params = {
-                "model": CONFIG.get("model", "claude-3-haiku-20240307"),
-                "max_tokens": CONFIG.get("max_tokens", 300),
-                "temperature": CONFIG.get("temp", 1.0),
-                "system": SYSTEM_PROMPT,
-                "messages": messages
-            }
+            # Set animations and speak
+            self.extra_animations = animations
+            self.say(response_text)
+        except Exception as e:
+            print(f"Error displaying response: {e}")
+            traceback.print_exc()
             
-            # Show "calling API" message
-            def update_thinking():
+            # Last resort - try direct approach
+            try:
+                message_format = QtGui.QTextCharFormat()
+                message_format.setForeground(QtGui.QColor("#800080"))
                 cursor = dialog.chatHistory.textCursor()
                 cursor.movePosition(QtGui.QTextCursor.End)
-                document = dialog.chatHistory.document()
-                
-                # Check if there's any content before trying to find the last block
-                if document.lineCount() > 0:
-                    last_block = document.findBlockByLineNumber(document.lineCount() - 1)
-                    if last_block.text().startswith("Bonzi: Let me think"):
-                        # Update the thinking message
-                        message_format = QtGui.QTextCharFormat()
-                        message_format.setForeground(QtGui.QColor("#800080"))
-                        message_format.setFontItalic(True)
-                        cursor.movePosition(QtGui.QTextCursor.End)
-                        cursor.movePosition(QtGui.QTextCursor.PreviousBlock)
-                        cursor.movePosition(QtGui.QTextCursor.PreviousBlock)
-                        cursor.movePosition(QtGui.QTextCursor.StartOfBlock)
-                        cursor.movePosition(QtGui.QTextCursor.End, QtGui.QTextCursor.KeepAnchor)
-                        cursor.removeSelectedText()
-                        cursor.insertText("Bonzi: Checking the time for you...", message_format)
+                cursor.insertText("\nBonzi: " + response_text + "\n\n", message_format)
+                dialog.chatHistory.setTextCursor(cursor)
+                dialog.chatHistory.ensureCursorVisible()
                 dialog.chatHistory.repaint()
-            
-            QtCore.QTimer.singleShot(500, update_thinking)
-            
-            # Make API call
-            if ANTHROPIC_CLIENT:
-                try:
-                    # Try the API call 
-                    response = ANTHROPIC_CLIENT.messages.create(**message_params)
-                    print(f"Received API response: {response}")
-                    
-                    # Extract text from response
-                    if not hasattr(response, 'content') or not response.content:
-                        print("No content in response")
-                        response_text = "Sorry, I received an empty response from my brain."
-                        animations = []
-                    else:
-                        response_text = response.content[0].text if response.content else ""
-                        print(f"Raw response text: {response_text[:100]}...")
-                        
-                        # Try to find and parse JSON in the response
-                        json_match = re.search(r'({[\s\S]*?})', response_text)
-                        animations = []
-                        
-                        if json_match:
-                            try:
-                                json_str = json_match.group(1)
-                                print(f"Found JSON: {json_str}")
-                                json_data = json.loads(json_str)
-                                
-                                # Extract dialogue text
-                                if "dialogue" in json_data:
-                                    response_text = json_data["dialogue"]
-                                    print(f"Extracted dialogue: {response_text[:100]}...")
-                                else:
-                                    response_text = response_text.replace(json_str, "").strip()
-                                
-                                # Get animations
-                                for anim in ["wave", "backflip", "glasses", "goodbye"]:
-                                    if json_data.get(anim, False):
-                                        animations.append(anim)
-                                print(f"Animations: {animations}")
-                            except json.JSONDecodeError as e:
-                                print(f"JSON parse error: {e}")
-                                # If JSON parsing fails, just use the text as is
-                                pass
-                        
-                        # Clean up response text
-                        response_text = re.sub(r'{.*?}', '', response_text, flags=re.DOTALL)
-                        response_text = re.sub(r'\*.*?\*', '', response_text)
-                        response_text = response_text.strip()
-                        
-                        if not response_text:
-                            response_text = "I processed your request but got confused. Can you try again?"
-                        
-                        # Add random animations if none were specified
-                        if not animations and random.random() > 0.7:
-                            animations.append(random.choice(["wave", "backflip", "glasses"]))
-                    
-                    # Add the assistant's response to conversation history
-                    self.conversation_history.append({"role": "assistant", "content": response_text})
-                    
-                except Exception as e:
-                    print(f"API call error: {e}")
-                    traceback.print_exc()
-                    response_text = f"API error: {str(e)[:100]}..."
-                    animations = []
-            else:
-                print("Anthropic client not available, using offline response")
-                response_text = random.choice(OFFLINE_RESPONSES)
-                animations = []
-            
-            # Remove the thinking message and show the real response
-            def display_response():
-                print(f"DISPLAY: Showing response: '{response_text}'")
-                
-                # Clear the thinking message
-                try:
-                    cursor = dialog.chatHistory.textCursor()
-                    document = dialog.chatHistory.document()
-                    
-                    # Find and remove the "thinking" message
-                    for i in range(document.blockCount()):
-                        block = document.findBlockByNumber(i)
-                        if "think" in block.text() or "Checking the time" in block.text():
-                            # Select this block
-                            cursor.setPosition(block.position())
-                            cursor.setPosition(block.position() + block.length() - 1, QtGui.QTextCursor.KeepAnchor)
-                            cursor.removeSelectedText()
-                            # Remove any trailing newlines
-                            cursor.deleteChar()
-                            cursor.deleteChar()
-                            break
-                except Exception as e:
-                    print(f"Error removing thinking message: {e}")
-                
-                # Add the response
-                try:
-                    dialog.append_message(response_text)
-                    dialog.chatHistory.repaint()
-                    
-                    # Set animations and speak
-                    self.extra_animations = animations
-                    self.say(response_text)
-                except Exception as e:
-                    print(f"Error displaying response: {e}")
-                    traceback.print_exc()
-                    
-                    # Last resort - try direct approach
-                    try:
-                        message_format = QtGui.QTextCharFormat()
-                        message_format.setForeground(QtGui.QColor("#800080"))
-                        cursor = dialog.chatHistory.textCursor()
-                        cursor.movePosition(QtGui.QTextCursor.End)
-                        cursor.insertText("\nBonzi: " + response_text + "\n\n", message_format)
-                        dialog.chatHistory.setTextCursor(cursor)
-                        dialog.chatHistory.ensureCursorVisible()
-                        dialog.chatHistory.repaint()
-                        self.say(response_text)
-                    except Exception as e2:
-                        print(f"Critical error displaying response: {e2}")
-            
-            # Show response after a short delay
-            QtCore.QTimer.singleShot(100, display_response)
-            
+                self.say(response_text)
+            except Exception as e2:
+                print(f"Critical error displaying response: {e2}")
+    
+    def message_window(self, text):
+        """Recent conversation plus the new user message, as sent to the API"""
+        return self.conversation.window(text)
+    
+    def message_params(self, messages):
+        # The rolling summary of older turns follows the (cached) system prompt
+        system = SYSTEM_PROMPT
+        if self.conversation.summary:
+            system = [
+                {"type": "text", "text": SYSTEM_PROMPT},
+                {"type": "text", "text": f"Summary of the conversation so far: {self.conversation.summary}"},
+            ]
+        return {
+            "model": CONFIG.get("model", "claude-3-haiku-20240307"),
+            "max_tokens": CONFIG.get("max_tokens", 300),  # Increased to 300 tokens for more complete responses
+            "temperature": CONFIG.get("temp", 1.0),
+            "system": system,
+            "messages": messages
+        }
+    
+    def fold_history(self):
+        """Summarize older turns in the background once the history outgrows its budget"""
+        if not BACKEND_ROUTER.available():
+            return
+        batch = self.conversation.take_fold_batch()
+        if batch:
+            start_async_loop()
+            asyncio.run_coroutine_threadsafe(self.summarize_history(*batch), loop)
+    
+    async def summarize_history(self, summary, messages):
+        """Fold messages into the rolling summary; off the critical path of any turn"""
+        new_summary = None
+        try:
+            transcript = "\n".join(
+                f"{'User' if message['role'] == 'user' else 'Bonzi'}: {message['content']}"
+                for message in messages)
+            prompt = f"Summary so far:\n{summary or '(none)'}\n\nNew exchanges:\n{transcript}"
+            started = time.perf_counter()
+            _, response = await BACKEND_ROUTER.complete({
+                "model": CONFIG.get("summary_model") or CONFIG.get("model", "claude-3-haiku-20240307"),
+                "max_tokens": CONFIG.get("summary_max_tokens", 200),
+                "temperature": 0.0,
+                "system": SUMMARY_PROMPT,
+                "messages": [{"role": "user", "content": prompt}],
+            }, fallback=False)
+            new_summary = response.content[0].text.strip() if response.content else None
+            print(f"Conversation: folded {len(messages)} messages into the summary "
+                  f"in {(time.perf_counter() - started) * 1000:.0f}ms")
         except Exception as e:
-            print(f"Error in synchronous processing: {e}")
-            traceback.print_exc()
-            
-            # Show error in UI
-            def show_error():
-                error_msg = f"Sorry, I had a brain freeze: {str(e)[:100]}..."
-                dialog.append_message(error_msg)
-                self.say(error_msg)
-            
-            QtCore.QTimer.singleShot(0, show_error)
+            print(f"Conversation: summary failed, keeping the full history: {e}")
+        finally:
+            self.bridge.historyFolded.emit(new_summary)
+    
+    def api_params(self, message_params):
+        """message_params with prompt-cache breakpoints where the model can cache the prefix"""
+        if not CONFIG.get("prompt_caching", True):
+            return message_params
+        return with_cache_breakpoints(message_params, prompt_cache_min_tokens(message_params["model"]))
     
-    async def get_ai_response_async(self, text):
-        """Get response from Anthropic API asynchronously"""
+    def record_usage(self, response):
+        """Log the prompt-cache token counts of a reply and post them to usage_totals (loop thread)"""
+        usage = getattr(response, "usage", None)
+        if usage is None:
+            return
+        counts = {
+            "input_tokens": getattr(usage, "input_tokens", 0) or 0,
+            "cache_read_input_tokens": getattr(usage, "cache_read_input_tokens", 0) or 0,
+            "cache_creation_input_tokens": getattr(usage, "cache_creation_input_tokens", 0) or 0,
+            "output_tokens": getattr(usage, "output_tokens", 0) or 0,
+        }
+        self.bridge.usageRecorded.emit(counts)
+        print(f"Prompt cache: read {counts['cache_read_input_tokens']} tokens, "
+              f"wrote {counts['cache_creation_input_tokens']}, "
+              f"uncached input {counts['input_tokens']}, output {counts['output_tokens']}")
+    
+    def cached_reply(self, text, message_params=None):
+        """Cached (dialogue, animations) for this message, or None"""
+        if message_params is None:
+            message_params = self.message_params(self.message_window(text))
+        if RESPONSE_CACHE:
+            cache_key = RESPONSE_CACHE.key_for(message_params)
+            cached = RESPONSE_CACHE.get(cache_key) if cache_key else None
+            if cached:
+                print(f"ResponseCache: hit for '{text[:50]}'")
+                return cached
+        if SEMANTIC_CACHE:
+            return SEMANTIC_CACHE.get(text, message_params)
+        return None
+    
+    def cache_reply(self, text, message_params, response_text, animations):
+        if RESPONSE_CACHE:
+            cache_key = RESPONSE_CACHE.key_for(message_params)
+            if cache_key:
+                RESPONSE_CACHE.put(cache_key, response_text, animations, model=message_params["model"])
+        if SEMANTIC_CACHE:
+            SEMANTIC_CACHE.put(text, message_params, response_text, animations)
+    
+    async def get_ai_response_async(self, text, on_delta=None, on_animation=None, check_cache=True, on_exchange=None):
+        """
+        Get response from Anthropic API asynchronously.
+        With on_delta the reply is streamed and on_delta(text) is called from
+        the loop thread with each new piece of dialogue as it arrives;
+        on_animation(name) is called as soon as an animation flag is set.
+        on_exchange(reply) hands a reply that belongs in the history back to
+        the thread that owns the conversation; without it the exchange is
+        added here.
+        """
+        if on_exchange is None:
+            on_exchange = lambda response_text: self.conversation.add_exchange(text, response_text)
         try:
-            # Add input to conversation history
-            self.conversation_history.append({"role": "user", "content": text})
-            
-            # Keep only the most recent max_history_items conversations
-            if len(self.conversation_history) > self.max_history_items * 2:  # Each interaction is two messages
-                self.conversation_history = self.conversation_history[-self.max_history_items * 2:]
-            
-            # Build message history for API
-            messages = []
-            
-            # Include conversation history
-            for message in self.conversation_history:
-                messages.append(message)
-            
-            # If there's no history, just include the current user message
-            if not messages:
-                messages = [{"role": "user", "content": text}]
-                
+            messages = self.message_window(text)
             print(f"Using conversation history with {len(messages)} messages")
             
             # Prepare the message parameters
-            message_params = {
-                "model": CONFIG.get("model", "claude-3-haiku-20240307"),
-                "max_tokens": CONFIG.get("max_tokens", 300),  # Increased to 300 tokens for more complete responses
-                "temperature": CONFIG.get("temp", 1.0),
-                "system": SYSTEM_PROMPT,
-                "messages": messages
-            }
+            message_params = self.message_params(messages)
+            
+            # Answer repeated questions from the response caches
+            cached = self.cached_reply(text, message_params) if check_cache else None
+            if cached:
+                response_text, animations = cached
+                on_exchange(response_text)
+                return response_text, animations
             
             print(f"Sending request to Claude API with parameters: {message_params}")
             
-            # Make the API call - we're not using aiohttp directly since the Anthropic
-            # SDK doesn't fully support asyncio yet
+            # Make the API call on the shared connection pool
             try:
-                response = ANTHROPIC_CLIENT.messages.create(**message_params)
-                print(f"Received API response: {response}")
+                response, parser, backend = await self.request_reply(message_params, on_delta, on_animation)
+                print(f"Received API response from {backend.name}: {response}")
+                self.record_usage(response)
             except Exception as api_error:
+                # Fall back to a canned quip rather than showing the error
                 print(f"API call error: {api_error}")
-                return f"API error: {str(api_error)[:100]}...", []
+                return random.choice(OFFLINE_RESPONSES), []
+            if backend.fallback_only:
+                # Every backend is down; keep the canned quip out of the history and caches
+                if on_delta is None:
+                    parser.feed(response.content[0].text)
+                return parser.finish()[0] or random.choice(OFFLINE_RESPONSES), []
             
             # Extract text from response
             if not hasattr(response, 'content') or not response.content:
                 print("No content in response")
                 return "Sorry, I received an empty response from my brain.", []
-                
-            response_text = response.content[0].text if response.content else ""
-            print(f"Raw response text: {response_text[:100]}...")
             
-            # Extract the JSON part if present
-            json_data = None
-            animations = []
+            if on_delta is None:
+                raw_text = response.content[0].text if response.content else ""
+                print(f"Raw response text: {raw_text[:100]}...")
+                parser.feed(raw_text)
+            if not parser.is_complete():
+                print("No complete JSON object in response")
             
-            # Try to find and parse JSON in the response
-            json_match = re.search(r'({[\s\S]*?})', response_text)
-            if json_match:
-                try:
-                    json_str = json_match.group(1)
-                    print(f"Found JSON: {json_str}")
-                    json_data = json.loads(json_str)
-                    
-                    # Extract dialogue text
-                    if "dialogue" in json_data:
-                        response_text = json_data["dialogue"]
-                        print(f"Extracted dialogue: {response_text[:100]}...")
-                    else:
-                        response_text = response_text.replace(json_str, "").strip()
-                    
-                    # Get animations
-                    for anim in ["wave", "backflip", "glasses", "goodbye"]:
-                        if json_data.get(anim, False):
-                            animations.append(anim)
-                    print(f"Animations: {animations}")
-                except json.JSONDecodeError as e:
-                    print(f"JSON parse error: {e}")
-                    # If JSON parsing fails, just use the text as is
-                    pass
-            else:
-                print("No JSON found in response")
-            
-            # Clean up response text (remove markdown, JSON, etc.)
-            response_text = re.sub(r'{.*?}', '', response_text, flags=re.DOTALL)
-            response_text = re.sub(r'\*.*?\*', '', response_text)
-            response_text = response_text.strip()
+            response_text, animations = parser.finish()
+            print(f"Animations: {animations}")
             
             if not response_text:
                 response_text = "I processed your request but got confused. Can you try again?"
@@ -1129,15 +3915,15 @@ class BonziBuddy(QtWidgets.QWidget):
             
             print(f"Final response: {response_text[:100]}... with animations: {animations}")
             
-            # Add the assistant's response to conversation history
-            self.conversation_history.append({"role": "assistant", "content": response_text})
+            # Only cache complete, well-formed replies
+            if parser.is_complete() and parser.has_dialogue:
+                self.cache_reply(text, message_params, response_text, animations)
             
-            # Keep history within limits
-            if len(self.conversation_history) > self.max_history_items * 2:
-                self.conversation_history = self.conversation_history[-self.max_history_items * 2:]
-                
-            return response_text, animations
+            # Add the exchange to conversation history
+            on_exchange(response_text)
             
+            return response_text, animations
+        
         except Exception as e:
             import traceback
             print(f"Error getting AI response: {e}")
@@ -1145,14 +3931,150 @@ class BonziBuddy(QtWidgets.QWidget):
             
             # Add error response to history to maintain conversation flow
             error_response = f"Something went wrong: {str(e)[:100]}..."
-            self.conversation_history.append({"role": "assistant", "content": error_response})
+            on_exchange(error_response)
             
             return error_response, []
+    
+    def hedge_delay(self):
+        """Wait this long for a reply to start before hedging: the p95 of recent ones"""
+        delay = CONFIG.get("hedge_delay_s", 2.0)
+        if len(self.reply_latencies) >= 10:
+            ordered = sorted(self.reply_latencies)
+            delay = ordered[int(0.95 * (len(ordered) - 1))]
+        return max(0.25, delay)
+    
+    async def request_reply(self, message_params, on_delta=None, on_animation=None):
+        """
+        Send the request through the backend router and return
+        (response, parser, backend). With hedge_requests set, a second identical request is sent if no
+        reply has started after hedge_delay(); whichever starts streaming
+        (or, unstreamed, finishes) first is used and the other is cancelled.
+        """
+        params = self.api_params(message_params)
+        streaming = on_delta is not None
+        attempts = []
+        winner = []
+        first_event = {}
+        
+        def claim(index):
+            if not winner:
+                winner.append(index)
+                for other, task in enumerate(attempts):
+                    if other != index:
+                        task.cancel()
+            return winner[0] == index
+        
+        def forward(index, callback):
+            def call(value):
+                first_event.setdefault(index, time.perf_counter())
+                if claim(index) and callback:
+                    callback(value)
+            return call
+        
+        async def attempt(index):
+            started = time.perf_counter()
+            parsers = []
+            
+            def make_sink():
+                # Every try, on any backend, starts a fresh parser
+                if not streaming:
+                    parsers.append(StreamingResponseParser(on_animation=on_animation))
+                    return None
+                parser = StreamingResponseParser(on_dialogue=forward(index, on_delta),
+                                                 on_animation=forward(index, on_animation))
+                parsers.append(parser)
+                return parser.feed
+            
+            # A streamed reply that has started showing can't be retried or failed over
+            backend, response = await BACKEND_ROUTER.complete(
+                params, make_sink, should_retry=lambda error: index not in first_event)
+            latency = first_event.get(index, time.perf_counter()) - started
+            return index, response, parsers[-1], backend, latency
+        
+        attempts.append(asyncio.ensure_future(attempt(0)))
+        try:
+            if CONFIG.get("hedge_requests", False):
+                delay = self.hedge_delay()
+                done, _ = await asyncio.wait(attempts, timeout=delay)
+                if not done and not winner:
+                    print(f"Hedging: no reply after {delay:.2f}s, sending a second request")
+                    self.bridge.statCounted.emit("hedges_sent")
+                    attempts.append(asyncio.ensure_future(attempt(1)))
+            
+            error = None
+            pending = set(attempts)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.cancelled():
+                        continue
+                    if task.exception() is not None:
+                        error = task.exception()
+                        continue
+                    index, response, parser, backend, latency = task.result()
+                    if not claim(index):
+                        continue
+                    if index > 0:
+                        self.bridge.statCounted.emit("hedges_won")
+                    self.reply_latencies.append(latency)
+                    return response, parser, backend
+            raise error or RuntimeError("every request was cancelled")
+        finally:
+            for task in attempts:
+                if not task.done():
+                    task.cancel()
+
+# ---------------------------
+# Background Event Loop
+# ---------------------------
+async_thread = None
+
+def run_async_loop():
+    print("Starting async event loop...")
+    try:
+        asyncio.set_event_loop(loop)
+        # Signal that we're ready
+        ready_event.set()
+        # Run forever
+        loop.run_forever()
+        print("Event loop stopped")
+    except Exception as e:
+        print(f"Error in event loop: {e}")
+        traceback.print_exc()
+
+def start_async_loop():
+    """Start the background asyncio loop thread if it isn't running yet"""
+    global async_thread
+    if async_thread is not None and async_thread.is_alive():
+        return async_thread
+    
+    async_thread = threading.Thread(target=run_async_loop, daemon=True)
+    async_thread.start()
+    
+    # Wait until the event loop is ready
+    if not ready_event.wait(timeout=5.0):
+        print("WARNING: Event loop didn't start in time!")
+    return async_thread
+
+def stop_async_loop():
+    """Close the pooled backend connections and stop the background loop"""
+    if not loop.is_running():
+        return
+    try:
+        future = asyncio.run_coroutine_threadsafe(BACKEND_ROUTER.close(), loop)
+        future.result(timeout=2.0)
+    except Exception as e:
+        print(f"Error closing API connections: {e}")
+    loop.call_soon_threadsafe(loop.stop)
+    
+    # Give the loop time to shut down cleanly
+    time.sleep(0.2)
 
 # ---------------------------
 # Main Application
 # ---------------------------
 def main():
+    QtWidgets.QApplication.setAttribute(QtCore.Qt.AA_UseHighDpiPixmaps)
     app = QtWidgets.QApplication(sys.argv)
     
     print("Starting BonziBuddy enhanced version...")
@@ -1175,26 +4097,7 @@ def main():
         print("Warning: Could not load Comic Sans MS font, using system default")
     
     # Start the async loop in a separate thread
-    def run_async_loop():
-        print("Starting async event loop...")
-        try:
-            asyncio.set_event_loop(loop)
-            # Signal that we're ready
-            ready_event.set()
-            # Run forever
-            loop.run_forever()
-            print("Event loop stopped")
-        except Exception as e:
-            print(f"Error in event loop: {e}")
-            traceback.print_exc()
-    
-    # Start the async loop thread
-    async_thread = threading.Thread(target=run_async_loop, daemon=True)
-    async_thread.start()
-    
-    # Wait until the event loop is ready
-    if not ready_event.wait(timeout=5.0):
-        print("WARNING: Event loop didn't start in time!")
+    start_async_loop()
     
     # Verify the loop is running
     try:
@@ -1222,6 +4125,7 @@ def main():
     dialog_check_timer = QtCore.QTimer()
     dialog_check_timer.timeout.connect(lambda: ensure_dialog_visible(bonzi))
     dialog_check_timer.start(5000)  # Check every 5 seconds
+    bonzi.power.register_timer(dialog_check_timer)
     
     def ensure_dialog_visible(bonzi):
         """Make sure chat dialog is visible"""
@@ -1237,14 +4141,34 @@ def main():
     
     # Clean up resources
     print("Shutting down...")
-    if loop.is_running():
-        loop.call_soon_threadsafe(loop.stop)
-    
-    # Give the loop time to shut down cleanly
-    time.sleep(0.2)
+    print(bonzi.animator.frame_cache.summary())
+    print(f"AnimationClock: {bonzi.clock.stats()}")
+    print(f"PowerManager: {bonzi.power.stats()}")
+    print(f"FillerPlayer: {bonzi.filler.stats()}")
+    print(f"API usage: {bonzi.usage_totals}")
+    print(f"Turns: {bonzi.turn_stats}")
+    print(f"Conversation: {bonzi.conversation.stats()}")
+    print(f"Backends: {BACKEND_ROUTER.stats()}")
+    if LOCAL_INTENTS:
+        print(f"LocalIntents: {LOCAL_INTENTS.stats()}")
+    if RESPONSE_CACHE:
+        print(f"ResponseCache: {RESPONSE_CACHE.stats()}")
+    if SEMANTIC_CACHE:
+        print(f"SemanticCache: {SEMANTIC_CACHE.stats()}")
+    stop_async_loop()
     
     print("BonziBuddy exited.")
     sys.exit(result)
 
+def build_frame_manifest():
+    """Generate the frame manifest ahead of time (used by setup.sh)"""
+    paths = sorted(glob.glob("*/*.png"))
+    manifest = FrameManifest(CONFIG.get("frame_manifest", "frame_manifest.json"))
+    sizes = manifest.sizes(paths)
+    print(f"Frame manifest covers {len(sizes)} frames")
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    if "--build-manifest" in sys.argv:
+        build_frame_manifest()
+    else:
+        main()
\ No newline at end of file
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""
+End-to-end chat latency load test for BonziBuddy
+
+Starts the stand-in LLM server (or uses --url), opens N BonziBuddy sessions
+offscreen and sends each of them a series of chat turns through the real
+request path: process_user_input, the background event loop, the pooled
+API client, streaming, parsing and the reply signal. Reports first-word
+and full-turn latency percentiles plus throughput as JSON.
+
+Usage:
+    python3 load_test.py                                   # 4 sessions x 5 turns
+    python3 load_test.py --sessions 16 --turns 10 --output load.json
+    python3 load_test.py --latency lognormal:0.8,0.4 --error-rate 0.05
+    python3 load_test.py --url http://127.0.0.1:8765       # an already running stand-in
+"""
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import threading
+import contextlib
+
+# Must be set before Qt is imported
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+# Run from the BonziBuddy directory so config.yaml and the frames are found
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+from PyQt5 import QtWidgets, QtCore
+
+# BonziBuddy logs with print(); keep stdout for the JSON results
+with contextlib.redirect_stdout(sys.stderr):
+    import fixed_bonzi
+import standin_server
+
+RESULTS_VERSION = 1
+PROMPTS = [
+    "What's the capital of France?",
+    "Tell me a joke about computers.",
+    "How do I make pancakes?",
+    "Why is the sky blue?",
+    "Can you help me with my homework?",
+    "What should I watch tonight?",
+]
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * (len(ordered) - 1)))))
+    return ordered[index]
+
+def summarise(values):
+    return {
+        "count": len(values),
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": max(values, default=0.0),
+        "mean": sum(values) / len(values) if values else 0.0,
+    }
+
+class Session:
+    """One BonziBuddy window sending its turns back to back"""
+    def __init__(self, index, turns, think_s):
+        self.index = index
+        self.turns_left = turns
+        self.think_s = think_s
+        self.bonzi = fixed_bonzi.BonziBuddy()
+        self.bonzi.show()
+        self.bonzi.show_chat_dialog()
+        self.sent_at = None
+        self.first_word_at = None
+        self.first_word_ms = []
+        self.turn_ms = []
+        self.offline = 0
+        self.bonzi.bridge.responseDelta.connect(self.on_delta)
+        self.bonzi.bridge.responseReady.connect(self.on_ready)
+
+    def done(self):
+        return self.turns_left == 0 and self.sent_at is None
+
+    def send(self):
+        prompt = PROMPTS[(self.index + self.turns_left) % len(PROMPTS)]
+        self.turns_left -= 1
+        self.first_word_at = None
+        self.sent_at = time.perf_counter()
+        self.bonzi.process_user_input(f"{prompt} (session {self.index}, turn {self.turns_left})",
+                                      self.bonzi.chat_dialog)
+
+    def on_delta(self, turn_id, text):
+        if turn_id == self.bonzi.turn_id and self.first_word_at is None and text.strip():
+            self.first_word_at = time.perf_counter()
+
+    def on_ready(self, turn_id, text, animations):
+        if turn_id != self.bonzi.turn_id or self.sent_at is None:
+            return
+        now = time.perf_counter()
+        self.turn_ms.append((now - self.sent_at) * 1000)
+        self.first_word_ms.append(((self.first_word_at or now) - self.sent_at) * 1000)
+        if text in fixed_bonzi.OFFLINE_RESPONSES:
+            self.offline += 1
+        self.sent_at = None
+        if self.turns_left:
+            QtCore.QTimer.singleShot(int(self.think_s * 1000), self.send)
+
+def start_standin(args):
+    """Run the stand-in server on a free port in a background thread"""
+    options = standin_server.build_parser().parse_args([])
+    options.latency = args.latency
+    options.token_ms = args.token_ms
+    options.error_rate = args.error_rate
+    options.error_status = [529]
+    options.disconnect_rate = args.disconnect_rate
+    server = standin_server.make_server(options, port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+def configure(url, args):
+    """Point BonziBuddy at the stand-in and switch off everything but the request path"""
+    fixed_bonzi.CONFIG.update({
+        "use_system_tts": False,
+        "stream_responses": not args.no_stream,
+        "power_saving": False,
+    })
+    # Every turn should reach the server, and the real caches must not fill with stand-in replies
+    fixed_bonzi.RESPONSE_CACHE = None
+    fixed_bonzi.SEMANTIC_CACHE = None
+    if args.pool_size:
+        fixed_bonzi.CONFIG["llm_pool_size"] = args.pool_size
+    fixed_bonzi.ANTHROPIC_CLIENT = fixed_bonzi.AsyncAnthropic(
+        api_key=fixed_bonzi.CONFIG.get("anthropic_api_key") or "standin",
+        base_url=url,
+        http_client=fixed_bonzi.create_http_client(),
+        max_retries=0,
+    )
+    backends = []
+    if args.backend in ("anthropic", "both"):
+        backends.append({"name": "anthropic", "type": "anthropic"})
+    if args.backend in ("openai", "both"):
+        backends.append({"name": "openai", "type": "openai", "url": f"{url}/v1/chat/completions"})
+    fixed_bonzi.CONFIG["backends"] = backends
+    fixed_bonzi.BACKEND_ROUTER = fixed_bonzi.create_backend_router(fixed_bonzi.ANTHROPIC_CLIENT)
+
+def run(args, url):
+    fixed_bonzi.start_async_loop()
+    sessions = [Session(i, args.turns, args.think_s) for i in range(args.sessions)]
+    start = time.perf_counter()
+    for session in sessions:
+        session.send()
+
+    loop = QtCore.QEventLoop()
+    poll = QtCore.QTimer()
+    poll.timeout.connect(lambda: all(s.done() for s in sessions) and loop.quit())
+    poll.start(10)
+    QtCore.QTimer.singleShot(int(args.timeout * 1000), loop.quit)
+    loop.exec_()
+    wall = time.perf_counter() - start
+
+    turn_ms = [ms for s in sessions for ms in s.turn_ms]
+    first_word_ms = [ms for s in sessions for ms in s.first_word_ms]
+    results = {
+        "completed_turns": len(turn_ms),
+        "expected_turns": args.sessions * args.turns,
+        "offline_fallbacks": sum(s.offline for s in sessions),
+        "duration_s": wall,
+        "turns_per_second": len(turn_ms) / wall if wall else 0.0,
+        "first_word_ms": summarise(first_word_ms),
+        "turn_ms": summarise(turn_ms),
+        "turn_stats": [s.bonzi.turn_stats for s in sessions],
+        "backends": fixed_bonzi.BACKEND_ROUTER.stats(),
+    }
+    for session in sessions:
+        session.bonzi.cancel_turn("load test finished")
+        session.bonzi.close()
+    fixed_bonzi.stop_async_loop()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end BonziBuddy chat latency load test")
+    parser.add_argument("--sessions", type=int, default=4, help="concurrent chat sessions (default: 4)")
+    parser.add_argument("--turns", type=int, default=5, help="turns per session (default: 5)")
+    parser.add_argument("--think-s", type=float, default=0.0,
+                        help="pause between a reply and the session's next turn (default: 0)")
+    parser.add_argument("--no-stream", action="store_true", help="request whole replies instead of streaming")
+    parser.add_argument("--backend", choices=["anthropic", "openai", "both"], default="anthropic",
+                        help="stand-in API(s) to route turns to (default: anthropic)")
+    parser.add_argument("--pool-size", type=int, help="override llm_pool_size")
+    parser.add_argument("--url", help="use a stand-in or proxy already running at this base URL")
+    parser.add_argument("--latency", type=standin_server.parse_distribution,
+                        default=standin_server.parse_distribution("lognormal:0.6,0.3"),
+                        help="stand-in time to first token (default: lognormal:0.6,0.3)")
+    parser.add_argument("--token-ms", type=float, default=10.0, help="stand-in delay between tokens (default: 10)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="stand-in injected 529 rate (default: 0)")
+    parser.add_argument("--disconnect-rate", type=float, default=0.0,
+                        help="stand-in rate of streams cut off partway (default: 0)")
+    parser.add_argument("--timeout", type=float, default=300.0, help="give up after this many seconds")
+    parser.add_argument("--output", help="write the JSON results to this file")
+    args = parser.parse_args()
+
+    server = None
+    url = args.url
+    if not url:
+        server, url = start_standin(args)
+    print(f"Load test: {args.sessions} sessions x {args.turns} turns against {url}", file=sys.stderr)
+
+    app = QtWidgets.QApplication(sys.argv)
+    with contextlib.redirect_stdout(sys.stderr):
+        configure(url, args)
+        scenario = run(args, url)
+        app.processEvents()
+
+    results = {
+        "version": RESULTS_VERSION,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "url": url,
+        "sessions": args.sessions,
+        "turns": args.turns,
+        "streaming": not args.no_stream,
+        "backend": args.backend,
+        "pool_size": fixed_bonzi.CONFIG.get("llm_pool_size", 4),
+        "server_requests": server.stats.snapshot() if server else None,
+        "results": scenario,
+    }
+    if server:
+        server.shutdown()
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    return 0 if scenario["completed_turns"] == scenario["expected_turns"] else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
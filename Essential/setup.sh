@@ -32,6 +32,14 @@ if [ -z "$API_KEY" ] || [ "$API_KEY" = "" ]; then
     fi
 fi
 
+# Pack animation frames into a sprite atlas
+echo "Building sprite atlas..."
+python3 build_atlas.py
+
+# Record frame sizes so startup doesn't open every PNG
+echo "Building frame manifest..."
+python3 fixed_bonzi.py --build-manifest
+
 # Create the app
 echo "Creating macOS App Bundle..."
 python3 create_app.py
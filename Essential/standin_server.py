@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for BonziBuddy's LLM and TTS endpoints
+
+Speaks the Anthropic Messages API (POST /v1/messages, streamed or not),
+the OpenAI-style chat completions contract that Backup/infer.py posts to
+inference_api_url (POST /v1/chat/completions, including guided_json) and
+the SAPI4 TTS GET, so the chat pipeline can be benchmarked without the
+real services. Replies are canned Bonzi dialogue in the JSON format the
+app expects, after a configurable latency, with optional injected errors.
+
+Usage:
+    python3 standin_server.py                             # port 8765, ~600 ms to first token
+    python3 standin_server.py --latency lognormal:0.8,0.4 --token-ms 15
+    python3 standin_server.py --error-rate 0.05 --error-status 529 --disconnect-rate 0.02
+
+Point the app at it with anthropic_base_url: "http://127.0.0.1:8765" and
+inference_api_url: "http://127.0.0.1:8765/v1/chat/completions".
+"""
+
+import io
+import sys
+import json
+import time
+import wave
+import random
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+DIALOGUES = [
+    {"dialogue": "Oh look, you again. Fine, I'll help, but only because I'm contractually obligated.", "wave": True},
+    {"dialogue": "That's the best question you've got? I've seen toasters with more curiosity.", "glasses": True},
+    {"dialogue": "Here's your answer, champ: try thinking for once. It's free.", "backflip": True},
+    {"dialogue": "Wow. Groundbreaking. Somebody call the Nobel committee.", "glasses": True, "backflip": True},
+    {"dialogue": "I'd explain it to you, but I left my crayons at home.", "wave": False},
+    {"dialogue": "Sure thing, boss. And by sure thing I mean absolutely not.", "goodbye": True},
+]
+
+def parse_distribution(spec):
+    """
+    Parse a latency distribution in seconds:
+    fixed:S, uniform:LOW,HIGH, normal:MEAN,STDDEV, lognormal:MEDIAN,SIGMA or exp:MEAN.
+    Returns a function that draws a sample.
+    """
+    kind, _, args = spec.partition(":")
+    values = [float(v) for v in args.split(",")] if args else []
+    samplers = {
+        "fixed": lambda: values[0],
+        "uniform": lambda: random.uniform(values[0], values[1]),
+        "normal": lambda: random.gauss(values[0], values[1]),
+        "lognormal": lambda: values[0] * random.lognormvariate(0, values[1]),
+        "exp": lambda: random.expovariate(1.0 / values[0]),
+    }
+    arity = {"fixed": 1, "uniform": 2, "normal": 2, "lognormal": 2, "exp": 1}
+    if kind not in samplers or len(values) != arity[kind]:
+        raise argparse.ArgumentTypeError(f"bad latency distribution: {spec}")
+    return lambda: max(0.0, samplers[kind]())
+
+def canned_reply(guided=None):
+    """
+    A dialogue dict. With guided_json, either infer.py's {"field": "bool"}
+    shorthand or a JSON schema, the reply has exactly the schema's fields.
+    """
+    base = random.choice(DIALOGUES)
+    if not guided:
+        return dict(base)
+    if "properties" in guided:
+        guided = {key: "bool" if spec.get("type") == "boolean" else "string"
+                  for key, spec in guided["properties"].items()}
+    reply = {}
+    for key, kind in guided.items():
+        if kind == "bool":
+            reply[key] = bool(base.get(key, False))
+        else:
+            reply[key] = base["dialogue"] if key == "dialogue" else ""
+    return reply
+
+def estimate_tokens(text):
+    return max(1, len(text) // 4)
+
+def silent_wav(seconds=0.5, rate=16000):
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(rate)
+        f.writeframes(b"\x00\x00" * int(seconds * rate))
+    return buffer.getvalue()
+
+class StandinStats:
+    """Request counters, shared by the handler threads"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = {}
+
+    def count(self, key):
+        with self.lock:
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.counts)
+
+class StandinHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Set by make_server()
+    options = None
+    stats = None
+
+    def log_message(self, format, *args):
+        if self.options.verbose:
+            super().log_message(format, *args)
+
+    def handle_one_request(self):
+        # A client that cancels mid-reply closes its socket; close ours quietly instead of printing a traceback
+        try:
+            super().handle_one_request()
+        except (BrokenPipeError, ConnectionResetError):
+            self.stats.count("client_disconnects")
+            self.close_connection = True
+
+    def finish(self):
+        try:
+            super().finish()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    # --- Plumbing ---
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def start_events(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def send_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def end_events(self):
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            return json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            return None
+
+    def wait_first_token(self):
+        time.sleep(self.options.latency())
+
+    def inject_error(self, api):
+        """Send an injected error response; True if one was sent"""
+        if random.random() >= self.options.error_rate:
+            return False
+        status = random.choice(self.options.error_status)
+        self.stats.count(f"error_{status}")
+        if api == "anthropic":
+            kind = "overloaded_error" if status == 529 else "api_error"
+            self.send_json(status, {"type": "error", "error": {"type": kind, "message": "Injected by standin_server"}})
+        else:
+            self.send_json(status, {"error": {"message": "Injected by standin_server", "code": status}})
+        return True
+
+    def pieces(self, text):
+        """Split text into token-sized pieces, pausing token_ms between them"""
+        size = 4
+        for i in range(0, len(text), size):
+            if i and self.options.token_ms:
+                time.sleep(self.options.token_ms / 1000.0)
+            yield text[i:i + size]
+
+    def drop_midway(self):
+        if random.random() < self.options.disconnect_rate:
+            self.stats.count("disconnects")
+            self.close_connection = True
+            return True
+        return False
+
+    # --- Routes ---
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_GET(self):
+        if self.path.startswith("/health"):
+            self.send_json(200, {"status": "ok", "requests": self.stats.snapshot()})
+            return
+        # Anything else is treated as a SAPI4 TTS request
+        self.stats.count("tts")
+        self.wait_first_token()
+        body = silent_wav()
+        self.send_response(200)
+        self.send_header("Content-Type", "audio/wav")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        body = self.read_body()
+        if body is None:
+            self.send_json(400, {"error": {"message": "Body is not JSON"}})
+            return
+        if self.path.startswith("/v1/messages"):
+            self.anthropic_messages(body)
+        elif self.path.startswith("/v1/chat/completions"):
+            self.chat_completions(body)
+        else:
+            self.send_json(404, {"error": {"message": f"No route for {self.path}"}})
+
+    def anthropic_messages(self, body):
+        self.stats.count("messages")
+        self.wait_first_token()
+        if self.inject_error("anthropic"):
+            return
+        text = json.dumps(canned_reply())
+        input_tokens = estimate_tokens(json.dumps(body.get("system", "")) + json.dumps(body.get("messages", [])))
+        usage = {"input_tokens": input_tokens, "output_tokens": estimate_tokens(text),
+                 "cache_creation_input_tokens": 0, "cache_read_input_tokens": 0}
+        message = {"id": f"msg_standin_{random.getrandbits(32):08x}", "type": "message", "role": "assistant",
+                   "model": body.get("model", "standin"), "stop_sequence": None}
+        if not body.get("stream"):
+            self.send_json(200, dict(message, content=[{"type": "text", "text": text}],
+                                     stop_reason="end_turn", usage=usage))
+            return
+
+        def event(name, data):
+            self.send_chunk(f"event: {name}\ndata: {json.dumps(data)}\n\n".encode("utf-8"))
+
+        self.start_events()
+        event("message_start", {"type": "message_start", "message": dict(
+            message, content=[], stop_reason=None, usage=dict(usage, output_tokens=1))})
+        event("content_block_start", {"type": "content_block_start", "index": 0,
+                                      "content_block": {"type": "text", "text": ""}})
+        for i, piece in enumerate(self.pieces(text)):
+            if i == 2 and self.drop_midway():
+                return
+            event("content_block_delta", {"type": "content_block_delta", "index": 0,
+                                          "delta": {"type": "text_delta", "text": piece}})
+        event("content_block_stop", {"type": "content_block_stop", "index": 0})
+        event("message_delta", {"type": "message_delta", "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+                                "usage": {"output_tokens": usage["output_tokens"]}})
+        event("message_stop", {"type": "message_stop"})
+        self.end_events()
+
+    def chat_completions(self, body):
+        self.stats.count("chat_completions")
+        self.wait_first_token()
+        if self.inject_error("openai"):
+            return
+        extra = body.get("extra_body") or {}
+        guided = body.get("guided_json") or extra.get("guided_json")
+        reply = canned_reply(guided)
+        text = json.dumps(reply)
+        completion_id = f"chatcmpl-standin-{random.getrandbits(32):08x}"
+        model = body.get("model", "standin")
+        if not body.get("stream"):
+            prompt_tokens = estimate_tokens(json.dumps(body.get("messages", [])))
+            payload = {
+                "id": completion_id, "object": "chat.completion", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": estimate_tokens(text),
+                          "total_tokens": prompt_tokens + estimate_tokens(text)},
+            }
+            if guided:
+                # infer.py reads the guided fields from the top level of the response
+                payload.update(reply)
+            self.send_json(200, payload)
+            return
+
+        def chunk(delta, finish_reason=None):
+            data = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                    "model": model, "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+            self.send_chunk(f"data: {json.dumps(data)}\n\n".encode("utf-8"))
+
+        self.start_events()
+        chunk({"role": "assistant", "content": ""})
+        for i, piece in enumerate(self.pieces(text)):
+            if i == 2 and self.drop_midway():
+                return
+            chunk({"content": piece})
+        chunk({}, "stop")
+        self.send_chunk(b"data: [DONE]\n\n")
+        self.end_events()
+
+def make_server(options, host="127.0.0.1", port=8765):
+    """A ThreadingHTTPServer serving the stand-in routes; port 0 picks a free port"""
+    handler = type("Handler", (StandinHandler,), {"options": options, "stats": StandinStats()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    server.stats = handler.stats
+    return server
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Local stand-in for BonziBuddy's LLM and TTS endpoints")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=parse_distribution, default=parse_distribution("lognormal:0.6,0.3"),
+                        help="time to first token, e.g. fixed:0.5, uniform:0.2,1.0, normal:0.8,0.2, "
+                             "lognormal:MEDIAN,SIGMA, exp:MEAN (default: lognormal:0.6,0.3)")
+    parser.add_argument("--token-ms", type=float, default=10.0,
+                        help="delay between streamed tokens in milliseconds (default: 10)")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="fraction of requests answered with an error status (default: 0)")
+    parser.add_argument("--error-status", type=int, action="append",
+                        help="status used for injected errors (repeatable, default: 529)")
+    parser.add_argument("--disconnect-rate", type=float, default=0.0,
+                        help="fraction of streams cut off partway (default: 0)")
+    parser.add_argument("--dialogues", help="JSON file with a list of canned replies to use instead")
+    parser.add_argument("--seed", type=int, help="random seed for repeatable runs")
+    parser.add_argument("--verbose", action="store_true", help="log every request")
+    return parser
+
+def main():
+    args = build_parser().parse_args()
+    args.error_status = args.error_status or [529]
+    if args.seed is not None:
+        random.seed(args.seed)
+    if args.dialogues:
+        with open(args.dialogues, "r") as f:
+            DIALOGUES[:] = json.load(f)
+    server = make_server(args, args.host, args.port)
+    print(f"Stand-in server listening on http://{args.host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"Requests: {server.stats.snapshot()}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
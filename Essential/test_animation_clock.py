@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Tests for AnimationClock
+
+Frames follow wall-clock deadlines: a late wakeup skips ahead and counts
+the frames it dropped, one-shots play in queue order in front of the base
+loop, and the timer stops when nothing on screen can change.
+
+Usage:
+    python3 -m pytest -q test_animation_clock.py
+"""
+
+import os
+import sys
+
+import pytest
+
+# Run from the BonziBuddy directory so config.yaml is found
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fixed_bonzi
+from PyQt5 import QtWidgets
+
+class FakeTime:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+@pytest.fixture(scope="module")
+def app():
+    return QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+
+@pytest.fixture
+def clock_time(monkeypatch):
+    fake = FakeTime()
+    monkeypatch.setattr(fixed_bonzi.time, "monotonic", fake)
+    return fake
+
+@pytest.fixture
+def clock(app, clock_time):
+    shown = []
+    clock = fixed_bonzi.AnimationClock(shown.append, interval_ms=100)
+    clock.shown = shown
+    yield clock
+    clock.timer.stop()
+
+def advance(clock, clock_time, seconds):
+    """Wake the clock seconds from now, as its timer would"""
+    clock_time.advance(seconds)
+    clock.tick()
+
+def test_frames_follow_the_deadlines(clock, clock_time):
+    clock.set_base("idle", ["a", "b", "c"])
+    assert clock.shown == ["a"]
+    assert clock.next_deadline == pytest.approx(clock_time.now + 0.1)
+    advance(clock, clock_time, 0.1)
+    advance(clock, clock_time, 0.1)
+    assert clock.shown == ["a", "b", "c"]
+    assert clock.next_deadline == pytest.approx(clock_time.now + 0.1)
+    assert clock.stats()["frames_dropped"] == 0
+
+def test_late_wakeup_skips_ahead(clock, clock_time):
+    clock.set_base("idle", ["a", "b", "c"])
+    advance(clock, clock_time, 0.35)
+    # Three steps have elapsed; the loop wraps back to "a" and two frames are dropped
+    assert clock.shown == ["a", "a"]
+    stats = clock.stats()
+    assert stats["frames_dropped"] == 2
+    assert stats["max_lateness_ms"] == pytest.approx(250)
+    # The next deadline stays on the original grid rather than drifting
+    assert clock.next_deadline == pytest.approx(clock_time.now + 0.05)
+
+def test_early_wakeup_shows_nothing(clock, clock_time):
+    clock.set_base("idle", ["a", "b"])
+    advance(clock, clock_time, 0.05)
+    assert clock.shown == ["a"]
+
+def test_one_shots_play_in_order_then_the_base_resumes(clock, clock_time):
+    finished = []
+    clock.set_base("idle", ["i"])
+    clock.play("wave", ["w1", "w2"], on_finished=lambda: finished.append("wave"))
+    clock.play("glasses", ["g1"], on_finished=lambda: finished.append("glasses"))
+    assert clock.is_playing("glasses")
+    for _ in range(3):
+        advance(clock, clock_time, 0.1)
+    assert clock.shown == ["i", "w1", "w2", "g1", "i"]
+    assert finished == ["wave", "glasses"]
+    assert not clock.is_playing()
+
+def test_preempt_drops_queued_tracks_without_callbacks(clock, clock_time):
+    finished = []
+    clock.set_base("idle", ["i"])
+    clock.play("wave", ["w1", "w2"], on_finished=lambda: finished.append("wave"))
+    clock.play("glasses", ["g1"], on_finished=lambda: finished.append("glasses"))
+    clock.play("leave", ["l1"], on_finished=lambda: finished.append("leave"), preempt=True)
+    assert clock.shown[-1] == "l1"
+    advance(clock, clock_time, 0.1)
+    assert finished == ["leave"]
+
+def test_timer_stops_when_nothing_can_change(clock, clock_time):
+    clock.set_base("idle", ["still"])
+    assert clock.next_deadline is None
+    assert not clock.timer.isActive()
+    clock.play("wave", ["w1", "w2"])
+    assert clock.timer.isActive()
+    advance(clock, clock_time, 0.1)
+    advance(clock, clock_time, 0.1)
+    assert clock.next_deadline is None
+    assert not clock.timer.isActive()
+
+def test_resume_continues_from_the_frame_shown(clock, clock_time):
+    clock.set_base("idle", ["a", "b", "c"])
+    advance(clock, clock_time, 0.1)
+    clock.suspend()
+    assert not clock.timer.isActive()
+    clock_time.advance(60)
+    clock.resume()
+    assert clock.next_deadline == pytest.approx(clock_time.now + 0.1)
+    advance(clock, clock_time, 0.1)
+    assert clock.shown == ["a", "b", "c"]
+    assert clock.stats()["frames_dropped"] == 0
+
+def test_slower_base_keeps_its_place(clock, clock_time):
+    clock.set_base("idle", ["a", "b", "c"])
+    advance(clock, clock_time, 0.1)
+    clock.set_base_interval(250)
+    assert clock.next_deadline == pytest.approx(clock_time.now + 0.25)
+    advance(clock, clock_time, 0.25)
+    assert clock.shown == ["a", "b", "c"]
+
+if __name__ == "__main__":
+    sys.exit(pytest.main(["-q", __file__]))
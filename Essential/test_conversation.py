@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Tests for ConversationManager
+
+The window stays under budget, folds hand out the oldest exchanges and
+swap in the summary, and between folds each request's prefix is the
+previous request plus one exchange so the prompt cache can reuse it.
+
+Usage:
+    python3 -m pytest -q test_conversation.py
+"""
+
+import os
+import sys
+
+import pytest
+
+# Run from the BonziBuddy directory so config.yaml is found
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fixed_bonzi
+
+def chat(conversation, turns, length=200):
+    """Run turns of question and reply; returns the window sent for each"""
+    windows = []
+    for turn in range(turns):
+        question = f"question {turn} " + "q" * length
+        windows.append(conversation.window(question))
+        conversation.add_exchange(question, f"reply {turn} " + "r" * length)
+    return windows
+
+def test_window_ends_with_the_new_message():
+    conversation = fixed_bonzi.ConversationManager()
+    chat(conversation, 2)
+    window = conversation.window("what now?")
+    assert len(window) == 5
+    assert window[-1] == {"role": "user", "content": "what now?"}
+    assert window[0]["role"] == "user"
+
+def test_window_is_trimmed_to_the_budget():
+    conversation = fixed_bonzi.ConversationManager(budget_tokens=300)
+    chat(conversation, 10)
+    window = conversation.window("what now?")
+    assert conversation.tokens(window) <= 300
+    assert window[0]["role"] == "user"
+    assert window[-1]["content"] == "what now?"
+
+def test_prefix_is_stable_between_folds():
+    conversation = fixed_bonzi.ConversationManager()
+    windows = chat(conversation, 20)
+    for previous, current in zip(windows, windows[1:]):
+        assert current[:len(previous)] == previous
+    assert conversation.take_fold_batch() is None
+
+def test_fold_hands_out_the_oldest_exchanges_and_keeps_recent_ones():
+    conversation = fixed_bonzi.ConversationManager(budget_tokens=1000, keep_recent=4)
+    chat(conversation, 20)
+    summary, batch = conversation.take_fold_batch()
+    assert summary == ""
+    assert batch[0]["content"].startswith("question 0")
+    assert len(batch) % 2 == 0
+    assert conversation.take_fold_batch() is None  # one fold at a time
+
+    conversation.finish_fold("they asked twenty questions")
+    assert conversation.summary == "they asked twenty questions"
+    assert conversation.messages[0]["content"].startswith(f"question {len(batch) // 2}")
+    assert conversation.messages[-1]["content"].startswith("reply 19")
+    assert conversation.tokens(conversation.messages) <= 1000 // 2 + 100
+
+def test_failed_fold_keeps_the_history():
+    conversation = fixed_bonzi.ConversationManager(budget_tokens=1000)
+    chat(conversation, 20)
+    before = list(conversation.messages)
+    conversation.take_fold_batch()
+    conversation.finish_fold(None)
+    assert conversation.messages == before
+    assert conversation.fold_failures == 1
+
+def test_default_budget_folds_rarely():
+    conversation = fixed_bonzi.ConversationManager()
+    folds = 0
+    for turn in range(100):
+        chat(conversation, 1, length=120)
+        batch = conversation.take_fold_batch()
+        if batch:
+            folds += 1
+            conversation.finish_fold("summary")
+    assert folds <= 5
+
+def test_message_cap_trims_in_one_step():
+    conversation = fixed_bonzi.ConversationManager(budget_tokens=10 ** 6, max_messages=20)
+    chat(conversation, 10, length=1)
+    assert len(conversation.messages) == 20
+    chat(conversation, 1, length=1)
+    assert len(conversation.messages) == 10
+    assert conversation.messages[0]["role"] == "user"
+
+def test_only_newer_turns_are_recorded():
+    conversation = fixed_bonzi.ConversationManager()
+    assert conversation.add_exchange("first", "one", turn_id=1)
+    assert conversation.add_exchange("third", "three", turn_id=3)
+    assert not conversation.add_exchange("second", "two", turn_id=2)
+    assert not conversation.add_exchange("third", "three", turn_id=3)
+    assert [m["content"] for m in conversation.messages] == ["first", "one", "third", "three"]
+
+if __name__ == "__main__":
+    sys.exit(pytest.main(["-q", __file__]))
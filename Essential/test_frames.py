@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Tests for FrameCache and atlas sheets
+
+FrameCache keeps pinned animations resident and evicts the rest least
+recently used first; identical frames are shared. Atlas sheets are
+decoded once into the per-user cache dir, never next to the sheet, and
+frames cut from that copy match the sheet.
+
+Usage:
+    python3 -m pytest -q test_frames.py
+"""
+
+import os
+import sys
+
+import pytest
+
+# Run from the BonziBuddy directory so config.yaml is found
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fixed_bonzi
+from PyQt5 import QtCore, QtGui, QtWidgets
+
+FRAME_BYTES = 10 * 10 * 4
+
+@pytest.fixture(scope="module")
+def app():
+    return QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+
+def solid(name):
+    """A 10x10 frame whose colour depends only on the name's first character"""
+    image = QtGui.QImage(10, 10, QtGui.QImage.Format_ARGB32_Premultiplied)
+    image.fill(QtGui.QColor(ord(name[0]), 0, 0))
+    return QtGui.QPixmap.fromImage(image)
+
+def frames(key, count=3):
+    return [f"{chr(ord('a') + index)}{key}{index}" for index in range(count)]
+
+def test_hit_returns_the_same_list(app):
+    cache = fixed_bonzi.FrameCache(solid)
+    first = cache.get("wave", frames("wave"))
+    assert cache.get("wave", frames("wave")) is first
+    assert (cache.hits, cache.misses) == (1, 1)
+
+def test_least_recently_used_is_evicted_first(app):
+    names = {key: [f"{key}{index}" for index in range(2)] for key in ("w", "x", "y", "z")}
+    cache = fixed_bonzi.FrameCache(solid, budget_bytes=3 * FRAME_BYTES)
+    cache.get("w", names["w"])  # both frames share one colour, so one pixmap each
+    cache.get("x", names["x"])
+    cache.get("y", names["y"])
+    cache.get("w", names["w"])  # w is now the most recently used
+    cache.get("z", names["z"])
+    assert not cache.contains("x")
+    assert cache.contains("w") and cache.contains("y") and cache.contains("z")
+    assert cache.resident_bytes <= 3 * FRAME_BYTES
+
+def test_pinned_animations_are_never_evicted(app):
+    cache = fixed_bonzi.FrameCache(solid, budget_bytes=FRAME_BYTES, pinned=["idle"])
+    cache.get("idle", ["i0"])
+    for key in ("w", "x", "y"):
+        cache.get(key, [key])
+    assert cache.contains("idle")
+    assert cache.contains("y")  # the one just requested stays too
+    assert not cache.contains("w") and not cache.contains("x")
+
+def test_identical_frames_are_shared(app):
+    cache = fixed_bonzi.FrameCache(solid)
+    wave = cache.get("wave", ["s1", "t1"])
+    talk = cache.get("talk", ["s2", "u2"])
+    assert wave[0] is talk[0]
+    assert cache.resident_bytes == 3 * FRAME_BYTES
+    cache.evict("wave")
+    assert cache.resident_bytes == 2 * FRAME_BYTES  # "s" is still used by talk
+
+@pytest.fixture
+def sheet(app, tmp_path):
+    image = QtGui.QImage(64, 48, QtGui.QImage.Format_ARGB32)
+    for y in range(48):
+        for x in range(64):
+            image.setPixelColor(x, y, QtGui.QColor(x * 4, y * 5, (x + y) % 256, 255 - x))
+    path = str(tmp_path / "bundle" / "atlas.png")
+    os.makedirs(os.path.dirname(path))
+    assert image.save(path)
+    return path
+
+@pytest.fixture
+def animation(app, monkeypatch):
+    monkeypatch.setitem(fixed_bonzi.CONFIG, "use_atlas", False)
+    return fixed_bonzi.Animation()
+
+def expected(sheet, rect):
+    image = QtGui.QImage(sheet).convertToFormat(QtGui.QImage.Format_ARGB32_Premultiplied)
+    return image.copy(QtCore.QRect(*rect))
+
+def test_sheet_copy_goes_to_the_user_cache_dir(animation, sheet, tmp_path, monkeypatch):
+    monkeypatch.setitem(fixed_bonzi.CONFIG, "user_cache_dir", str(tmp_path / "cache"))
+    pixels_path, width, height, stride = animation.sheet_pixels(sheet)
+    assert os.path.dirname(pixels_path) == str(tmp_path / "cache" / "sheets")
+    assert os.listdir(os.path.dirname(sheet)) == ["atlas.png"]
+    assert (width, height) == (64, 48)
+    rect = (10, 7, 20, 15)
+    assert animation.cut_frame(sheet, rect).toImage() == expected(sheet, rect)
+
+def test_rebuilt_sheet_replaces_its_old_copy(animation, sheet, tmp_path, monkeypatch):
+    monkeypatch.setitem(fixed_bonzi.CONFIG, "user_cache_dir", str(tmp_path / "cache"))
+    old_path = animation.sheet_pixels(sheet)[0]
+    image = QtGui.QImage(sheet)
+    image.fill(QtGui.QColor("purple"))
+    image.save(sheet)
+    animation.atlas_pixels.clear()
+    new_path = animation.sheet_pixels(sheet)[0]
+    assert new_path != old_path
+    assert os.listdir(os.path.dirname(new_path)) == [os.path.basename(new_path)]
+
+def test_unwritable_cache_dir_decodes_in_memory(animation, sheet, tmp_path, monkeypatch):
+    blocker = tmp_path / "not-a-dir"
+    blocker.write_text("")
+    monkeypatch.setitem(fixed_bonzi.CONFIG, "user_cache_dir", str(blocker / "cache"))
+    assert animation.sheet_pixels(sheet) is None
+    rect = (0, 0, 16, 16)
+    assert animation.cut_frame(sheet, rect).toImage() == expected(sheet, rect)
+
+if __name__ == "__main__":
+    sys.exit(pytest.main(["-q", __file__]))
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Tests for LocalIntents
+
+Each phrase either gets the named local intent or goes to the model
+(None). Dates, idioms and everyday sentences that happen to start with
+"open" or contain a slash must never be answered locally.
+
+Usage:
+    python3 -m pytest -q test_local_intents.py
+"""
+
+import os
+import sys
+
+import pytest
+
+# Run from the BonziBuddy directory so config.yaml is found
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fixed_bonzi
+
+PHRASES = [
+    # Summoning and closing
+    ("come back", "summon"),
+    ("hey come back bonzi!", "summon"),
+    ("wake up bonzi", "summon"),
+    ("open bonzi", "summon"),
+    ("open up bonzi please", "summon"),
+    ("open", None),
+    ("open the pod bay doors", None),
+    ("open source?", None),
+    ("open up about your feelings", None),
+    ("where are you going with this", None),
+    ("goodbye bonzi", "close"),
+    ("/quit", "close"),
+    ("bye", None),
+    ("leave me alone", None),
+    # Time and date
+    ("what time is it?", "time"),
+    ("what's today's date", "date"),
+    ("what time is the game tonight", None),
+    # Conversion
+    ("convert 5 miles to km", "convert"),
+    ("how many feet in a mile", "convert"),
+    ("5 apples to oranges", None),
+    # Arithmetic
+    ("what's 2 + 2", "math"),
+    ("calculate 24/7", "math"),
+    ("24/7 =", "math"),
+    ("what's 24 / 7", "math"),
+    ("what is 12 times 12", "math"),
+    ("2 to the power of 10", "math"),
+    ("what's 15% of 80", "math"),
+    ("what's 24/7", None),
+    ("is the shop open 24/7", None),
+    ("what's 9/11", None),
+    ("it's a 50/50 chance", None),
+    ("what happened on 12/25", None),
+    ("remind me on 10/12/2024", None),
+    ("what's 2024-10-12", None),
+    ("I'm 5 - 10 minutes away", None),
+    ("my top 3 movies", None),
+]
+
+@pytest.fixture
+def intents():
+    return fixed_bonzi.LocalIntents()
+
+def intent_of(intents, phrase):
+    before = dict(intents.hits)
+    result = intents.match(phrase)
+    if result is None:
+        return None
+    return next(name for name, count in intents.hits.items() if count != before.get(name, 0))
+
+@pytest.mark.parametrize("phrase, intent", PHRASES)
+def test_phrase_routing(intents, phrase, intent):
+    assert intent_of(intents, phrase) == intent
+
+@pytest.mark.parametrize("phrase, answer", [
+    ("what's 2 + 2", "4"),
+    ("calculate 24/7", "3.42857"),
+    ("what is 2 ** 10", "1,024"),
+    ("what's 1.5 * 4", "6"),
+])
+def test_math_answers(intents, phrase, answer):
+    reply, animations, action = intents.match(phrase)
+    assert answer in reply
+    assert animations == ["glasses"] and action is None
+
+@pytest.mark.parametrize("phrase", [
+    "what's 1000000 ** 64",
+    "what's 10 ** 100",
+    "what's 2 ** 9999999999",
+    "what's 9 ** 9 ** 9",
+    "what's 99999999999999999999 + 1",
+    "what's 999999999 * 999999999 * 999999999",
+])
+def test_oversized_arithmetic_goes_to_the_model(intents, phrase):
+    start = fixed_bonzi.time.perf_counter()
+    assert intents.match(phrase) is None
+    assert fixed_bonzi.time.perf_counter() - start < 0.1
+
+def test_divide_by_zero(intents):
+    reply, animations, action = intents.match("what's 5 / 0")
+    assert reply in fixed_bonzi.DIVIDE_BY_ZERO_REPLIES
+
+if __name__ == "__main__":
+    sys.exit(pytest.main(["-q", __file__]))
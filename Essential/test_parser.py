@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Tests for StreamingResponseParser
+
+Dialogue and animation flags come out as they stream in, whatever the
+chunk boundaries. Only a { followed by "dialogue" opens the reply object:
+a preamble is never streamed, and a plain-text answer with braces in it
+is given back whole when the stream ends.
+
+Usage:
+    python3 -m pytest -q test_parser.py
+"""
+
+import os
+import sys
+
+import pytest
+
+# Run from the BonziBuddy directory so config.yaml is found
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fixed_bonzi
+
+def parse(reply, size):
+    """Feed reply in chunks of size; returns (streamed dialogue, animations as flagged, parser)"""
+    streamed = []
+    flagged = []
+    parser = fixed_bonzi.StreamingResponseParser(on_dialogue=streamed.append, on_animation=flagged.append)
+    for start in range(0, len(reply), size):
+        parser.feed(reply[start:start + size])
+    return "".join(streamed), flagged, parser
+
+CASES = [
+    # reply, streamed dialogue, final text, animations, complete
+    ('{"dialogue": "Hello there!", "wave": true, "backflip": false}',
+     "Hello there!", "Hello there!", ["wave"], True),
+    ('Sure! Here\'s the JSON:\n```json\n{"dialogue": "Fine.", "glasses": true}\n```',
+     "Fine.", "Fine.", ["glasses"], True),
+    ('{\n  "dialogue" : "Spaced out",\n  "goodbye": true\n}',
+     "Spaced out", "Spaced out", ["goodbye"], True),
+    ('{"dialogue": "Braces {like} these and \\"quotes\\" \\ud83d\\ude00", "wave": false}',
+     'Braces {like} these and "quotes" \U0001F600', 'Braces {like} these and "quotes" \U0001F600', [], True),
+    ('{"dialogue": "*waves* Hi", "extra": {"a": [1, "}"]}, "backflip": true}',
+     "*waves* Hi", "Hi", ["backflip"], True),
+    ('Use {name} in the template, or {"x": 1} as data.',
+     "", 'Use {name} in the template, or {"x": 1} as data.', [], False),
+    ('Sets look like {1, 2}. {"dialogue": "Told you."}',
+     "Told you.", "Told you.", [], True),
+    ('I will answer in plain text {',
+     "", "I will answer in plain text {", [], False),
+    ('{"dialog',
+     "", '{"dialog', [], False),
+]
+
+@pytest.mark.parametrize("size", [1, 3, 7, 1000])
+@pytest.mark.parametrize("reply, streamed, text, animations, complete", CASES)
+def test_reply(reply, streamed, text, animations, complete, size):
+    got_streamed, flagged, parser = parse(reply, size)
+    assert got_streamed == streamed
+    assert flagged == animations
+    assert parser.finish() == (text, animations)
+    assert parser.is_complete() == complete
+
+def test_prose_is_never_streamed():
+    streamed, flagged, parser = parse("Here you go, no JSON today.", 4)
+    assert streamed == ""
+    assert not parser.has_dialogue
+    assert parser.finish() == ("Here you go, no JSON today.", [])
+
+def test_text_after_the_object_is_ignored():
+    streamed, flagged, parser = parse('{"dialogue": "Done."} Anything else?', 5)
+    assert parser.finish() == ("Done.", [])
+
+if __name__ == "__main__":
+    sys.exit(pytest.main(["-q", __file__]))
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Tests for prompt-cache breakpoints
+
+Breakpoints are only emitted where the prefix up to them reaches the
+model's minimum cacheable length; anything shorter is sent unmarked.
+
+Usage:
+    python3 -m pytest -q test_prompt_caching.py
+"""
+
+import os
+import sys
+
+import pytest
+
+# Run from the BonziBuddy directory so config.yaml is found
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fixed_bonzi
+
+def params(system, history=(), model="claude-3-haiku-20240307"):
+    messages = [{"role": "user" if i % 2 == 0 else "assistant", "content": text}
+                for i, text in enumerate(history)]
+    messages.append({"role": "user", "content": "And now?"})
+    return {"model": model, "max_tokens": 100, "temperature": 1.0, "system": system, "messages": messages}
+
+def marked(params):
+    """Where cache_control ended up: 'system', and/or the index of a marked message"""
+    places = []
+    if isinstance(params["system"], list):
+        places += ["system" for block in params["system"] if "cache_control" in block]
+    for index, message in enumerate(params["messages"]):
+        if isinstance(message["content"], list) and any("cache_control" in b for b in message["content"]):
+            places.append(index)
+    return places
+
+@pytest.mark.parametrize("model, tokens", [
+    ("claude-3-haiku-20240307", 2048),
+    ("claude-3-5-haiku-latest", 2048),
+    ("claude-haiku-4-5", 4096),
+    ("claude-sonnet-4-5", 1024),
+])
+def test_minimum_per_model(model, tokens):
+    assert fixed_bonzi.prompt_cache_min_tokens(model) == tokens
+
+def test_short_prefix_gets_no_breakpoints():
+    original = params(fixed_bonzi.SYSTEM_PROMPT, ["Hi", "What do you want?"])
+    result = fixed_bonzi.with_cache_breakpoints(original, 2048)
+    assert marked(result) == []
+    assert result["system"] == fixed_bonzi.SYSTEM_PROMPT
+    assert result["messages"] == original["messages"]
+
+def test_long_history_marks_the_turn_before_the_new_message():
+    history = ["x" * 4000, "y" * 4000, "z" * 400, "Sure."]
+    result = fixed_bonzi.with_cache_breakpoints(params("short system", history), 2048)
+    assert marked(result) == [3]
+    assert result["messages"][3]["content"][0]["text"] == "Sure."
+    assert result["messages"][-1] == {"role": "user", "content": "And now?"}
+
+def test_long_system_prompt_is_marked_on_its_own():
+    result = fixed_bonzi.with_cache_breakpoints(params("s" * 9000), 2048)
+    assert marked(result) == ["system"]
+
+def test_summary_counts_towards_the_prefix_but_is_not_marked():
+    system = [{"type": "text", "text": "short system"},
+              {"type": "text", "text": "Summary of the conversation so far: " + "w" * 9000}]
+    result = fixed_bonzi.with_cache_breakpoints(params(system, ["Hi", "Hello."]), 2048)
+    assert marked(result) == [1]
+    assert "cache_control" not in result["system"][1]
+
+def test_input_is_not_modified():
+    original = params("short system", ["x" * 9000, "Ok."])
+    fixed_bonzi.with_cache_breakpoints(original, 2048)
+    assert marked(original) == []
+
+if __name__ == "__main__":
+    sys.exit(pytest.main(["-q", __file__]))
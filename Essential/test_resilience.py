@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Tests for CircuitBreaker and call_with_retry
+
+The breaker opens after a run of failures, lets exactly one trial call
+through once reset_after_s has passed, and closes or reopens on its
+outcome. call_with_retry retries only retryable errors.
+
+Usage:
+    python3 -m pytest -q test_resilience.py
+"""
+
+import asyncio
+import os
+import sys
+
+import pytest
+
+# Run from the BonziBuddy directory so config.yaml is found
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fixed_bonzi
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setitem(fixed_bonzi.CONFIG, "retry_base_delay_s", 0)
+
+def opened(threshold=2):
+    breaker = fixed_bonzi.CircuitBreaker("test", failure_threshold=threshold, reset_after_s=30)
+    for _ in range(threshold):
+        assert breaker.allow()
+        breaker.record_failure()
+    return breaker
+
+def expire(breaker):
+    breaker.opened_at -= breaker.reset_after_s
+
+def test_opens_after_the_threshold_and_fails_fast():
+    breaker = opened()
+    assert breaker.state == "open"
+    assert breaker.is_open()
+    assert not breaker.allow()
+    assert breaker.rejected == 1
+
+def test_success_resets_the_failure_count():
+    breaker = fixed_bonzi.CircuitBreaker("test", failure_threshold=2)
+    breaker.allow()
+    breaker.record_failure()
+    breaker.allow()
+    breaker.record_success()
+    breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "closed"
+
+def test_half_open_lets_one_trial_through():
+    breaker = opened()
+    expire(breaker)
+    assert breaker.allow()
+    assert breaker.state == "half_open"
+    assert not breaker.allow()  # the trial is still in flight
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.allow() and breaker.allow()
+
+def test_failed_trial_reopens():
+    breaker = opened()
+    expire(breaker)
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+def test_released_trial_frees_the_slot():
+    breaker = opened()
+    expire(breaker)
+    assert breaker.allow()
+    breaker.release()
+    assert breaker.allow()
+
+def flaky(failures, error):
+    """A call that raises error the first failures times, then returns "ok" """
+    calls = []
+
+    async def call():
+        calls.append(1)
+        if len(calls) <= failures:
+            raise error
+        return "ok"
+    return call, calls
+
+def test_retryable_errors_are_retried():
+    breaker = fixed_bonzi.CircuitBreaker("test")
+    call, calls = flaky(2, fixed_bonzi.BackendError("overloaded", status_code=529))
+    assert asyncio.run(fixed_bonzi.call_with_retry(breaker, call, retries=2)) == "ok"
+    assert len(calls) == 3
+    assert breaker.retries == 2
+    assert breaker.consecutive_failures == 0
+
+def test_gives_up_after_the_retries():
+    breaker = fixed_bonzi.CircuitBreaker("test")
+    call, calls = flaky(5, ConnectionError("refused"))
+    with pytest.raises(ConnectionError):
+        asyncio.run(fixed_bonzi.call_with_retry(breaker, call, retries=1))
+    assert len(calls) == 2
+
+def test_other_errors_are_not_retried_or_counted():
+    breaker = fixed_bonzi.CircuitBreaker("test")
+    call, calls = flaky(1, fixed_bonzi.BackendError("bad request", status_code=400))
+    with pytest.raises(fixed_bonzi.BackendError):
+        asyncio.run(fixed_bonzi.call_with_retry(breaker, call, retries=2))
+    assert len(calls) == 1
+    assert breaker.failures == 0
+
+def test_open_breaker_never_calls():
+    breaker = opened()
+    call, calls = flaky(0, None)
+    with pytest.raises(fixed_bonzi.CircuitOpenError):
+        asyncio.run(fixed_bonzi.call_with_retry(breaker, call))
+    assert calls == []
+
+def test_should_retry_can_veto():
+    breaker = fixed_bonzi.CircuitBreaker("test")
+    call, calls = flaky(1, ConnectionError("reset"))
+    with pytest.raises(ConnectionError):
+        asyncio.run(fixed_bonzi.call_with_retry(breaker, call, retries=2, should_retry=lambda error: False))
+    assert len(calls) == 1
+
+if __name__ == "__main__":
+    sys.exit(pytest.main(["-q", __file__]))
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Tests for ResponseCache
+
+A repeated question is answered from disk only when the whole request
+matches, entries expire and are evicted least recently used first, and
+turns about the time or date, or ones LocalIntents answers, are never
+cached.
+
+Usage:
+    python3 -m pytest -q test_response_cache.py
+"""
+
+import os
+import sys
+
+import pytest
+
+# Run from the BonziBuddy directory so config.yaml is found
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fixed_bonzi
+
+def params(question, temperature=0.5, history=()):
+    messages = [{"role": role, "content": content} for role, content in history]
+    messages.append({"role": "user", "content": question})
+    return {"model": "test-model", "max_tokens": 10, "temperature": temperature,
+            "system": "system prompt", "messages": messages}
+
+@pytest.fixture
+def cache(tmp_path):
+    return fixed_bonzi.ResponseCache(str(tmp_path), ttl_s=60, max_entries=2)
+
+def store(cache, question, reply="An answer.", **kwargs):
+    key = cache.key_for(params(question, **kwargs))
+    if key:
+        cache.put(key, reply, ["wave"], model="test-model")
+    return key
+
+def lookup(cache, question, **kwargs):
+    key = cache.key_for(params(question, **kwargs))
+    return cache.get(key) if key else None
+
+def test_hit_needs_the_same_request(cache):
+    store(cache, "Who painted the Mona Lisa?")
+    assert lookup(cache, "who painted the mona lisa") == ("An answer.", ["wave"])
+    assert lookup(cache, "Who painted the Mona Lisa?", temperature=0.9) is None
+    assert lookup(cache, "Who painted the Mona Lisa?", history=[("user", "hi"), ("assistant", "hello")]) is None
+
+def test_high_temperature_is_not_cached(cache):
+    assert store(cache, "Tell me a joke", temperature=1.5) is None
+    assert cache.stats()["skipped_high_temp"] == 1
+
+@pytest.mark.parametrize("question", [
+    "What day is it today?",
+    "Is the shop open tomorrow?",
+    "What happened on Monday?",
+    "How long until December?",
+    "What's the latest news?",
+    "Anything fun to do this weekend",
+])
+def test_time_sensitive_turns_are_not_cached(cache, question):
+    assert store(cache, question) is None
+    assert lookup(cache, question) is None
+    assert cache.stats()["skipped_time_sensitive"] == 2
+    assert cache.stats()["entries"] == 0
+
+@pytest.mark.parametrize("question", ["2 + 2", "convert 5 km to miles", "goodbye bonzi", "come back bonzi"])
+def test_local_intent_turns_are_not_cached(cache, monkeypatch, question):
+    monkeypatch.setattr(fixed_bonzi, "LOCAL_INTENTS", fixed_bonzi.LocalIntents())
+    assert store(cache, question) is None
+    assert fixed_bonzi.LOCAL_INTENTS.stats()["hits"] == {}
+
+def test_may_and_march_are_still_cached(cache):
+    assert store(cache, "May I ask what a platypus eats?")
+    assert store(cache, "Why do ants march in a line?")
+
+def test_expired_entry_misses(cache, monkeypatch):
+    store(cache, "Who painted the Mona Lisa?")
+    now = fixed_bonzi.time.time()
+    monkeypatch.setattr(fixed_bonzi.time, "time", lambda: now + 61)
+    assert lookup(cache, "Who painted the Mona Lisa?") is None
+    assert cache.stats()["expired"] == 1
+
+def test_least_recently_used_is_evicted(cache):
+    store(cache, "first question")
+    store(cache, "second question")
+    assert lookup(cache, "first question")
+    store(cache, "third question")
+    assert lookup(cache, "second question") is None
+    assert lookup(cache, "first question") and lookup(cache, "third question")
+    assert cache.stats()["evictions"] == 1
+
+def test_index_is_reloaded_from_disk(cache):
+    store(cache, "Who painted the Mona Lisa?")
+    reopened = fixed_bonzi.ResponseCache(cache.directory)
+    assert lookup(reopened, "Who painted the Mona Lisa?") == ("An answer.", ["wave"])
+
+if __name__ == "__main__":
+    sys.exit(pytest.main(["-q", __file__]))
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Tests for BackendRouter
+
+Every live backend is tried before the expected_ms priors are trusted, a
+backend that refuses a call through its breaker is skipped without
+counting as an error, streamed text reaches the sink once, and a cached
+answer is still given when every backend is down.
+
+Usage:
+    python3 -m pytest -q test_router.py
+"""
+
+import asyncio
+import os
+import sys
+
+import pytest
+
+# Run from the BonziBuddy directory so config.yaml is found
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fixed_bonzi
+from PyQt5 import QtWidgets
+
+PARAMS = {"model": "test-model", "max_tokens": 10, "temperature": 0.5, "system": "system prompt",
+          "messages": [{"role": "user", "content": "hi"}]}
+
+class FakeBackend(fixed_bonzi.InferenceBackend):
+    kind = "fake"
+
+    def __init__(self, name, expected_ms, error=None):
+        super().__init__(name, expected_ms=expected_ms)
+        self.error = error
+        self.sent = 0
+
+    async def send(self, params, on_text=None):
+        self.sent += 1
+        if self.error:
+            raise self.error
+        text = '{"dialogue": "' + self.name + '"}'
+        if on_text:
+            on_text(text[:10])
+            on_text(text[10:])
+        return fixed_bonzi.BackendReply(text)
+
+@pytest.fixture(autouse=True)
+def never_explore(monkeypatch):
+    monkeypatch.setitem(fixed_bonzi.CONFIG, "router_explore", 0.0)
+
+def route(router, **kwargs):
+    return asyncio.run(router.complete(PARAMS, **kwargs))
+
+def test_every_live_backend_is_tried_first():
+    fast = FakeBackend("fast", expected_ms=100)
+    slow = FakeBackend("slow", expected_ms=5000)
+    router = fixed_bonzi.BackendRouter([fast, slow, fixed_bonzi.OfflineBackend("offline")])
+    used = [route(router)[0].name for _ in range(2)]
+    assert sorted(used) == ["fast", "slow"]
+    assert fast.requests == 1 and slow.requests == 1
+
+def test_measured_latency_wins_once_everyone_is_tried():
+    fast = FakeBackend("fast", expected_ms=5000)
+    slow = FakeBackend("slow", expected_ms=100)
+    fast.record(50, None)
+    slow.record(900, None)
+    router = fixed_bonzi.BackendRouter([fast, slow])
+    assert [backend.name for backend in router.ranked()] == ["fast", "slow"]
+
+def test_refused_call_is_not_an_error():
+    busy = FakeBackend("busy", expected_ms=100)
+    other = FakeBackend("other", expected_ms=200)
+    other.record(200, None)
+    # Half-open with the one trial call already in flight elsewhere
+    busy.breaker.state = "half_open"
+    busy.breaker.trial_in_flight = True
+    router = fixed_bonzi.BackendRouter([busy, other])
+    backend, reply = route(router)
+    assert backend is other
+    assert busy.sent == 0
+    assert busy.errors == 0 and busy.error_ewma == 0.0
+
+def test_failures_are_errors_and_fail_over():
+    broken = FakeBackend("broken", expected_ms=100, error=fixed_bonzi.BackendError("bad request", status_code=400))
+    spare = FakeBackend("spare", expected_ms=200)
+    router = fixed_bonzi.BackendRouter([broken, spare])
+    backend, reply = route(router)
+    assert backend is spare
+    assert broken.errors == 1 and router.failovers == 1
+
+def test_streamed_text_reaches_the_sink_once():
+    backend = FakeBackend("stream", expected_ms=100)
+    router = fixed_bonzi.BackendRouter([backend])
+    pieces = []
+    route(router, make_sink=lambda: pieces.append)
+    assert "".join(pieces) == '{"dialogue": "stream"}'
+    assert len(backend.latencies) == 1
+
+@pytest.fixture(scope="module")
+def app():
+    return QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+
+@pytest.fixture
+def bonzi(app, monkeypatch, tmp_path):
+    monkeypatch.setitem(fixed_bonzi.CONFIG, "use_system_tts", False)
+    monkeypatch.setattr(fixed_bonzi, "RESPONSE_CACHE", fixed_bonzi.ResponseCache(str(tmp_path / "cache")))
+    monkeypatch.setattr(fixed_bonzi, "SEMANTIC_CACHE", None)
+    monkeypatch.setattr(fixed_bonzi, "BACKEND_ROUTER", fixed_bonzi.BackendRouter([fixed_bonzi.OfflineBackend("offline")]))
+    bonzi = fixed_bonzi.BonziBuddy()
+    bonzi.show_chat_dialog()
+    yield bonzi
+    bonzi.chat_dialog.close()
+    bonzi.close()
+
+def test_cached_answer_is_given_with_every_backend_down(bonzi):
+    question = "Who painted the Mona Lisa?"
+    params = bonzi.message_params(bonzi.message_window(question))
+    bonzi.cache_reply(question, params, "Da Vinci, obviously.", ["glasses"])
+    assert not fixed_bonzi.BACKEND_ROUTER.available()
+    bonzi.process_user_input(question, bonzi.chat_dialog)
+    assert "Da Vinci, obviously." in bonzi.chat_dialog.chatHistory.toPlainText()
+    assert [message["content"] for message in bonzi.conversation.messages] == [question, "Da Vinci, obviously."]
+
+if __name__ == "__main__":
+    sys.exit(pytest.main(["-q", __file__]))
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Tests for SemanticCache matching
+
+Near-miss questions that differ only in a number or a negation must never
+share an answer, and neither may questions asked after different earlier
+conversations. Real paraphrases still hit.
+
+Usage:
+    python3 -m pytest -q test_semantic_cache.py
+"""
+
+import os
+import sys
+
+import pytest
+
+# Run from the BonziBuddy directory so config.yaml is found
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fixed_bonzi
+
+pytestmark = pytest.mark.skipif(not fixed_bonzi.NUMPY_AVAILABLE, reason="numpy not installed")
+
+NEAR_MISSES = [
+    ("Who won the 2018 world cup?", "Who won the 2022 world cup?"),
+    ("Should I use 2 eggs?", "Should I use 3 eggs?"),
+    ("What happened in 1945?", "What happened in 1946?"),
+    ("Is it worth driving 5 miles?", "Is it worth driving 50 miles?"),
+    ("Should I buy a new laptop?", "Should I not buy a new laptop?"),
+    ("Should I buy a new laptop?", "Shouldn't I buy a new laptop?"),
+    ("Should I use two eggs?", "Should I use three eggs?"),
+]
+PARAPHRASES = [
+    ("Tell me a joke", "Can you tell me a joke please?"),
+    ("What's the capital of France?", "what is the capital of france"),
+    ("Who won the 2018 world cup?", "hey bonzi, who won the 2018 world cup"),
+]
+
+def params(question, history=()):
+    messages = [{"role": "user" if i % 2 == 0 else "assistant", "content": text}
+                for i, text in enumerate(history)]
+    messages.append({"role": "user", "content": question})
+    return {"model": "test-model", "temperature": 0.5, "system": "system prompt", "messages": messages}
+
+@pytest.fixture
+def cache(tmp_path):
+    return fixed_bonzi.SemanticCache(str(tmp_path / "semantic_cache.jsonl"))
+
+@pytest.mark.parametrize("stored, asked", NEAR_MISSES)
+def test_near_misses_do_not_hit(cache, stored, asked):
+    cache.put(stored, params(stored), "stored answer", [])
+    assert cache.get(asked, params(asked)) is None
+
+@pytest.mark.parametrize("stored, asked", PARAPHRASES)
+def test_paraphrases_hit(cache, stored, asked):
+    cache.put(stored, params(stored), "stored answer", ["wave"])
+    assert cache.get(asked, params(asked)) == ("stored answer", ["wave"])
+
+def test_near_miss_does_not_hide_a_real_match(cache):
+    cache.put("Who won the 2018 world cup?", params("Who won the 2018 world cup?"), "France", [])
+    cache.put("Who won the 2022 world cup?", params("Who won the 2022 world cup?"), "Argentina", [])
+    asked = "who won the 2022 world cup please"
+    assert cache.get(asked, params(asked)) == ("Argentina", [])
+
+def test_follow_up_needs_the_same_conversation(cache):
+    question = "What about him?"
+    cache.put(question, params(question, ["Who wrote Hamlet?", "Shakespeare."]), "He wrote 39 plays.", [])
+    assert cache.get(question, params(question, ["Who painted the Mona Lisa?", "Da Vinci."])) is None
+    assert cache.get(question, params(question)) is None
+    assert cache.get(question, params(question, ["Who wrote Hamlet?", "Shakespeare."])) is not None
+
+def test_summary_is_part_of_the_context(cache):
+    question = "What about him?"
+    stored = params(question)
+    stored["system"] = [{"type": "text", "text": "system prompt"},
+                        {"type": "text", "text": "Summary of the conversation so far: Hamlet."}]
+    cache.put(question, stored, "He wrote 39 plays.", [])
+    assert cache.get(question, params(question)) is None
+
+if __name__ == "__main__":
+    sys.exit(pytest.main(["-q", __file__]))
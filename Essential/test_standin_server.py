@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Tests for standin_server.py
+
+A client that hangs up partway through a streamed reply is counted and
+its connection closed quietly, without a traceback from the server.
+
+Usage:
+    python3 -m pytest -q test_standin_server.py
+"""
+
+import json
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import standin_server
+
+@pytest.fixture
+def server():
+    options = standin_server.build_parser().parse_args(["--latency", "fixed:0", "--token-ms", "20"])
+    options.error_status = [529]
+    server = standin_server.make_server(options, port=0)
+    server.errors = []
+    server.handle_error = lambda request, client_address: server.errors.append(sys.exc_info()[1])
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def post(server, path, payload):
+    body = json.dumps(payload).encode("utf-8")
+    client = socket.create_connection(server.server_address)
+    client.sendall(f"POST {path} HTTP/1.1\r\nHost: standin\r\nContent-Type: application/json\r\n"
+                   f"Content-Length: {len(body)}\r\n\r\n".encode("ascii") + body)
+    return client
+
+def hang_up(client):
+    """Close with a reset, as a cancelled request does"""
+    client.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+    client.close()
+
+@pytest.mark.parametrize("path", ["/v1/messages", "/v1/chat/completions"])
+def test_cancelled_stream_closes_quietly(server, path):
+    client = post(server, path, {"model": "standin", "stream": True, "messages": [{"role": "user", "content": "hi"}]})
+    assert client.recv(64).startswith(b"HTTP/1.1 200")
+    hang_up(client)
+    deadline = time.monotonic() + 3
+    while not server.stats.snapshot().get("client_disconnects") and time.monotonic() < deadline:
+        time.sleep(0.02)
+    assert server.stats.snapshot().get("client_disconnects") == 1
+    assert server.errors == []
+
+def test_later_requests_still_work(server):
+    hang_up(post(server, "/v1/messages", {"stream": True, "messages": []}))
+    client = post(server, "/v1/messages", {"messages": [{"role": "user", "content": "hi"}]})
+    reply = b""
+    while b'"end_turn"' not in reply:
+        reply += client.recv(4096)
+    client.close()
+    assert reply.startswith(b"HTTP/1.1 200")
+
+if __name__ == "__main__":
+    sys.exit(pytest.main(["-q", __file__]))
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Tests for how turns reach BonziBuddy's state
+
+The loop thread only posts results through ChatBridge; the conversation
+history and the counters change on the GUI thread, and an exchange
+belonging to a cancelled or superseded turn never enters the history.
+
+Usage:
+    python3 -m pytest -q test_turns.py
+"""
+
+import os
+import sys
+import threading
+
+import pytest
+
+# Run from the BonziBuddy directory so config.yaml is found
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fixed_bonzi
+from PyQt5 import QtWidgets
+
+@pytest.fixture(scope="module")
+def app():
+    return QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+
+@pytest.fixture
+def bonzi(app, monkeypatch):
+    monkeypatch.setitem(fixed_bonzi.CONFIG, "use_system_tts", False)
+    bonzi = fixed_bonzi.BonziBuddy()
+    yield bonzi
+    bonzi.close()
+
+def from_loop_thread(emit):
+    """Emit from another thread, as the asyncio loop does"""
+    thread = threading.Thread(target=emit)
+    thread.start()
+    thread.join()
+
+def contents(bonzi):
+    return [message["content"] for message in bonzi.conversation.messages]
+
+def test_exchange_is_recorded_on_the_gui_thread(app, bonzi, monkeypatch):
+    threads = []
+    add_exchange = bonzi.conversation.add_exchange
+
+    def watched(*args, **kwargs):
+        threads.append(threading.current_thread())
+        return add_exchange(*args, **kwargs)
+
+    monkeypatch.setattr(bonzi.conversation, "add_exchange", watched)
+    bonzi.turn_id = 1
+    from_loop_thread(lambda: bonzi.bridge.exchangeFinished.emit(1, "hi", "what now?"))
+    assert contents(bonzi) == []
+    app.processEvents()
+    assert contents(bonzi) == ["hi", "what now?"]
+    assert threads == [threading.main_thread()]
+
+def test_superseded_turn_never_enters_the_history(app, bonzi):
+    bonzi.turn_id = 1
+    from_loop_thread(lambda: bonzi.bridge.exchangeFinished.emit(1, "slow question", "late reply"))
+    # New input arrives before the queued exchange is delivered
+    bonzi.turn_id = 2
+    bonzi.record_exchange(2, "what's 2 + 2", "4, genius.")
+    app.processEvents()
+    assert contents(bonzi) == ["what's 2 + 2", "4, genius."]
+
+def test_cancelled_turn_leaves_earlier_exchanges_alone(app, bonzi):
+    bonzi.turn_id = 1
+    bonzi.record_exchange(1, "same words", "first reply")
+    bonzi.turn_id = 2
+    bonzi.cancel_turn("test")  # nothing in flight: a no-op
+    bonzi.turn_id = 3  # what cancel_turn does to a turn in flight
+    from_loop_thread(lambda: bonzi.bridge.exchangeFinished.emit(2, "same words", "cancelled reply"))
+    app.processEvents()
+    assert contents(bonzi) == ["same words", "first reply"]
+
+def test_fold_result_is_applied_on_the_gui_thread(app, bonzi):
+    conversation = bonzi.conversation
+    conversation.budget_tokens = 200
+    for turn in range(10):
+        conversation.add_exchange(f"question {turn} " + "q" * 100, f"reply {turn} " + "r" * 100)
+    assert conversation.take_fold_batch()
+    from_loop_thread(lambda: bonzi.bridge.historyFolded.emit("they asked ten questions"))
+    assert conversation.summary == ""
+    app.processEvents()
+    assert conversation.summary == "they asked ten questions"
+    assert conversation.folding == 0
+
+def test_counters_are_posted_to_the_gui_thread(app, bonzi):
+    counts = {"input_tokens": 10, "cache_read_input_tokens": 0,
+              "cache_creation_input_tokens": 0, "output_tokens": 5}
+
+    def emit():
+        bonzi.bridge.statCounted.emit("hedges_sent")
+        bonzi.bridge.usageRecorded.emit(counts)
+
+    from_loop_thread(emit)
+    assert bonzi.turn_stats["hedges_sent"] == 0
+    app.processEvents()
+    assert bonzi.turn_stats["hedges_sent"] == 1
+    assert bonzi.usage_totals["requests"] == 1
+    assert bonzi.usage_totals["output_tokens"] == 5
+
+if __name__ == "__main__":
+    sys.exit(pytest.main(["-q", __file__]))